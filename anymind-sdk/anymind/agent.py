@@ -1,5 +1,7 @@
+from typing import List, Optional
+
 from .client import AnymindClient
-from .types import ChatResponse
+from .types import ChatResponse, BatchResult
 
 
 class Agent:
@@ -37,3 +39,23 @@ class Agent:
         result: ChatResponse = self.client.post(endpoint, payload)
         return result["content"]
 
+    def chat_batch(self, messages: List[str], concurrency: Optional[int] = None) -> List[BatchResult]:
+        """
+        Sends many messages in one request and returns one result per message,
+        in input order. Messages run concurrently against the chat history as
+        it was when the batch started; a failed message has an "error" key
+        instead of "content".
+        """
+
+        payload = {
+            "items": [
+                {"chat_id": self.chat_id, "message": {"role": "user", "content": message}}
+                for message in messages
+            ],
+        }
+        if concurrency is not None:
+            payload["concurrency"] = concurrency
+
+        endpoint = f"/api/v1/agents/{self.agent_id}/messages/batch"
+        results = [r for r in self.client.post_ndjson(endpoint, payload) if not r.get("done")]
+        return sorted(results, key=lambda r: r["index"])
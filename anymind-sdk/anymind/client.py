@@ -1,3 +1,6 @@
+import json
+from typing import Iterator
+
 import requests
 from .errors import AuthenticationError, AnymindRuntimeError
 
@@ -18,6 +21,27 @@ class AnymindClient:
             timeout=30,
         )
 
+        self._raise_for_status(resp)
+        return resp.json()
+
+    def post_ndjson(self, path: str, payload: dict, read_timeout: float = 300) -> Iterator[dict]:
+        """POST and yield each line of an NDJSON response as it arrives"""
+        with requests.post(
+            f"{self.base_url}{path}",
+            json=payload,
+            headers={
+                "X-Wallet-Address": self.wallet_address,
+                "Content-Type": "application/json",
+            },
+            timeout=(30, read_timeout),
+            stream=True,
+        ) as resp:
+            self._raise_for_status(resp)
+            for line in resp.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def _raise_for_status(self, resp: requests.Response) -> None:
         if resp.status_code == 401:
             raise AuthenticationError("Wallet address required or invalid")
 
@@ -27,5 +51,3 @@ class AnymindClient:
         if resp.status_code != 200:
             raise AnymindRuntimeError(f"API error ({resp.status_code}): {resp.text}")
 
-        return resp.json()
-
@@ -7,3 +7,12 @@ class ChatResponse(TypedDict):
     usage: Optional[Dict[str, Any]]
     metadata: Optional[Dict[str, Any]]
 
+
+
+class BatchResult(TypedDict, total=False):
+    index: int
+    chat_id: str
+    content: str
+    usage: Optional[Dict[str, Any]]
+    error: str
+    retry_after: int
@@ -1,16 +1,28 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import StreamingResponse
 from typing import Optional, List, Dict, Any
 from app.models.schemas import (
     Chat, ChatCreate, ChatUpdate, Message, MessageCreate,
-    Agent, AgentCreate, AgentUpdate, LLMResponse, CapsuleCreate, StakingCreate
+    Agent, AgentCreate, AgentUpdate, LLMResponse, CapsuleCreate, StakingCreate,
+    ResponseCachePolicy, BatchMessageRequest
 )
 from app.services.agent_service import AgentService
 from app.services.llm_service import LLMService
+from app.services.batch_service import BatchService
 from app.services.capsule_service import CapsuleService
 from app.services.wallet_service import WalletService
+from app.services.cache_service import cache_service
+from app.services.prefetch_service import prefetch_service
+from app.services.response_cache_service import response_cache
+from app.services.streaming import coalesce_chunks, sse_event
+from app.services.stream_checkpoint_service import stream_checkpoint_service, LiveStream, COMPLETED, FAILED
+from app.services.rate_limiter import ProviderBusyError
 from app.core.auth_dependencies import get_wallet_address
+from app.core.config import settings
+from contextlib import aclosing
 from datetime import datetime
+import anyio
+import asyncio
 import logging
 import json
 
@@ -19,6 +31,15 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def _provider_busy(error: ProviderBusyError) -> HTTPException:
+    """503 telling the client when to retry"""
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
 @router.get("/", response_model=List[Agent])
 async def list_agents(wallet_address: Optional[str] = Depends(get_wallet_address)):
     """List all agents for a user"""
@@ -49,7 +70,9 @@ async def update_agent(
     service = AgentService()
     
     try:
-        return await service.update_agent(agent_id, agent_update, wallet_address)
+        agent = await service.update_agent(agent_id, agent_update, wallet_address)
+        prefetch_service.invalidate_agent(agent_id)
+        return agent
     except Exception as e:
         # logger.error(f"Error updating agent {agent_id}: {e}")
         raise HTTPException(status_code=404, detail=str(e))
@@ -68,12 +91,68 @@ async def delete_agent(
     
     try:
         await service.delete_agent(agent_id, wallet_address)
+        prefetch_service.invalidate_agent(agent_id)
         return {"success": True, "message": "Agent deleted successfully"}
     except Exception as e:
         # logger.error(f"Error deleting agent {agent_id}: {e}")
         raise HTTPException(status_code=404, detail=str(e))
 
 
+@router.get("/{agent_id}/response-cache", response_model=ResponseCachePolicy)
+async def get_response_cache_policy(
+    agent_id: str,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """Get the response cache policy for an agent"""
+    if not wallet_address:
+        raise HTTPException(status_code=401, detail="Wallet address required")
+
+    service = AgentService()
+    agent = await service.get_agent(agent_id, wallet_address)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found or unauthorized")
+
+    policy = await asyncio.to_thread(cache_service.get_agent_response_cache_policy, agent_id) or {}
+    return ResponseCachePolicy(**policy)
+
+
+@router.put("/{agent_id}/response-cache", response_model=ResponseCachePolicy)
+async def update_response_cache_policy(
+    agent_id: str,
+    policy: ResponseCachePolicy,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """Opt an agent in/out of the response cache and set its TTL"""
+    if not wallet_address:
+        raise HTTPException(status_code=401, detail="Wallet address required")
+    
+    service = AgentService()
+    agent = await service.get_agent(agent_id, wallet_address)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found or unauthorized")
+    
+    await asyncio.to_thread(cache_service.set_agent_response_cache_policy, agent_id, policy.model_dump())
+    response_cache.invalidate_policy(agent_id)
+    return policy
+
+
+@router.get("/{agent_id}/usage")
+async def get_agent_usage(
+    agent_id: str,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """Get aggregated token usage for an agent (all chats)"""
+    if not wallet_address:
+        raise HTTPException(status_code=401, detail="Wallet address required")
+    
+    service = AgentService()
+    agent = await service.get_agent(agent_id, wallet_address)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found or unauthorized")
+    
+    return {"agent_id": agent_id, "usage": await asyncio.to_thread(cache_service.get_agent_usage, agent_id)}
+
+
 @router.get("/{agent_id}/chats", response_model=List[Chat])
 async def list_chats(agent_id: str, wallet_address: Optional[str] = Depends(get_wallet_address)):
     """List all chats for an agent"""
@@ -104,6 +183,9 @@ async def get_chat(agent_id: str, chat_id: str, wallet_address: Optional[str] =
     chat = await service.get_chat(chat_id, wallet_address)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
+    
+    # Opt-in: warm agent config and memories before the user sends a message
+    prefetch_service.schedule(chat, agent_id, wallet_address)
     return chat
 
 
@@ -146,11 +228,20 @@ async def send_message(
     # if actual_agent_id != agent_id:
     #     logger.info(f"Using chat's agent_id ({actual_agent_id}) instead of URL agent_id ({agent_id})")
     
-    # Get agent config (with API key for internal use)
-    agent = await service.get_agent(actual_agent_id, wallet_address)
+    # Get agent config (with API key for internal use), pre-resolved if the chat was prefetched
+    agent = (
+        prefetch_service.get_agent(chat_id, actual_agent_id, wallet_address)
+        or await service.get_agent(actual_agent_id, wallet_address)
+    )
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agent not found (agent_id: {actual_agent_id})")
     
+    # Fail fast with 503 when the provider queue is full
+    try:
+        llm_service.check_capacity(actual_agent_id, agent, getattr(chat, 'capsule_id', None))
+    except ProviderBusyError as e:
+        raise _provider_busy(e)
+    
     # Save user message first
     user_msg = await service.add_message(chat_id, message, wallet_address)
     
@@ -175,7 +266,8 @@ async def send_message(
             chat_id=chat_id,  # Pass chat_id for memory retrieval
             memory_size=memory_size,  # Pass memory_size setting
             capsule_id=capsule_id,  # Pass capsule_id for memory scope isolation
-            web_search_enabled=web_search_enabled  # Pass web_search_enabled flag
+            web_search_enabled=web_search_enabled,  # Pass web_search_enabled flag
+            bypass_cache=message.bypass_cache  # Skip response cache lookup if requested
         )
         
         # Save assistant message
@@ -183,6 +275,8 @@ async def send_message(
         await service.add_message(chat_id, assistant_msg, wallet_address)
         
         return response
+    except ProviderBusyError as e:
+        raise _provider_busy(e)
     except Exception as e:
         # Log error but don't remove user message (user can see it failed)
         # logger.error(f"Error getting LLM response: {e}", exc_info=True)
@@ -194,6 +288,7 @@ async def send_message_stream(
     agent_id: str,
     chat_id: str,
     message: MessageCreate,
+    request: Request,
     wallet_address: Optional[str] = Depends(get_wallet_address)
 ):
     """Send a message to an agent and get streaming response (Server-Sent Events)"""
@@ -215,11 +310,20 @@ async def send_message_stream(
     # if actual_agent_id != agent_id:
     #     logger.info(f"Using chat's agent_id ({actual_agent_id}) instead of URL agent_id ({agent_id})")
     
-    # Get agent config (with API key for internal use)
-    agent = await service.get_agent(actual_agent_id, wallet_address)
+    # Get agent config (with API key for internal use), pre-resolved if the chat was prefetched
+    agent = (
+        prefetch_service.get_agent(chat_id, actual_agent_id, wallet_address)
+        or await service.get_agent(actual_agent_id, wallet_address)
+    )
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agent not found (agent_id: {actual_agent_id})")
     
+    # Fail fast with 503 when the provider queue is full
+    try:
+        llm_service.check_capacity(actual_agent_id, agent, getattr(chat, 'capsule_id', None))
+    except ProviderBusyError as e:
+        raise _provider_busy(e)
+    
     # Save user message first
     user_msg = await service.add_message(chat_id, message, wallet_address)
     
@@ -232,36 +336,146 @@ async def send_message_stream(
     capsule_id = chat.capsule_id if hasattr(chat, 'capsule_id') else None
     web_search_enabled = getattr(chat, 'web_search_enabled', False)
     
-    async def generate_stream():
-        full_content = ""
+    async def produce(stream: LiveStream):
+        # Runs in the background so a reconnecting client can resume it;
+        # coalesce small provider chunks into fewer SSE frames
+        completed = False
+        usage = {}
+        frames = coalesce_chunks(llm_service.get_completion_stream(
+            agent_id=actual_agent_id,
+            messages=messages_history,
+            agent_config=agent,
+            chat_id=chat_id,
+            memory_size=memory_size,
+            capsule_id=capsule_id,
+            web_search_enabled=web_search_enabled,
+            bypass_cache=message.bypass_cache,
+            usage=usage
+        ))
         try:
-            async for chunk in llm_service.get_completion_stream(
-                agent_id=actual_agent_id,
-                messages=messages_history,
-                agent_config=agent,
-                chat_id=chat_id,
-                memory_size=memory_size,
-                capsule_id=capsule_id,
-                web_search_enabled=web_search_enabled
-            ):
-                full_content += chunk
-                # Send chunk as SSE
-                yield f"data: {json.dumps({'content': chunk})}\n\n"
+            async for chunk in frames:
+                stream.append(chunk)
+            completed = True
             
             # Save assistant message after streaming completes
+            full_content = stream.content
             if full_content:
                 assistant_msg = MessageCreate(role="assistant", content=full_content)
                 await service.add_message(chat_id, assistant_msg, wallet_address)
-            
-            # Send completion signal
-            yield f"data: {json.dumps({'done': True})}\n\n"
+            await stream.finish(COMPLETED, usage=usage or None)
+        except ProviderBusyError as e:
+            # Queue filled up between the admission check and the provider call
+            await stream.finish(FAILED, error=str(e), retry_after=e.retry_after)
         except Exception as e:
             # logger.error(f"Error in streaming: {e}", exc_info=True)
-            error_data = json.dumps({'error': str(e)})
-            yield f"data: {error_data}\n\n"
+            await stream.finish(FAILED, error=str(e))
+        finally:
+            # Runs on completion, errors, and cancellation once every client
+            # has gone; shielded so cleanup completes inside a cancelled scope
+            with anyio.CancelScope(shield=True):
+                # Closing the chain cancels the upstream provider request
+                await frames.aclose()
+                if not completed and stream.content:
+                    partial_msg = MessageCreate(role="assistant", content=stream.content, interrupted=True)
+                    await service.add_message(chat_id, partial_msg, wallet_address)
+    
+    stream = stream_checkpoint_service.start(chat_id, wallet_address, produce)
+    
+    return StreamingResponse(
+        _follow_stream(request, chat_id, stream.message_id, announce=True, stream=stream),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Disable buffering for nginx
+        }
+    )
+
+
+async def _watch_disconnect(request: Request) -> None:
+    """Return once the client has gone (polled, so a stalled stream still notices)"""
+    interval = max(settings.STREAM_DISCONNECT_POLL_MS, 50) / 1000
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def _follow_stream(
+    request: Request,
+    chat_id: str,
+    message_id: str,
+    offset: int = 0,
+    announce: bool = False,
+    stream: Optional[LiveStream] = None
+):
+    """SSE frames for an answer, from a character offset (first frame names the message)"""
+    if announce:
+        yield sse_event({'message_id': message_id})
+    # Watch for the client going away while waiting on the next frame too, so a
+    # client that drops during a provider stall or a checkpoint poll stops
+    # following right away; the last follower leaving starts the resume grace
+    # period, after which generation (and its provider slot) is cancelled
+    watcher = asyncio.ensure_future(_watch_disconnect(request))
+    async with aclosing(stream_checkpoint_service.follow(message_id, offset, stream=stream)) as frames:
+        next_frame: Optional[asyncio.Future] = None
+        try:
+            while True:
+                next_frame = asyncio.ensure_future(frames.__anext__())
+                await asyncio.wait([next_frame, watcher], return_when=asyncio.FIRST_COMPLETED)
+                if not next_frame.done():
+                    logger.info(f"Client disconnected from chat {chat_id} stream")
+                    break
+                try:
+                    frame = next_frame.result()
+                except StopAsyncIteration:
+                    break
+                yield sse_event(frame)
+        finally:
+            watcher.cancel()
+            if next_frame is not None and not next_frame.done():
+                # Cancelling the pending read unsubscribes the follower
+                next_frame.cancel()
+                await asyncio.wait([next_frame])
+
+
+@router.get("/{agent_id}/chats/{chat_id}/messages/{message_id}/partial")
+async def get_partial_message(
+    agent_id: str,
+    chat_id: str,
+    message_id: str,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """
+    Get the content generated so far for a streamed answer
+    status is streaming, completed, interrupted, error, or stale (the worker
+    generating it stopped checkpointing, e.g. it crashed)
+    """
+    if not wallet_address:
+        raise HTTPException(status_code=401, detail="Wallet address required")
+    checkpoint = stream_checkpoint_service.get_checkpoint(message_id, chat_id, wallet_address)
+    if not checkpoint:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {k: v for k, v in checkpoint.items() if k != "wallet_address"}
+
+
+@router.get("/{agent_id}/chats/{chat_id}/messages/{message_id}/stream")
+async def resume_message_stream(
+    agent_id: str,
+    chat_id: str,
+    message_id: str,
+    request: Request,
+    offset: int = 0,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """
+    Resume a streamed answer by message ID (Server-Sent Events)
+    Sends the content after `offset` characters, then follows the live stream.
+    """
+    if not wallet_address:
+        raise HTTPException(status_code=401, detail="Wallet address required")
+    if not stream_checkpoint_service.get_checkpoint(message_id, chat_id, wallet_address):
+        raise HTTPException(status_code=404, detail="Message not found")
     
     return StreamingResponse(
-        generate_stream(),
+        _follow_stream(request, chat_id, message_id, offset=max(0, offset)),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -270,6 +484,41 @@ async def send_message_stream(
     )
 
 
+@router.post("/{agent_id}/messages/batch")
+async def send_message_batch(
+    agent_id: str,
+    batch: BatchMessageRequest,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """
+    Send many messages in one request (evaluation / backfill jobs)
+    Items run with bounded concurrency; results stream back as NDJSON
+    in completion order, one line per item, then a final done line.
+    """
+    if not wallet_address:
+        raise HTTPException(status_code=401, detail="Wallet address required")
+    if len(batch.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large ({len(batch.items)} items, max {settings.BATCH_MAX_ITEMS})"
+        )
+    
+    batch_service = BatchService()
+    
+    async def generate_results():
+        async for result in batch_service.run(agent_id, batch.items, wallet_address, batch.concurrency):
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(
+        generate_results(),
+        media_type="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Disable buffering for nginx
+        }
+    )
+
+
 @router.get("/{agent_id}/chats/{chat_id}/messages", response_model=List[Message])
 async def get_messages(
     agent_id: str,
@@ -284,18 +533,29 @@ async def get_messages(
     return chat.messages
 
 
-@router.get("/{agent_id}/chats/{chat_id}/memories")
-async def get_chat_memories(
+@router.get("/{agent_id}/chats/{chat_id}/usage")
+async def get_chat_usage(
     agent_id: str,
     chat_id: str,
     wallet_address: Optional[str] = Depends(get_wallet_address)
 ):
-    """Get all stored memories for a chat (for verification/tracking)"""
+    """Get aggregated token usage for a chat"""
+    if not wallet_address:
+        raise HTTPException(status_code=401, detail="Wallet address required")
+    
+    service = AgentService()
+    chat = await service.get_chat(chat_id, wallet_address)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return {"chat_id": chat_id, "usage": await asyncio.to_thread(cache_service.get_chat_usage, chat_id)}
+
+
+async def _memory_scope(agent_id: str, chat_id: str, wallet_address: Optional[str]) -> tuple:
+    """(agent_id, capsule_id) whose memories the wallet may read for a chat"""
     if not wallet_address:
         raise HTTPException(status_code=401, detail="Wallet address required")
     
     service = AgentService()
-    llm_service = LLMService()
     
     # Verify chat exists and belongs to user
     chat = await service.get_chat(chat_id, wallet_address)
@@ -308,27 +568,95 @@ async def get_chat_memories(
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
     
-    # Get all memories for this chat
-    from app.services.memory_service import MemoryService
-    memory_service = MemoryService()
     # Get capsule_id from chat for memory filtering
     capsule_id = chat.capsule_id if hasattr(chat, 'capsule_id') else None
-    memories = memory_service.get_all_chat_memories(actual_agent_id, chat_id, capsule_id)
+    return actual_agent_id, capsule_id
+
+
+@router.get("/{agent_id}/chats/{chat_id}/memories")
+async def get_chat_memories(
+    agent_id: str,
+    chat_id: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """
+    Get one page of the memories stored for a chat (for verification/tracking)
+    
+    memory_count is the exact total; pass next_cursor back as `cursor` for the next page.
+    """
+    actual_agent_id, capsule_id = await _memory_scope(agent_id, chat_id, wallet_address)
+    
+    from app.services.memory_service import MemoryService
+    memory_service = MemoryService()
+    try:
+        # Memory reads are blocking; keep them off the event loop
+        page = await anyio.to_thread.run_sync(
+            lambda: memory_service.list_chat_memories(actual_agent_id, chat_id, capsule_id, cursor=cursor, limit=limit)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return {
         "chat_id": chat_id,
         "agent_id": actual_agent_id,
-        "memory_count": len(memories),
-        "memories": memories,
+        "memory_count": page["total"],
+        "memories": page["memories"],
+        "next_cursor": page["next_cursor"],
         "using_platform": memory_service.use_platform
     }
 
 
+@router.get("/{agent_id}/chats/{chat_id}/memories/export")
+async def export_chat_memories(
+    agent_id: str,
+    chat_id: str,
+    wallet_address: Optional[str] = Depends(get_wallet_address)
+):
+    """
+    Stream every memory of a chat as NDJSON (one memory per line)
+    
+    Memories are read a page at a time, so large chats are never held in
+    memory; the exact count is sent up front in X-Memory-Count.
+    """
+    actual_agent_id, capsule_id = await _memory_scope(agent_id, chat_id, wallet_address)
+    
+    from app.services.memory_service import MemoryService
+    memory_service = MemoryService()
+    
+    def read_page(cursor: Optional[str]) -> dict:
+        return memory_service.list_chat_memories(
+            actual_agent_id, chat_id, capsule_id, cursor=cursor, limit=settings.MEMORY_PAGE_MAX_SIZE
+        )
+    
+    first_page = await anyio.to_thread.run_sync(read_page, None)
+    
+    async def lines():
+        page = first_page
+        while True:
+            if page["memories"]:
+                yield "".join(json.dumps(memory, default=str) + "\n" for memory in page["memories"])
+            if not page["next_cursor"]:
+                return
+            page = await anyio.to_thread.run_sync(read_page, page["next_cursor"])
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={
+            "X-Memory-Count": str(first_page["total"]),
+            "Content-Disposition": f'attachment; filename="memories-{chat_id}.ndjson"'
+        }
+    )
+
+
 @router.delete("/{agent_id}/chats/{chat_id}")
 async def delete_chat(agent_id: str, chat_id: str, wallet_address: Optional[str] = Depends(get_wallet_address)):
     """Delete a chat"""
     service = AgentService()
     await service.delete_chat(chat_id, wallet_address)
+    prefetch_service.invalidate(chat_id)
     return {"success": True, "message": "Chat deleted"}
 
 
@@ -99,10 +99,142 @@ class Settings(BaseSettings):
     # LLM API Keys
     OPENROUTER_API_KEY: str = os.getenv("OPENROUTER_API_KEY", "")
     CEREBRAS_API_KEY: str = os.getenv("CEREBRAS_API_KEY", "")
+    # Provider endpoints (override to point at a local mock, see benchmarks/mock_provider.py)
+    OPENROUTER_BASE_URL: str = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    CEREBRAS_BASE_URL: str = os.getenv("CEREBRAS_BASE_URL", "https://api.cerebras.ai/v1")
+    
+    # Context window (prompt token budget for provider requests)
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+    CONTEXT_MEMORY_RESERVE_TOKENS: int = int(os.getenv("CONTEXT_MEMORY_RESERVE_TOKENS", "600"))
+    CONTEXT_WEB_SEARCH_RESERVE_TOKENS: int = int(os.getenv("CONTEXT_WEB_SEARCH_RESERVE_TOKENS", "1500"))
+    
+    # Rolling chat summaries (refreshed in the background every N turns)
+    SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "True").lower() == "true"
+    SUMMARY_REFRESH_EVERY_TURNS: int = int(os.getenv("SUMMARY_REFRESH_EVERY_TURNS", "4"))
+    SUMMARY_KEEP_RECENT_MESSAGES: int = int(os.getenv("SUMMARY_KEEP_RECENT_MESSAGES", "8"))
+    SUMMARY_MAX_WORDS: int = int(os.getenv("SUMMARY_MAX_WORDS", "200"))
+    
+    # Response cache (opt-in per agent; this is the default for agents without a policy)
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "False").lower() == "true"
+    RESPONSE_CACHE_TTL_SECONDS: int = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+    RESPONSE_CACHE_SEMANTIC_ENABLED: bool = os.getenv("RESPONSE_CACHE_SEMANTIC_ENABLED", "False").lower() == "true"
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD: float = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+    RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES", "500"))
+    
+    # Embeddings (OpenAI-compatible /embeddings endpoint)
+    EMBEDDING_API_BASE: str = os.getenv("EMBEDDING_API_BASE", "https://api.openai.com/v1")
+    EMBEDDING_API_KEY: str = os.getenv("EMBEDDING_API_KEY") or os.getenv("OPENAI_API_KEY", "")
+    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    
+    # Embedding cache by content hash, namespaced by model (memory LRU + memory-mapped disk tier)
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "./.embedding_cache")
+    EMBEDDING_CACHE_MEMORY_ENTRIES: int = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+    # Vectors kept on disk per model (0 disables the disk tier)
+    EMBEDDING_CACHE_DISK_ENTRIES: int = int(os.getenv("EMBEDDING_CACHE_DISK_ENTRIES", "100000"))
+    
+    # Speculative memory prefetch when a chat is opened (per-process, short-lived)
+    MEMORY_PREFETCH_ENABLED: bool = os.getenv("MEMORY_PREFETCH_ENABLED", "False").lower() == "true"
+    MEMORY_PREFETCH_TTL_SECONDS: int = int(os.getenv("MEMORY_PREFETCH_TTL_SECONDS", "60"))
+    # With prefetched memories available, wait at most this long for the query-specific search
+    MEMORY_SEARCH_DEADLINE_MS: int = int(os.getenv("MEMORY_SEARCH_DEADLINE_MS", "250"))
+    
+    # Memory search result cache (shared via CacheService; invalidated when a chat's memories change)
+    MEMORY_SEARCH_CACHE_ENABLED: bool = os.getenv("MEMORY_SEARCH_CACHE_ENABLED", "True").lower() == "true"
+    MEMORY_SEARCH_CACHE_TTL_SECONDS: int = int(os.getenv("MEMORY_SEARCH_CACHE_TTL_SECONDS", "120"))
+    
+    # Hybrid memory retrieval: vector and BM25 rankings fused by reciprocal rank
+    MEMORY_RRF_K: int = int(os.getenv("MEMORY_RRF_K", "60"))
+    # Vector matches below this cosine similarity are ignored (unless they also match lexically)
+    MEMORY_MIN_SIMILARITY: float = float(os.getenv("MEMORY_MIN_SIMILARITY", "0.2"))
+    # Fraction of the best fused score a memory needs to reach the prompt (fused scores are rank-based)
+    MEMORY_MIN_SCORE: float = float(os.getenv("MEMORY_MIN_SCORE", "0.3"))
+    # mem0 backends: vector candidates fetched per memory wanted, for BM25 reranking
+    MEMORY_HYBRID_OVERSAMPLE: int = int(os.getenv("MEMORY_HYBRID_OVERSAMPLE", "3"))
+    
+    # Memory listing/export pages (GET .../memories and .../memories/export)
+    MEMORY_PAGE_SIZE: int = int(os.getenv("MEMORY_PAGE_SIZE", "100"))
+    MEMORY_PAGE_MAX_SIZE: int = int(os.getenv("MEMORY_PAGE_MAX_SIZE", "1000"))
+    
+    # Web search result cache (shared via CacheService)
+    WEB_SEARCH_CACHE_ENABLED: bool = os.getenv("WEB_SEARCH_CACHE_ENABLED", "True").lower() == "true"
+    WEB_SEARCH_CACHE_TTL_SECONDS: int = int(os.getenv("WEB_SEARCH_CACHE_TTL_SECONDS", "900"))
+    # Size cap for the in-memory fallback (Redis entries are bounded by their TTL)
+    WEB_SEARCH_CACHE_MAX_ENTRIES: int = int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "1000"))
+    
+    # Web search client (results are trimmed to CONTEXT_WEB_SEARCH_RESERVE_TOKENS)
+    TAVILY_BASE_URL: str = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+    WEB_SEARCH_TIMEOUT_SECONDS: float = float(os.getenv("WEB_SEARCH_TIMEOUT_SECONDS", "4"))
+    WEB_SEARCH_SNIPPET_CHARS: int = int(os.getenv("WEB_SEARCH_SNIPPET_CHARS", "600"))
+    
+    # Provider routing (failover / hedging between equivalent OpenRouter and Cerebras models)
+    PROVIDER_FAILOVER_ENABLED: bool = os.getenv("PROVIDER_FAILOVER_ENABLED", "True").lower() == "true"
+    PROVIDER_HEDGING_ENABLED: bool = os.getenv("PROVIDER_HEDGING_ENABLED", "False").lower() == "true"
+    PROVIDER_HEDGE_MIN_DELAY_MS: int = int(os.getenv("PROVIDER_HEDGE_MIN_DELAY_MS", "300"))
+    PROVIDER_HEDGE_DEFAULT_DELAY_MS: int = int(os.getenv("PROVIDER_HEDGE_DEFAULT_DELAY_MS", "2000"))
+    PROVIDER_STATS_WINDOW: int = int(os.getenv("PROVIDER_STATS_WINDOW", "100"))
+    PROVIDER_ERROR_RATE_THRESHOLD: float = float(os.getenv("PROVIDER_ERROR_RATE_THRESHOLD", "0.5"))
+    # JSON object mapping OpenRouter model -> equivalent Cerebras model (added to the built-in map)
+    PROVIDER_MODEL_EQUIVALENTS: str = os.getenv("PROVIDER_MODEL_EQUIVALENTS", "")
+    # Retries after failover is exhausted (exponential backoff with jitter, honours Retry-After)
+    PROVIDER_RETRY_MAX_ATTEMPTS: int = int(os.getenv("PROVIDER_RETRY_MAX_ATTEMPTS", "2"))
+    PROVIDER_RETRY_BASE_DELAY_MS: int = int(os.getenv("PROVIDER_RETRY_BASE_DELAY_MS", "250"))
+    PROVIDER_RETRY_MAX_DELAY_MS: int = int(os.getenv("PROVIDER_RETRY_MAX_DELAY_MS", "4000"))
+    # Resume a stream that fails mid-answer, sending the partial answer as an assistant prefix
+    PROVIDER_STREAM_RESUME_ENABLED: bool = os.getenv("PROVIDER_STREAM_RESUME_ENABLED", "True").lower() == "true"
+    
+    # Provider rate limiting (0 = unlimited); applied per provider and per API key
+    OPENROUTER_MAX_CONCURRENCY: int = int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "32"))
+    OPENROUTER_TOKENS_PER_MINUTE: int = int(os.getenv("OPENROUTER_TOKENS_PER_MINUTE", "0"))
+    CEREBRAS_MAX_CONCURRENCY: int = int(os.getenv("CEREBRAS_MAX_CONCURRENCY", "16"))
+    CEREBRAS_TOKENS_PER_MINUTE: int = int(os.getenv("CEREBRAS_TOKENS_PER_MINUTE", "60000"))
+    PROVIDER_KEY_MAX_CONCURRENCY: int = int(os.getenv("PROVIDER_KEY_MAX_CONCURRENCY", "8"))
+    PROVIDER_KEY_TOKENS_PER_MINUTE: int = int(os.getenv("PROVIDER_KEY_TOKENS_PER_MINUTE", "0"))
+    # Requests allowed to wait for a slot; beyond this callers get a 503 with Retry-After
+    PROVIDER_QUEUE_MAX_SIZE: int = int(os.getenv("PROVIDER_QUEUE_MAX_SIZE", "64"))
+    PROVIDER_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv("PROVIDER_QUEUE_TIMEOUT_SECONDS", "20"))
+    
+    # Batch completions (POST /agents/{id}/messages/batch)
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+    BATCH_MAX_CONCURRENCY: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+    
+    # SSE frame coalescing (0 disables the corresponding limit; both 0 = one frame per chunk)
+    SSE_FLUSH_INTERVAL_MS: int = int(os.getenv("SSE_FLUSH_INTERVAL_MS", "30"))
+    SSE_FLUSH_BYTES: int = int(os.getenv("SSE_FLUSH_BYTES", "256"))
+    
+    # Streaming checkpoints (partial answers saved to CacheService, resumable by message ID)
+    STREAM_CHECKPOINT_ENABLED: bool = os.getenv("STREAM_CHECKPOINT_ENABLED", "True").lower() == "true"
+    STREAM_CHECKPOINT_TOKENS: int = int(os.getenv("STREAM_CHECKPOINT_TOKENS", "50"))
+    STREAM_CHECKPOINT_INTERVAL_MS: int = int(os.getenv("STREAM_CHECKPOINT_INTERVAL_MS", "1000"))
+    STREAM_CHECKPOINT_TTL_SECONDS: int = int(os.getenv("STREAM_CHECKPOINT_TTL_SECONDS", "3600"))
+    # A checkpoint not updated for this long belongs to a dead worker
+    STREAM_CHECKPOINT_STALE_SECONDS: int = int(os.getenv("STREAM_CHECKPOINT_STALE_SECONDS", "30"))
+    # How long generation keeps running after the last client disconnects, waiting for a resume
+    STREAM_RESUME_GRACE_SECONDS: float = float(os.getenv("STREAM_RESUME_GRACE_SECONDS", "10"))
+    # How often an SSE response checks whether its client is still connected
+    STREAM_DISCONNECT_POLL_MS: int = int(os.getenv("STREAM_DISCONNECT_POLL_MS", "500"))
     
     # Mem0 Platform API Key (for hosted memory service)
     MEM0_API_KEY: str = os.getenv("MEM0_API_KEY", "")
     
+    # Memory backend: "auto" (Mem0 Platform if MEM0_API_KEY is set, else open-source mem0 with
+    # ChromaDB if installed, else the local engine), "mem0" (Platform, then open-source mem0) or "local"
+    MEMORY_BACKEND: str = os.getenv("MEMORY_BACKEND", "auto")
+    # Local memory engine (memory-mapped vectors per agent, fully offline)
+    LOCAL_MEMORY_PATH: str = os.getenv("LOCAL_MEMORY_PATH", "./.memory_store")
+    LOCAL_MEMORY_EMBEDDING_DIM: int = int(os.getenv("LOCAL_MEMORY_EMBEDDING_DIM", "384"))
+    # Use an HNSW index (if hnswlib is installed) once a scope has this many memories
+    LOCAL_MEMORY_HNSW_THRESHOLD: int = int(os.getenv("LOCAL_MEMORY_HNSW_THRESHOLD", "20000"))
+    # Shards (one per agent and capsule) kept open at once; least recently used are closed
+    LOCAL_MEMORY_MAX_OPEN_SHARDS: int = int(os.getenv("LOCAL_MEMORY_MAX_OPEN_SHARDS", "64"))
+    # Rewrite a shard in the background once it has this many deleted rows making up this share of it
+    LOCAL_MEMORY_COMPACTION_MIN_DEAD: int = int(os.getenv("LOCAL_MEMORY_COMPACTION_MIN_DEAD", "100"))
+    LOCAL_MEMORY_COMPACTION_DEAD_RATIO: float = float(os.getenv("LOCAL_MEMORY_COMPACTION_DEAD_RATIO", "0.25"))
+    # Scheduled near-duplicate merging (local engine; 0 disables)
+    MEMORY_COMPACTION_INTERVAL_SECONDS: int = int(os.getenv("MEMORY_COMPACTION_INTERVAL_SECONDS", "600"))
+    # Memories of a chat at least this similar (cosine) are merged, keeping the newest
+    MEMORY_DEDUP_SIMILARITY: float = float(os.getenv("MEMORY_DEDUP_SIMILARITY", "0.92"))
+    
     # Solana
     SOLANA_RPC_URL: str = os.getenv("SOLANA_RPC_URL", "https://api.devnet.solana.com")
     SOLANA_NETWORK: str = os.getenv("SOLANA_NETWORK", "devnet")
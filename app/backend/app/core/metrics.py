@@ -0,0 +1,96 @@
+"""
+Lightweight in-process metrics registry
+
+Collects counters and latency observations from the services so they can be
+exported through the /metrics endpoint without pulling in a metrics backend.
+Values are per-process (each uvicorn worker reports its own numbers).
+"""
+from collections import defaultdict, deque
+from typing import Deque, Dict, Tuple
+import math
+import threading
+
+# Keep a bounded window of observations per series for percentiles
+_MAX_OBSERVATIONS = 1024
+
+
+def _series_key(name: str, labels: Dict[str, str]) -> Tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and rolling observations"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple, float] = defaultdict(float)
+        self._gauges: Dict[Tuple, float] = {}
+        self._observations: Dict[Tuple, Deque[float]] = {}
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """Add value to a counter"""
+        with self._lock:
+            self._counters[_series_key(name, labels)] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Set a gauge to an absolute value"""
+        with self._lock:
+            self._gauges[_series_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record an observation (e.g. a latency in ms)"""
+        key = _series_key(name, labels)
+        with self._lock:
+            window = self._observations.get(key)
+            if window is None:
+                window = deque(maxlen=_MAX_OBSERVATIONS)
+                self._observations[key] = window
+            window.append(value)
+
+    def counter(self, name: str, **labels) -> float:
+        """Read the current value of a counter"""
+        with self._lock:
+            return self._counters.get(_series_key(name, labels), 0.0)
+
+    def snapshot(self) -> dict:
+        """
+        Export all series as a JSON-serializable dict
+        Observations are summarized as count/avg/p50/p95/p99
+        """
+        def fmt(key: Tuple) -> str:
+            name, labels = key
+            if not labels:
+                return name
+            return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+        with self._lock:
+            counters = {fmt(k): v for k, v in self._counters.items()}
+            gauges = {fmt(k): v for k, v in self._gauges.items()}
+            observations = {fmt(k): list(v) for k, v in self._observations.items()}
+
+        summaries = {}
+        for name, values in observations.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            summaries[name] = {
+                "count": len(ordered),
+                "avg": sum(ordered) / len(ordered),
+                "p50": percentile(ordered, 50),
+                "p95": percentile(ordered, 95),
+                "p99": percentile(ordered, 99),
+            }
+
+        return {"counters": counters, "gauges": gauges, "observations": summaries}
+
+
+def percentile(ordered_values, pct: float) -> float:
+    """Nearest-rank percentile over an already sorted sequence"""
+    if not ordered_values:
+        return 0.0
+    index = max(0, min(len(ordered_values) - 1, math.ceil(pct / 100 * len(ordered_values)) - 1))
+    return ordered_values[index]
+
+
+# Global metrics registry instance
+metrics = MetricsRegistry()
@@ -21,11 +21,14 @@ class Message(BaseModel):
     role: MessageRole
     content: str
     timestamp: Optional[datetime] = None
+    interrupted: bool = False  # Assistant reply cut short (e.g. client disconnected)
 
 
 class MessageCreate(BaseModel):
     role: MessageRole
     content: str
+    bypass_cache: bool = False  # Skip the response cache lookup for this message
+    interrupted: bool = False  # Partial assistant reply saved after a disconnect
 
 
 # Chat Models
@@ -82,6 +85,11 @@ class AgentUpdate(BaseModel):
     model: Optional[str] = None
 
 
+class ResponseCachePolicy(BaseModel):
+    enabled: Optional[bool] = None  # None = use the server default (RESPONSE_CACHE_ENABLED)
+    ttl_seconds: Optional[int] = Field(default=None, ge=1)
+
+
 # Capsule Models
 class Capsule(BaseModel):
     id: str
@@ -157,6 +165,16 @@ class LLMResponse(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
 
 
+class BatchMessageItem(BaseModel):
+    chat_id: str
+    message: MessageCreate
+
+
+class BatchMessageRequest(BaseModel):
+    items: List[BatchMessageItem] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(default=None, ge=1)  # Capped at BATCH_MAX_CONCURRENCY
+
+
 # API Response Models
 class APIResponse(BaseModel):
     success: bool
@@ -444,7 +444,8 @@ class AgentService:
             id=message_id,
             role=message.role,
             content=message.content,
-            timestamp=now
+            timestamp=now,
+            interrupted=message.interrupted
         )
         
         msg_dict = {
@@ -452,7 +453,8 @@ class AgentService:
             "chat_id": chat_id,
             "role": msg.role.value,
             "content": msg.content,
-            "timestamp": now.isoformat()
+            "timestamp": now.isoformat(),
+            "interrupted": msg.interrupted
         }
         
         # Save to Redis (primary storage) - ALWAYS save
@@ -546,6 +548,7 @@ class AgentService:
         # Delete from in-memory storage
         AgentService._in_memory_chats.pop(chat_id, None)
         AgentService._in_memory_messages.pop(chat_id, None)
+        cache_service.delete_chat_summary(chat_id)
     
     async def delete_agent(self, agent_id: str, wallet_address: str) -> bool:
         """Delete an agent/LLM configuration and all associated chats"""
@@ -566,6 +569,14 @@ class AgentService:
                 # print(f"⚠️  Error deleting chat {chat.id}: {e}")
                 pass
         
+        # Drop anything left in the agent's memory scope (e.g. chats deleted elsewhere)
+        from app.services.memory_service import MemoryService
+        try:
+            MemoryService().delete_agent_memories(agent_id)
+        except Exception as e:
+            # print(f"⚠️  Error deleting memories for agent {agent_id}: {e}")
+            pass
+        
         # Delete from Supabase
         if self.supabase:
             try:
@@ -0,0 +1,180 @@
+"""
+Batch completions for evaluation and backfill jobs
+
+Fans a list of (chat_id, message) items out through LLMService with bounded
+concurrency and yields one result per item as it completes.
+
+Items that target the same chat share one chat lookup and run against the
+chat history as it was when the batch started; each item gets its own memory
+lookup (shared only by items asking the same thing in the same chat). Each
+item's user/assistant pair is saved to the chat when it completes.
+
+Every item passes the provider rate limiter's admission check before any
+work is done for it, like a single message, and then queues behind
+interactive traffic; a full queue fails just that item with its retry_after.
+"""
+from typing import List, Dict, Optional, AsyncGenerator
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.models.schemas import BatchMessageItem, MessageCreate
+from app.services.agent_service import AgentService
+from app.services.llm_service import LLMService
+from app.services.rate_limiter import ProviderBusyError, PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+class BatchService:
+    """Service for running many chat completions in one request"""
+
+    def __init__(self):
+        self.agent_service = AgentService()
+        self.llm_service = LLMService()
+
+    async def run(
+        self,
+        agent_id: str,
+        items: List[BatchMessageItem],
+        wallet_address: str,
+        concurrency: Optional[int] = None
+    ) -> AsyncGenerator[dict, None]:
+        """
+        Process batch items, yielding results in completion order
+
+        Each result is {"index", "chat_id", "content", "usage"} on success or
+        {"index", "chat_id", "error"} on failure; a failing item never stops
+        the rest of the batch. A final {"done": True, ...} record closes the batch.
+
+        Args:
+            agent_id: Agent ID from the URL (chats created with another agent use theirs)
+            items: Batch items
+            wallet_address: User's wallet address
+            concurrency: Max items in flight (capped at BATCH_MAX_CONCURRENCY)
+        """
+        limit = min(concurrency or settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+        semaphore = asyncio.Semaphore(limit)
+
+        # One shared context lookup per chat, started by the first item that needs it
+        contexts: Dict[str, asyncio.Task] = {}
+        # One memory lookup per distinct (chat, message)
+        memories: Dict[tuple, asyncio.Task] = {}
+        save_locks: Dict[str, asyncio.Lock] = {item.chat_id: asyncio.Lock() for item in items}
+
+        def chat_context(chat_id: str) -> asyncio.Task:
+            if chat_id not in contexts:
+                contexts[chat_id] = asyncio.ensure_future(
+                    self._load_chat_context(agent_id, chat_id, wallet_address)
+                )
+            return contexts[chat_id]
+
+        def memory_context(chat_id: str, context: dict, query: str) -> asyncio.Task:
+            key = (chat_id, query)
+            if key in memories:
+                metrics.increment("batch_shared_memory_lookups_saved_total")
+            else:
+                memories[key] = asyncio.ensure_future(self._retrieve_memory(chat_id, context, query))
+            return memories[key]
+
+        async def process(index: int, item: BatchMessageItem) -> dict:
+            async with semaphore:
+                try:
+                    # shield: one cancelled item must not cancel the shared lookup
+                    context = await asyncio.shield(chat_context(item.chat_id))
+                    # Same admission path as a single message: no memory search
+                    # or prompt building for an item the provider cannot queue
+                    self.llm_service.check_capacity(
+                        context["agent_id"], context["agent"], context["capsule_id"], priority=PRIORITY_BACKGROUND
+                    )
+                    memory = await asyncio.shield(memory_context(item.chat_id, context, item.message.content))
+                    messages = context["history"] + [
+                        {"role": item.message.role.value, "content": item.message.content}
+                    ]
+                    response = await self.llm_service.get_completion(
+                        agent_id=context["agent_id"],
+                        messages=messages,
+                        agent_config=context["agent"],
+                        chat_id=item.chat_id,
+                        memory_size=context["memory_size"],
+                        capsule_id=context["capsule_id"],
+                        web_search_enabled=context["web_search_enabled"],
+                        bypass_cache=item.message.bypass_cache,
+                        memory_context=memory,
+                        priority=PRIORITY_BACKGROUND
+                    )
+
+                    # Keep each user/assistant pair adjacent in the chat
+                    async with save_locks[item.chat_id]:
+                        await self.agent_service.add_message(item.chat_id, item.message, wallet_address)
+                        assistant_msg = MessageCreate(role="assistant", content=response.content)
+                        await self.agent_service.add_message(item.chat_id, assistant_msg, wallet_address)
+
+                    metrics.increment("batch_items_total", status="ok")
+                    return {
+                        "index": index,
+                        "chat_id": item.chat_id,
+                        "content": response.content,
+                        "usage": response.usage,
+                    }
+                except ProviderBusyError as e:
+                    metrics.increment("batch_items_total", status="busy")
+                    return {"index": index, "chat_id": item.chat_id, "error": str(e), "retry_after": e.retry_after}
+                except Exception as e:
+                    metrics.increment("batch_items_total", status="error")
+                    return {"index": index, "chat_id": item.chat_id, "error": str(e)}
+
+        tasks = [asyncio.ensure_future(process(index, item)) for index, item in enumerate(items)]
+        succeeded = failed = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                if "error" in result:
+                    failed += 1
+                else:
+                    succeeded += 1
+                yield result
+            yield {"done": True, "succeeded": succeeded, "failed": failed}
+        finally:
+            # Client went away (or the generator was closed): stop outstanding work
+            for task in [*tasks, *contexts.values(), *memories.values()]:
+                task.cancel()
+
+    async def _load_chat_context(
+        self,
+        agent_id: str,
+        chat_id: str,
+        wallet_address: str
+    ) -> dict:
+        """Resolve chat, agent and history snapshot for a chat"""
+        chat = await self.agent_service.get_chat(chat_id, wallet_address)
+        if not chat:
+            raise LookupError(f"Chat not found (chat_id: {chat_id})")
+
+        actual_agent_id = chat.agent_id if chat.agent_id else agent_id
+        agent = await self.agent_service.get_agent(actual_agent_id, wallet_address)
+        if not agent:
+            raise LookupError(f"Agent not found (agent_id: {actual_agent_id})")
+
+        memory_size = chat.memory_size.value if hasattr(chat.memory_size, 'value') else str(chat.memory_size)
+        capsule_id = getattr(chat, 'capsule_id', None)
+
+        return {
+            "agent_id": actual_agent_id,
+            "agent": agent,
+            "history": [{"role": m.role.value, "content": m.content} for m in chat.messages],
+            "memory_size": memory_size,
+            "capsule_id": capsule_id,
+            "web_search_enabled": getattr(chat, 'web_search_enabled', False),
+        }
+
+    async def _retrieve_memory(self, chat_id: str, context: dict, query: str) -> str:
+        """Memory section for one item's message ("" if memory is unavailable)"""
+        if not self.llm_service.memory_service._is_available():
+            return ""
+        # Memory search is blocking; keep it off the event loop
+        return await asyncio.to_thread(
+            self.llm_service.retrieve_memory_context,
+            context["agent_id"], chat_id, query, context["memory_size"], context["capsule_id"]
+        )
@@ -15,8 +15,11 @@ Setup:
    - UPSTASH_REDIS_REST_TOKEN
 """
 from typing import Optional, Any
+from collections import OrderedDict
 import json
 import os
+import threading
+import time
 from datetime import timedelta
 
 try:
@@ -30,6 +33,31 @@ except ImportError:
 
 # Fallback in-memory cache if KV is not available
 _in_memory_cache: dict = {}
+# Guards read-modify-write updates of fallback sets (the memory ID index)
+_in_memory_lock = threading.Lock()
+# Key -> expiry timestamp for fallback entries set with a TTL
+_in_memory_expiry: dict = {}
+# Expired entries nobody reads again are swept at most this often
+_SWEEP_INTERVAL_SECONDS = 60
+_next_sweep = 0.0
+# Fallback web search keys, least recently used first (Redis bounds them by TTL alone)
+_web_search_lru: OrderedDict = OrderedDict()
+
+
+def _expire_in_memory(key: Optional[str] = None) -> None:
+    """Drop a fallback key if its TTL has passed (and periodically, every expired key)"""
+    global _next_sweep
+    now = time.time()
+    expired = []
+    if key is not None and _in_memory_expiry.get(key, now + 1) <= now:
+        expired.append(key)
+    if now >= _next_sweep:
+        _next_sweep = now + _SWEEP_INTERVAL_SECONDS
+        expired.extend(k for k, expires_at in list(_in_memory_expiry.items()) if expires_at <= now)
+    for k in expired:
+        _in_memory_expiry.pop(k, None)
+        _in_memory_cache.pop(k, None)
+        _web_search_lru.pop(k, None)
 
 
 class CacheService:
@@ -102,6 +130,7 @@ class CacheService:
                 return value
             else:
                 # Fallback to in-memory
+                _expire_in_memory(key)
                 return _in_memory_cache.get(key, default)
         except Exception as e:
             print(f"Error getting cache key '{key}': {e}")
@@ -129,8 +158,13 @@ class CacheService:
                     self.redis.set(key, value)
                 return True
             else:
-                # Fallback to in-memory (no TTL support)
+                # Fallback to in-memory (TTL checked on read)
                 _in_memory_cache[key] = value
+                if ttl_seconds:
+                    _in_memory_expiry[key] = time.time() + ttl_seconds
+                else:
+                    _in_memory_expiry.pop(key, None)
+                _expire_in_memory()
                 return True
         except Exception as e:
             print(f"Error setting cache key '{key}': {e}")
@@ -150,6 +184,7 @@ class CacheService:
                 return True
             else:
                 _in_memory_cache.pop(key, None)
+                _in_memory_expiry.pop(key, None)
                 return True
         except Exception as e:
             print(f"Error deleting cache key '{key}': {e}")
@@ -183,11 +218,56 @@ class CacheService:
                 keys_to_delete = [k for k in _in_memory_cache.keys() if pattern.replace('*', '') in k]
                 for key in keys_to_delete:
                     _in_memory_cache.pop(key, None)
+                    _in_memory_expiry.pop(key, None)
                 return len(keys_to_delete)
         except Exception as e:
             print(f"Error clearing cache pattern '{pattern}': {e}")
             return 0
     
+    def increment_counters(self, key: str, counters: dict) -> bool:
+        """
+        Atomically add to integer counters stored in a hash
+        Args:
+            key: Cache key of the hash
+            counters: Field -> amount to add
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            if self.redis_available and self.redis:
+                # One round trip for all fields
+                pipe = self.redis.pipeline()
+                for field, amount in counters.items():
+                    pipe.hincrby(key, field, int(amount))
+                pipe.exec()
+                return True
+            else:
+                hash_value = _in_memory_cache.setdefault(key, {})
+                for field, amount in counters.items():
+                    hash_value[field] = hash_value.get(field, 0) + int(amount)
+                return True
+        except Exception as e:
+            print(f"Error incrementing counters '{key}': {e}")
+            return False
+    
+    def get_counters(self, key: str) -> dict:
+        """
+        Get integer counters stored in a hash
+        Args:
+            key: Cache key of the hash
+        Returns:
+            Field -> value dict (empty if the key doesn't exist)
+        """
+        try:
+            if self.redis_available and self.redis:
+                values = self.redis.hgetall(key) or {}
+                return {field: int(value) for field, value in values.items()}
+            else:
+                return dict(_in_memory_cache.get(key, {}))
+        except Exception as e:
+            print(f"Error getting counters '{key}': {e}")
+            return {}
+    
     def get_user_preferences(self, wallet_address: str) -> dict:
         """Get user preferences from cache"""
         key = f"user:preferences:{wallet_address}"
@@ -231,6 +311,102 @@ class CacheService:
             agents.append(agent)  # Add new
         return self.set_user_agents(wallet_address, agents)
     
+    def get_agent_response_cache_policy(self, agent_id: str) -> Optional[dict]:
+        """Get the response cache policy for an agent (enabled, ttl_seconds)"""
+        key = f"agent:{agent_id}:response_cache"
+        return self.get(key)
+    
+    def set_agent_response_cache_policy(self, agent_id: str, policy: dict) -> bool:
+        """
+        Save the response cache policy for an agent (persistent)
+        Args:
+            agent_id: Agent ID
+            policy: Policy dict with 'enabled' and 'ttl_seconds'
+        """
+        key = f"agent:{agent_id}:response_cache"
+        return self.set(key, policy, ttl_seconds=None)
+    
+    def get_web_search_result(self, cache_key: str) -> Optional[dict]:
+        """Get a cached web search result (dict with 'context' and 'expires_at')"""
+        key = f"websearch:{cache_key}"
+        result = self.get(key)
+        if result is not None and not self.redis_available:
+            with _in_memory_lock:
+                if key in _web_search_lru:
+                    _web_search_lru.move_to_end(key)
+        return result
+    
+    def set_web_search_result(self, cache_key: str, result: dict, ttl_seconds: int, max_entries: int) -> bool:
+        """
+        Cache a web search result
+        Redis evicts entries by their TTL; the in-memory fallback also keeps at
+        most max_entries, evicting the least recently used first
+        Args:
+            cache_key: Normalized query digest plus k
+            result: Result dict with 'context' and 'expires_at'
+            ttl_seconds: TTL in seconds
+            max_entries: Max number of searches kept by the in-memory fallback
+        """
+        key = f"websearch:{cache_key}"
+        ok = self.set(key, result, ttl_seconds)
+        if ok and not self.redis_available:
+            with _in_memory_lock:
+                _web_search_lru[key] = None
+                _web_search_lru.move_to_end(key)
+                while len(_web_search_lru) > max_entries:
+                    evicted, _ = _web_search_lru.popitem(last=False)
+                    _in_memory_cache.pop(evicted, None)
+                    _in_memory_expiry.pop(evicted, None)
+        return ok
+    
+    def get_memory_search(self, cache_key: str) -> Optional[dict]:
+        """Get a cached memory search result (dict with 'memories' and 'expires_at')"""
+        return self.get(f"memsearch:{cache_key}")
+    
+    def set_memory_search(self, cache_key: str, result: dict, ttl_seconds: int) -> bool:
+        """Cache a memory search result"""
+        return self.set(f"memsearch:{cache_key}", result, ttl_seconds)
+    
+    def get_memory_generations(self, agent_id: str, chat_id: str, capsule_id: Optional[str] = None) -> Optional[tuple]:
+        """
+        Current generations of a chat's, its agent's and its capsule's memories
+        (each bumped whenever those memories change), in one round trip
+        Returns:
+            (chat, agent, capsule) generations (capsule 0 without one), None if unavailable
+        """
+        keys = [f"memgen:{agent_id}:{chat_id}", f"memgen:agent:{agent_id}"]
+        if capsule_id:
+            keys.append(f"memgen:capsule:{capsule_id}")
+        try:
+            if self.redis_available and self.redis:
+                pipe = self.redis.pipeline()
+                for key in keys:
+                    pipe.hget(key, "generation")
+                values = pipe.exec()
+            else:
+                values = [_in_memory_cache.get(key, {}).get("generation") for key in keys]
+            generations = [int(value or 0) for value in values]
+            return tuple(generations + [0] * (3 - len(generations)))
+        except Exception as e:
+            print(f"Error getting memory generations for chat '{chat_id}': {e}")
+            return None
+    
+    def bump_memory_generation(self, agent_id: str, chat_id: str) -> bool:
+        """Invalidate cached memory searches for a chat by moving to a new generation"""
+        return self.increment_counters(f"memgen:{agent_id}:{chat_id}", {"generation": 1})
+    
+    def bump_memory_scope_generation(self, scope: str, scope_id: str) -> bool:
+        """Invalidate cached memory searches for every chat of an agent or capsule"""
+        return self.increment_counters(f"memgen:{scope}:{scope_id}", {"generation": 1})
+    
+    def get_stream_checkpoint(self, message_id: str) -> Optional[dict]:
+        """Get the latest checkpoint of a streaming assistant message"""
+        return self.get(f"stream:{message_id}")
+    
+    def set_stream_checkpoint(self, message_id: str, checkpoint: dict, ttl_seconds: int = 3600) -> bool:
+        """Save a checkpoint of a streaming assistant message (partial content + status)"""
+        return self.set(f"stream:{message_id}", checkpoint, ttl_seconds)
+    
     def get_chat_cache(self, agent_id: str, wallet_address: str) -> Optional[list]:
         """Get cached chat list for an agent"""
         key = f"chats:{agent_id}:{wallet_address}"
@@ -285,10 +461,67 @@ class CacheService:
         return self.get(key)
     
     def delete_chat(self, chat_id: str) -> bool:
-        """Delete a chat from Redis"""
+        """Delete a chat (and its rolling summary and usage totals) from Redis"""
         key = f"chat:{chat_id}"
+        self.delete_chat_summary(chat_id)
+        self.delete(f"usage:chat:{chat_id}")
         return self.delete(key)
     
+    def get_chat_summary(self, chat_id: str) -> Optional[dict]:
+        """
+        Get the rolling conversation summary for a chat
+        Args:
+            chat_id: Chat ID
+        Returns:
+            Summary dictionary (summary, message_count, updated_at) or None
+        """
+        key = f"chat:{chat_id}:summary"
+        return self.get(key)
+    
+    def set_chat_summary(self, chat_id: str, summary: dict) -> bool:
+        """
+        Save the rolling conversation summary for a chat (persistent, like the chat)
+        Args:
+            chat_id: Chat ID
+            summary: Summary dictionary
+        """
+        key = f"chat:{chat_id}:summary"
+        return self.set(key, summary, ttl_seconds=None)
+    
+    def delete_chat_summary(self, chat_id: str) -> bool:
+        """Delete the rolling conversation summary for a chat"""
+        key = f"chat:{chat_id}:summary"
+        return self.delete(key)
+    
+    def record_usage(self, agent_id: str, chat_id: Optional[str], usage: dict) -> bool:
+        """
+        Add one completion's token usage to the agent and chat totals (persistent)
+        Args:
+            agent_id: Agent ID
+            chat_id: Chat ID (None to only update the agent totals)
+            usage: Usage dict (prompt_tokens, completion_tokens, total_tokens, estimated, cached)
+        """
+        counters = {
+            "requests": 1,
+            "prompt_tokens": usage.get("prompt_tokens") or 0,
+            "completion_tokens": usage.get("completion_tokens") or 0,
+            "total_tokens": usage.get("total_tokens") or 0,
+            "estimated_requests": 1 if usage.get("estimated") else 0,
+            "cached_requests": 1 if usage.get("cached") else 0,
+        }
+        ok = self.increment_counters(f"usage:agent:{agent_id}", counters)
+        if chat_id:
+            ok = self.increment_counters(f"usage:chat:{chat_id}", counters) and ok
+        return ok
+    
+    def get_agent_usage(self, agent_id: str) -> dict:
+        """Get the aggregated token usage for an agent"""
+        return self.get_counters(f"usage:agent:{agent_id}")
+    
+    def get_chat_usage(self, chat_id: str) -> dict:
+        """Get the aggregated token usage for a chat"""
+        return self.get_counters(f"usage:chat:{chat_id}")
+    
     def save_messages(self, chat_id: str, messages: list) -> bool:
         """
         Save messages for a chat to Redis
@@ -385,6 +618,117 @@ class CacheService:
             key = f"chats:agent:{agent_id}:wallet:{wallet_address}"
             return self.set(key, chat_list, ttl_seconds=None)
         return True
+    
+    # Memory ID index (open-source mem0 has no delete-by-metadata)
+    
+    def add_memory_ids(self, agent_id: str, chat_id: str, capsule_id: Optional[str], memory_ids: list) -> bool:
+        """
+        Record the memory IDs stored for a chat
+        The chat, agent and capsule indexes are sets, updated atomically (no
+        read-modify-write), so concurrent stores never lose each other's IDs.
+        Args:
+            agent_id: Agent ID
+            chat_id: Chat ID
+            capsule_id: Capsule ID the chat belongs to (if any)
+            memory_ids: IDs returned by the vector store
+        Returns:
+            True if successful
+        """
+        if not memory_ids:
+            return True
+        chat_key = f"memidx:chat:{agent_id}:{chat_id}"
+        agent_key = f"memidx:agent:{agent_id}"
+        capsule_key = f"memidx:capsule:{capsule_id}"
+        member = json.dumps([agent_id, chat_id])
+        try:
+            if self.redis_available and self.redis:
+                # One round trip for every index
+                pipe = self.redis.pipeline()
+                pipe.sadd(chat_key, *memory_ids)
+                pipe.sadd(agent_key, chat_id)
+                if capsule_id:
+                    pipe.set(f"memidx:chatcapsule:{agent_id}:{chat_id}", capsule_id)
+                    pipe.sadd(capsule_key, member)
+                pipe.exec()
+                return True
+            else:
+                with _in_memory_lock:
+                    _in_memory_cache.setdefault(chat_key, set()).update(memory_ids)
+                    _in_memory_cache.setdefault(agent_key, set()).add(chat_id)
+                    if capsule_id:
+                        _in_memory_cache[f"memidx:chatcapsule:{agent_id}:{chat_id}"] = capsule_id
+                        _in_memory_cache.setdefault(capsule_key, set()).add(member)
+                return True
+        except Exception as e:
+            print(f"Error indexing memory IDs for chat '{chat_id}': {e}")
+            return False
+    
+    def remove_memory_ids(self, agent_id: str, chat_id: str, memory_ids: list) -> bool:
+        """Forget memory IDs the vector store deleted (e.g. facts mem0 merged away)"""
+        if not memory_ids:
+            return True
+        key = f"memidx:chat:{agent_id}:{chat_id}"
+        try:
+            if self.redis_available and self.redis:
+                self.redis.srem(key, *memory_ids)
+            else:
+                with _in_memory_lock:
+                    _in_memory_cache.get(key, set()).difference_update(memory_ids)
+            return True
+        except Exception as e:
+            print(f"Error removing memory IDs for chat '{chat_id}': {e}")
+            return False
+    
+    def _get_set(self, key: str) -> list:
+        """Members of a set (empty if the key doesn't exist)"""
+        try:
+            if self.redis_available and self.redis:
+                return list(self.redis.smembers(key) or [])
+            else:
+                with _in_memory_lock:
+                    return list(_in_memory_cache.get(key, set()))
+        except Exception as e:
+            print(f"Error getting set '{key}': {e}")
+            return []
+    
+    def get_memory_ids(self, agent_id: str, chat_id: str) -> list:
+        """Memory IDs recorded for a chat (sorted, so pages are stable)"""
+        return sorted(self._get_set(f"memidx:chat:{agent_id}:{chat_id}"))
+    
+    def get_memory_indexed_chats(self, agent_id: str) -> list:
+        """Chat IDs with recorded memory IDs for an agent"""
+        return self._get_set(f"memidx:agent:{agent_id}")
+    
+    def get_capsule_memory_indexed_chats(self, capsule_id: str) -> list:
+        """[agent_id, chat_id] pairs with recorded memory IDs for a capsule"""
+        return [json.loads(member) for member in self._get_set(f"memidx:capsule:{capsule_id}")]
+    
+    def delete_memory_index(self, agent_id: str, chat_id: str) -> bool:
+        """Forget a chat's recorded memory IDs (after they were deleted)"""
+        chat_key = f"memidx:chat:{agent_id}:{chat_id}"
+        capsule_of_key = f"memidx:chatcapsule:{agent_id}:{chat_id}"
+        agent_key = f"memidx:agent:{agent_id}"
+        member = json.dumps([agent_id, chat_id])
+        try:
+            capsule_id = self.get(capsule_of_key)
+            if self.redis_available and self.redis:
+                pipe = self.redis.pipeline()
+                pipe.delete(chat_key, capsule_of_key)
+                pipe.srem(agent_key, chat_id)
+                if capsule_id:
+                    pipe.srem(f"memidx:capsule:{capsule_id}", member)
+                pipe.exec()
+            else:
+                with _in_memory_lock:
+                    _in_memory_cache.pop(chat_key, None)
+                    _in_memory_cache.pop(capsule_of_key, None)
+                    _in_memory_cache.get(agent_key, set()).discard(chat_id)
+                    if capsule_id:
+                        _in_memory_cache.get(f"memidx:capsule:{capsule_id}", set()).discard(member)
+            return True
+        except Exception as e:
+            print(f"Error deleting memory index for chat '{chat_id}': {e}")
+            return False
 
 
 # Global cache service instance
@@ -120,6 +120,14 @@ class CapsuleService:
             self.supabase.table("capsules").delete().eq("id", capsule_id).eq("creator_wallet", wallet_address).execute()
         except Exception as e:
             print(f"Error deleting capsule: {e}")
+            return
+        
+        # Drop the capsule's memories too (batched; a whole shard with the local engine)
+        from app.services.memory_service import MemoryService
+        try:
+            MemoryService().delete_capsule_memories(capsule_id)
+        except Exception as e:
+            print(f"Error deleting capsule memories: {e}")
     
     async def query_capsule(
         self,
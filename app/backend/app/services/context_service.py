@@ -0,0 +1,176 @@
+"""
+Context window builder for provider requests
+
+Keeps the conversation history sent to the LLM within a token budget:
+- Counts tokens per model (tiktoken when installed, calibrated heuristic otherwise)
+- Keeps the most recent turns that fit in the budget
+- Reserves room for the memory and web-search sections of the system prompt
+- Reports how much history was trimmed
+"""
+from typing import List, Dict, Optional, Tuple
+from functools import lru_cache
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None  # type: ignore
+    TIKTOKEN_AVAILABLE = False
+
+# Fixed per-message overhead (role markers / separators) in chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Average characters per token by model family, used when tiktoken is missing
+# or the model is not an OpenAI model
+_CHARS_PER_TOKEN = {
+    "gpt": 4.0,
+    "openai": 4.0,
+    "llama": 3.8,
+    "mistral": 3.6,
+    "gemma": 3.8,
+    "qwen": 3.5,
+    "deepseek": 3.6,
+    "claude": 3.5,
+}
+_DEFAULT_CHARS_PER_TOKEN = 3.8
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model: str):
+    """Resolve the tiktoken encoding for a model (None if not applicable)"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    name = model.split("/")[-1]
+    if not (model.startswith("openai/") or name.startswith("gpt")):
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use; fall back to the heuristic offline
+        logger.warning(f"tiktoken encoding unavailable for {model}, estimating tokens: {e}")
+        return None
+
+
+@lru_cache(maxsize=64)
+def _chars_per_token(model: str) -> float:
+    lowered = model.lower()
+    for family, ratio in _CHARS_PER_TOKEN.items():
+        if family in lowered:
+            return ratio
+    return _DEFAULT_CHARS_PER_TOKEN
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Count tokens in a text for a given model
+
+    Args:
+        text: Text to count
+        model: Model identifier (e.g. 'openai/gpt-4-turbo', 'llama3.1-8b')
+
+    Returns:
+        Exact token count when a tokenizer is available, otherwise an estimate
+    """
+    if not text:
+        return 0
+    model = model or ""
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return int(len(text) / _chars_per_token(model)) + 1
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+    """Count tokens for a list of chat messages including per-message overhead"""
+    return sum(
+        count_tokens(m.get("content", ""), model) + MESSAGE_OVERHEAD_TOKENS
+        for m in messages
+    )
+
+
+def build_history_window(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    reserved_tokens: int = 0,
+    budget: Optional[int] = None
+) -> Tuple[List[Dict[str, str]], Dict]:
+    """
+    Select the most recent messages that fit in the token budget
+
+    System messages are always kept. The latest message (the user's turn) is
+    always kept even if it alone exceeds the budget.
+
+    Args:
+        messages: Full chat history, oldest first
+        model: Model identifier used for token counting
+        reserved_tokens: Tokens reserved for the system prompt sections
+        budget: Total prompt token budget (defaults to settings.CONTEXT_TOKEN_BUDGET)
+
+    Returns:
+        Tuple of (windowed messages, stats dict)
+    """
+    budget = budget if budget is not None else settings.CONTEXT_TOKEN_BUDGET
+    history_budget = max(0, budget - reserved_tokens)
+
+    system_messages = [m for m in messages if m.get("role") == "system"]
+    turns = [m for m in messages if m.get("role") != "system"]
+
+    used = count_message_tokens(system_messages, model)
+    kept: List[Dict[str, str]] = []
+    total_tokens = used
+
+    # Walk backwards from the newest turn until the budget is exhausted
+    budget_exhausted = False
+    for index in range(len(turns) - 1, -1, -1):
+        message = turns[index]
+        tokens = count_tokens(message.get("content", ""), model) + MESSAGE_OVERHEAD_TOKENS
+        total_tokens += tokens
+        if budget_exhausted:
+            continue
+        if kept and used + tokens > history_budget:
+            budget_exhausted = True
+            continue
+        kept.append(message)
+        used += tokens
+
+    kept.reverse()
+    stats = {
+        "budget_tokens": budget,
+        "reserved_tokens": reserved_tokens,
+        "history_tokens": used,
+        "original_history_tokens": total_tokens,
+        "trimmed_tokens": total_tokens - used,
+        "kept_messages": len(kept),
+        "trimmed_messages": len(turns) - len(kept),
+    }
+    return system_messages + kept, stats
+
+
+def reserved_prompt_tokens(
+    model: Optional[str],
+    base_prompt: str,
+    memory_context: str = "",
+    web_search_context: str = "",
+    web_search_enabled: bool = False,
+    memory_enabled: bool = True
+) -> int:
+    """
+    Compute the tokens reserved for the injected system prompt sections
+
+    The memory and web-search sections always get at least their configured
+    reserve, so trimming leaves room for them even before they are known.
+    """
+    reserved = count_tokens(base_prompt, model) + MESSAGE_OVERHEAD_TOKENS
+    if memory_enabled:
+        reserved += max(settings.CONTEXT_MEMORY_RESERVE_TOKENS, count_tokens(memory_context, model))
+    if web_search_enabled:
+        reserved += max(settings.CONTEXT_WEB_SEARCH_RESERVE_TOKENS, count_tokens(web_search_context, model))
+    return reserved
@@ -0,0 +1,299 @@
+"""
+Content-addressed embedding cache
+
+Retrieval and ingestion keep embedding the same text (repeated questions,
+re-ingested history). Vectors are cached by the SHA-256 of the text, per
+namespace (embedding model and version, so a model change never serves stale
+vectors), in two tiers:
+- Memory: process-wide LRU of EMBEDDING_CACHE_MEMORY_ENTRIES vectors
+- Disk: per namespace, a memory-mapped float32 ring of
+  EMBEDDING_CACHE_DISK_ENTRIES vectors, the key each row holds, and an
+  append-only key log (oldest entries are overwritten once the ring is full)
+
+Shared by the memory backends behind MemoryService (the local engine's
+embedder and open-source mem0's embedding model) and embedding_service.
+"""
+from typing import Callable, Dict, List, Optional, Sequence
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Bytes of a content key stored alongside each disk row
+_TAG_BYTES = 16
+
+
+def content_key(text: str) -> str:
+    """Cache key for a text (hex SHA-256 prefix)"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:32]
+
+
+def _tag(key: str) -> np.ndarray:
+    """On-disk tag of a content key (the key's bytes, zero-padded)"""
+    raw = bytes.fromhex(key)[:_TAG_BYTES]
+    return np.frombuffer(raw.ljust(_TAG_BYTES, b"\0"), dtype=np.uint8)
+
+
+class _DiskTier:
+    """
+    One namespace's vectors on disk
+
+    vectors.f32 holds up to `capacity` rows written round-robin; keys.log has
+    one "<key> <slot>" line per write, replayed on open (later lines win).
+    tags.u8 holds the key each row was written for, checked on every read: a
+    slot's tag is cleared before the row is overwritten and the new tag saved
+    with the vector, ahead of the log line. A crash at any point therefore
+    leaves the old key missing rather than pointing at another text's vector.
+    """
+
+    def __init__(self, path: str, dim: int, capacity: int):
+        self.path = path
+        self.dim = dim
+        self.capacity = max(1, capacity)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._tags_path = os.path.join(path, "tags.u8")
+        self._log_path = os.path.join(path, "keys.log")
+        self._slots: Dict[str, int] = {}
+        self._slot_keys: Dict[int, str] = {}
+        self._next_slot = 0
+        self._log_lines = 0
+        self._vectors: Optional[np.memmap] = None
+        self._tags: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        if os.path.exists(self._log_path):
+            with open(self._log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2 or not parts[1].isdigit() or int(parts[1]) >= self.capacity:
+                        # Torn final line from a crash mid-write
+                        continue
+                    self._assign(parts[0], int(parts[1]))
+                    self._next_slot = (int(parts[1]) + 1) % self.capacity
+                    self._log_lines += 1
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(self.capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        # Rows written before tags existed have a zero tag and read as misses
+        with open(self._tags_path, "ab") as f:
+            f.truncate(self.capacity * _TAG_BYTES)
+        self._tags = np.memmap(self._tags_path, dtype=np.uint8, mode="r+", shape=(self.capacity, _TAG_BYTES))
+
+    def _assign(self, key: str, slot: int) -> None:
+        previous = self._slot_keys.get(slot)
+        if previous is not None and self._slots.get(previous) == slot:
+            del self._slots[previous]
+        self._slots[key] = slot
+        self._slot_keys[slot] = key
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            if not np.array_equal(self._tags[slot], _tag(key)):
+                # Overwritten by a write the log never recorded (crash mid-write)
+                del self._slots[key]
+                return None
+            return np.array(self._vectors[slot])
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            writes = []
+            for key, vector in items.items():
+                if key in self._slots:
+                    continue
+                writes.append((key, self._next_slot, vector))
+                self._next_slot = (self._next_slot + 1) % self.capacity
+            if not writes:
+                return
+            # Invalidate the slots' old keys on disk before touching their rows
+            for _, slot, _ in writes:
+                self._tags[slot] = 0
+            self._tags.flush()
+            lines = []
+            for key, slot, vector in writes:
+                self._vectors[slot] = vector
+                self._tags[slot] = _tag(key)
+                self._assign(key, slot)
+                lines.append(f"{key} {slot}\n")
+            self._vectors.flush()
+            self._tags.flush()
+            with open(self._log_path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+            self._log_lines += len(lines)
+            if self._log_lines > 2 * self.capacity:
+                self._rewrite_log()
+
+    def _rewrite_log(self) -> None:
+        """Replace the key log with one line per live slot, oldest first"""
+        order = list(range(self._next_slot, self.capacity)) + list(range(self._next_slot))
+        lines = [f"{self._slot_keys[s]} {s}\n" for s in order if s in self._slot_keys]
+        tmp_path = self._log_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._log_path)
+        self._log_lines = len(lines)
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + memory-mapped disk) cache of embeddings by content hash"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.EMBEDDING_CACHE_PATH
+        self._memory: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._disk: Dict[str, Optional[_DiskTier]] = {}
+        self._lock = threading.Lock()
+
+    def _namespace_dir(self, namespace: str) -> str:
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", namespace)[:48]
+        return os.path.join(self.path, f"{slug}-{hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:8]}")
+
+    def _disk_tier(self, namespace: str, dim: Optional[int] = None) -> Optional[_DiskTier]:
+        """
+        A namespace's disk tier, opened on first use
+        Created only when a vector of dimension `dim` is stored; None if
+        disabled, not created yet or of another dimension.
+        """
+        if settings.EMBEDDING_CACHE_DISK_ENTRIES <= 0:
+            return None
+        with self._lock:
+            if namespace in self._disk:
+                tier = self._disk[namespace]
+            else:
+                directory = self._namespace_dir(namespace)
+                meta_path = os.path.join(directory, "meta.json")
+                try:
+                    if os.path.exists(meta_path):
+                        with open(meta_path, "r", encoding="utf-8") as f:
+                            meta = json.load(f)
+                    elif dim is None:
+                        return None
+                    else:
+                        os.makedirs(directory, exist_ok=True)
+                        meta = {"namespace": namespace, "dim": dim, "capacity": settings.EMBEDDING_CACHE_DISK_ENTRIES}
+                        with open(meta_path, "w", encoding="utf-8") as f:
+                            json.dump(meta, f)
+                    tier = _DiskTier(directory, meta["dim"], meta["capacity"])
+                except Exception as e:
+                    logger.warning(f"Embedding disk cache unavailable for {namespace}: {e}")
+                    tier = None
+                self._disk[namespace] = tier
+        if tier is None or (dim is not None and tier.dim != dim):
+            return None
+        return tier
+
+    def get_many(self, namespace: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors for texts (None for misses)"""
+        results: List[Optional[np.ndarray]] = []
+        disk = self._disk_tier(namespace)
+        for text in texts:
+            key = (namespace, content_key(text))
+            with self._lock:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+            if vector is not None:
+                self._record("memory")
+            else:
+                vector = disk.get(key[1]) if disk is not None else None
+                if vector is not None:
+                    self._remember(key, vector)
+                    self._record("disk")
+                else:
+                    self._record("miss")
+            results.append(vector)
+        return results
+
+    def put_many(self, namespace: str, texts: Sequence[str], vectors: Sequence) -> None:
+        """Cache freshly computed vectors for texts"""
+        if not texts:
+            return
+        items = {content_key(t): np.asarray(v, dtype=np.float32) for t, v in zip(texts, vectors)}
+        for key, vector in items.items():
+            self._remember((namespace, key), vector)
+        disk = self._disk_tier(namespace, len(next(iter(items.values()))))
+        if disk is not None:
+            try:
+                disk.put_many(items)
+            except Exception as e:
+                logger.warning(f"Embedding disk cache write failed for {namespace}: {e}")
+
+    def embed(
+        self,
+        namespace: str,
+        texts: Sequence[str],
+        compute: Callable[[List[str]], Sequence]
+    ) -> List[np.ndarray]:
+        """
+        Vectors for texts, computing only the ones not cached
+
+        Args:
+            namespace: Embedding model and version the vectors belong to
+            texts: Texts to embed
+            compute: Embeds a list of (distinct, uncached) texts, one vector each
+
+        Returns:
+            One vector per text (same order)
+        """
+        if not settings.EMBEDDING_CACHE_ENABLED:
+            return [np.asarray(v, dtype=np.float32) for v in compute(list(texts))]
+        vectors = self.get_many(namespace, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            computed = [np.asarray(v, dtype=np.float32) for v in compute(missing)]
+            self.put_many(namespace, missing, computed)
+            by_text = dict(zip(missing, computed))
+            vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+        return vectors
+
+    def _remember(self, key: tuple, vector: np.ndarray) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > max(0, settings.EMBEDDING_CACHE_MEMORY_ENTRIES):
+                self._memory.popitem(last=False)
+
+    def _record(self, outcome: str) -> None:
+        metrics.increment("embedding_cache_lookups_total", outcome=outcome)
+        hits = (
+            metrics.counter("embedding_cache_lookups_total", outcome="memory")
+            + metrics.counter("embedding_cache_lookups_total", outcome="disk")
+        )
+        total = hits + metrics.counter("embedding_cache_lookups_total", outcome="miss")
+        metrics.set_gauge("embedding_cache_hit_rate", round(hits / total, 4) if total else 0.0)
+
+
+class CachedEmbedder:
+    """Wraps a batch embedder (embed(texts) -> (n, dim) array) with the embedding cache"""
+
+    def __init__(self, embedder, cache: Optional["EmbeddingCache"] = None):
+        self.embedder = embedder
+        self.cache = cache or embedding_cache
+        self.dim = embedder.dim
+        self.model_id = embedder.model_id
+        self.namespace = f"{embedder.model_id}:{embedder.dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.cache.embed(self.namespace, texts, self.embedder.embed)
+        return np.vstack(vectors) if vectors else np.zeros((0, self.dim), dtype=np.float32)
+
+
+# Global embedding cache (memory tier is per process, disk tier per host)
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,69 @@
+"""
+Text embeddings via an OpenAI-compatible /embeddings endpoint
+
+Used by features that need semantic similarity (e.g. the semantic tier of
+the response cache). Disabled when no embedding API key is configured.
+Texts embedded before are served from the embedding cache.
+"""
+from typing import List, Optional
+import asyncio
+import logging
+
+import httpx
+
+from app.core.config import settings
+from app.services.embedding_cache import embedding_cache
+
+logger = logging.getLogger(__name__)
+
+
+def is_available() -> bool:
+    """Check if an embedding provider is configured"""
+    return bool(settings.EMBEDDING_API_KEY)
+
+
+async def embed_texts(texts: List[str]) -> Optional[List[List[float]]]:
+    """
+    Embed a batch of texts
+
+    Args:
+        texts: Texts to embed
+
+    Returns:
+        One vector per text (same order), or None if embeddings are unavailable
+    """
+    if not texts or not is_available():
+        return None
+
+    namespace = f"api:{settings.EMBEDDING_API_BASE}:{settings.EMBEDDING_MODEL}"
+    cached = embedding_cache.get_many(namespace, texts) if settings.EMBEDDING_CACHE_ENABLED else [None] * len(texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+    if not missing:
+        return [v.tolist() for v in cached]
+
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"{settings.EMBEDDING_API_BASE}/embeddings",
+                headers={
+                    "Authorization": f"Bearer {settings.EMBEDDING_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={"model": settings.EMBEDDING_MODEL, "input": missing},
+                timeout=10
+            )
+            response.raise_for_status()
+            data = sorted(response.json().get("data", []), key=lambda d: d.get("index", 0))
+            computed = [item["embedding"] for item in data]
+    except Exception as e:
+        logger.warning(f"Embedding request failed: {e}")
+        return None
+
+    if len(computed) != len(missing):
+        logger.warning(f"Embedding response had {len(computed)} vectors for {len(missing)} texts")
+        return None
+    if settings.EMBEDDING_CACHE_ENABLED:
+        # The disk tier flushes a memory map; keep it off the event loop
+        await asyncio.to_thread(embedding_cache.put_many, namespace, missing, computed)
+    by_text = dict(zip(missing, computed))
+    return [v.tolist() if v is not None else by_text[t] for t, v in zip(texts, cached)]
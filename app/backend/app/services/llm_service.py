@@ -1,11 +1,27 @@
-from typing import List, Dict, Optional, AsyncGenerator
+from typing import List, Dict, Optional, AsyncGenerator, Tuple
 from app.core.config import settings
+from app.core.metrics import metrics
 from app.models.schemas import Agent, LLMResponse
+from app.services.context_service import (
+    build_history_window, reserved_prompt_tokens, count_tokens, count_message_tokens
+)
 from app.services.memory_service import MemoryService
-from app.services.web_search_service import web_search, is_available as web_search_available
-
+from app.services.prefetch_service import prefetch_service
+from app.services.prompt_assembler import assemble_prompt, SYSTEM_PROMPT
+from app.services.provider_router import provider_router, DEFAULT_MODELS
+from app.services.rate_limiter import (
+    provider_limiter, PRIORITY_CAPSULE, PRIORITY_DEFAULT, PRIORITY_BACKGROUND
+)
+from app.services.response_cache_service import response_cache
+from app.services.cache_service import cache_service
+from app.services.streaming import iter_sse_data, parse_chunk
+from app.services.summary_service import summary_service, conversation_turns, messages_after_summary
+from app.services.web_search_service import cached_web_search, is_available as web_search_available
+
+from contextlib import aclosing
+from functools import partial
+import asyncio
 import httpx
-import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,8 +36,8 @@ def truncate_to_words(text: str, max_words: int = 100) -> str:
 
 class LLMService:
     def __init__(self):
-        self.openrouter_base = "https://openrouter.ai/api/v1"
-        self.cerebras_base = "https://api.cerebras.ai/v1"
+        self.openrouter_base = settings.OPENROUTER_BASE_URL.rstrip("/")
+        self.cerebras_base = settings.CEREBRAS_BASE_URL.rstrip("/")
         self.memory_service = MemoryService()
 
     # ---------------------------------------------------------------------
@@ -36,74 +52,50 @@ class LLMService:
         chat_id: Optional[str] = None,
         memory_size: str = "Medium",
         capsule_id: Optional[str] = None,
-        web_search_enabled: bool = False
+        web_search_enabled: bool = False,
+        bypass_cache: bool = False,
+        memory_context: Optional[str] = None,
+        priority: Optional[int] = None
     ) -> LLMResponse:
         """
         Get a single completion (non-streaming).
         Collects the full response from the stream and returns it as LLMResponse.
+        Pass memory_context to reuse an already retrieved memory section
+        instead of querying memory again (e.g. for batched prompts).
         """
-        full_content = ""
         model_name = agent_config.model or "google/gemma-3-27b-it:free"
-        
-        # Get memory context
-        memory_context = ""
-        if chat_id and self.memory_service._is_available():
-            try:
-                user_message = messages[-1]["content"] if messages else ""
-                memories = self.memory_service.get_chat_memories(
-                    agent_id=agent_id,
-                    chat_id=chat_id,
-                    query=user_message,
-                    memory_size=memory_size,
-                    capsule_id=capsule_id
-                )
-                memory_context = self.memory_service.format_memory_context(memories)
-            except Exception as e:
-                # logger.warning(f"Memory retrieval failed: {e}")
-                pass
-
-        # Get web search context if enabled
-        web_search_context = ""
-        if web_search_enabled and web_search_available():
-            try:
-                user_message = messages[-1]["content"] if messages else ""
-                if user_message:
-                    logger.info(f"🔎 Performing web search for: {user_message[:50]}...")
-                    web_search_context = web_search(user_message, k=5)
-                    if web_search_context:
-                        logger.info("✅ Web search completed successfully")
-            except Exception as e:
-                # logger.warning(f"Web search failed: {e}")
-                pass
+        if priority is None:
+            priority = PRIORITY_CAPSULE if capsule_id else PRIORITY_DEFAULT
 
-        enhanced_messages = self._inject_system_prompt(messages, memory_context, web_search_context)
+        enhanced_messages, context_stats = await self._prepare_messages(
+            agent_id, messages, agent_config, chat_id, memory_size, capsule_id, web_search_enabled,
+            memory_context=memory_context
+        )
         
-        # Collect all chunks from the stream
+        # Collect all chunks from the stream (joined once at the end)
+        chunks = []
+        usage = {}
         async for chunk in self._stream_completion(
             enhanced_messages,
             agent_config,
-            agent_id
+            agent_id,
+            use_cache=True,
+            bypass_cache=bypass_cache,
+            priority=priority,
+            usage=usage
         ):
-            full_content += chunk
+            chunks.append(chunk)
+        full_content = "".join(chunks)
 
-        # Store memory after getting full response
-        if chat_id and self.memory_service._is_available():
-            try:
-                self.memory_service.store_chat_memory(
-                    agent_id=agent_id,
-                    chat_id=chat_id,
-                    messages=messages + [{"role": "assistant", "content": full_content}],
-                    capsule_id=capsule_id
-                )
-            except Exception as e:
-                # logger.warning(f"Memory storage failed: {e}")
-                pass
+        # Store memory and refresh the chat summary after getting full response
+        await self._record_usage(agent_id, chat_id, usage)
+        await self._after_completion(agent_id, messages, full_content, agent_config, chat_id, capsule_id)
 
         return LLMResponse(
             content=full_content,
             model=model_name,
-            usage=None,
-            metadata=None
+            usage=usage or None,
+            metadata={"context": context_stats}
         )
 
     # ---------------------------------------------------------------------
@@ -118,62 +110,270 @@ class LLMService:
         chat_id: Optional[str] = None,
         memory_size: str = "Medium",
         capsule_id: Optional[str] = None,
-        web_search_enabled: bool = False
+        web_search_enabled: bool = False,
+        bypass_cache: bool = False,
+        usage: Optional[dict] = None
     ) -> AsyncGenerator[str, None]:
+        """
+        Stream a completion chunk by chunk.
+        Pass a dict as usage to receive the token usage once the stream completes.
+        """
+        if usage is None:
+            usage = {}
 
-        memory_context = ""
-        if chat_id and self.memory_service._is_available():
-            try:
-                user_message = messages[-1]["content"] if messages else ""
-                memories = self.memory_service.get_chat_memories(
-                    agent_id=agent_id,
-                    chat_id=chat_id,
-                    query=user_message,
-                    memory_size=memory_size,
-                    capsule_id=capsule_id
-                )
-                memory_context = self.memory_service.format_memory_context(memories)
-            except Exception as e:
-                # logger.warning(f"Memory retrieval failed: {e}")
-                pass
+        enhanced_messages, _ = await self._prepare_messages(
+            agent_id, messages, agent_config, chat_id, memory_size, capsule_id, web_search_enabled
+        )
+
+        # aclosing() makes a consumer's aclose() (e.g. on client disconnect)
+        # propagate down to the provider httpx stream immediately
+        chunks = []
+        try:
+            async with aclosing(self._stream_completion(
+                enhanced_messages,
+                agent_config,
+                agent_id,
+                use_cache=True,
+                bypass_cache=bypass_cache,
+                priority=PRIORITY_CAPSULE if capsule_id else PRIORITY_DEFAULT,
+                usage=usage
+            )) as stream:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            partial_tokens = count_tokens("".join(chunks), agent_config.model)
+            metrics.increment("llm_streams_cancelled_total")
+            metrics.increment("llm_cancelled_stream_tokens_total", partial_tokens)
+            logger.info(f"🛑 Stream cancelled for chat {chat_id} after ~{partial_tokens} tokens")
+            raise
+
+        full_content = "".join(chunks)
+        await self._record_usage(agent_id, chat_id, usage)
+        await self._after_completion(agent_id, messages, full_content, agent_config, chat_id, capsule_id)
+
+    def check_capacity(
+        self,
+        agent_id: str,
+        agent_config: Agent,
+        capsule_id: Optional[str] = None,
+        priority: Optional[int] = None
+    ) -> None:
+        """
+        Fail fast if the agent's provider cannot take another request right now
+        Call before starting a streaming response so the client gets a 503,
+        and before preparing a batch item.
+
+        Raises:
+            ProviderBusyError: If the provider's wait queue is full
+        """
+        provider = self._resolve_provider(agent_config, agent_id)
+        if priority is None:
+            priority = PRIORITY_CAPSULE if capsule_id else PRIORITY_DEFAULT
+        provider_limiter.check_admission(provider, agent_config.api_key, priority)
+
+    # ---------------------------------------------------------------------
+    # PROMPT PREPARATION (MEMORY + WEB SEARCH + HISTORY WINDOW)
+    # ---------------------------------------------------------------------
+
+    def retrieve_memory_context(
+        self,
+        agent_id: str,
+        chat_id: str,
+        query: str,
+        memory_size: str = "Medium",
+        capsule_id: Optional[str] = None
+    ) -> str:
+        """Retrieve and format the memories relevant to a query ("" if none or unavailable)"""
+        try:
+            memories = self.memory_service.get_chat_memories(
+                agent_id=agent_id,
+                chat_id=chat_id,
+                query=query,
+                memory_size=memory_size,
+                capsule_id=capsule_id
+            )
+            return self.memory_service.format_memory_context(memories)
+        except Exception as e:
+            # logger.warning(f"Memory retrieval failed: {e}")
+            return ""
+
+    async def _retrieve_memory_with_deadline(
+        self,
+        agent_id: str,
+        chat_id: str,
+        query: str,
+        memory_size: str,
+        capsule_id: Optional[str],
+        prefetched: List[Dict]
+    ) -> str:
+        """
+        Run the query-specific memory search, falling back to the memories
+        prefetched when the chat was opened if it misses MEMORY_SEARCH_DEADLINE_MS
+        """
+        search = asyncio.to_thread(
+            self.retrieve_memory_context, agent_id, chat_id, query, memory_size, capsule_id
+        )
+        try:
+            memory_context = await asyncio.wait_for(search, timeout=settings.MEMORY_SEARCH_DEADLINE_MS / 1000)
+            metrics.increment("memory_search_deadline_total", outcome="search")
+            return memory_context
+        except asyncio.TimeoutError:
+            # The search thread finishes in the background; its result is dropped
+            metrics.increment("memory_search_deadline_total", outcome="prefetched")
+            return self.memory_service.format_memory_context(prefetched)
+
+    async def _prepare_messages(
+        self,
+        agent_id: str,
+        messages: List[Dict[str, str]],
+        agent_config: Agent,
+        chat_id: Optional[str],
+        memory_size: str,
+        capsule_id: Optional[str],
+        web_search_enabled: bool,
+        memory_context: Optional[str] = None
+    ) -> Tuple[List[Dict[str, str]], Dict]:
+        """
+        Build the provider messages for a turn.
+        Retrieves memory and web context, trims the history to the token
+        budget (reserving room for those sections) and assembles the prompt
+        in a prefix-cache-friendly order.
+        Returns the messages and the context window stats.
+        """
+        user_message = messages[-1]["content"] if messages else ""
+        memory_enabled = bool(chat_id) and self.memory_service._is_available()
+
+        if memory_context is None:
+            memory_context = ""
+            if memory_enabled:
+                prefetched = prefetch_service.get_memories(chat_id)
+                if prefetched is not None:
+                    memory_context = await self._retrieve_memory_with_deadline(
+                        agent_id, chat_id, user_message, memory_size, capsule_id, prefetched
+                    )
+                else:
+                    # Vector store and cache calls block; keep them off the event loop
+                    memory_context = await asyncio.to_thread(
+                        self.retrieve_memory_context, agent_id, chat_id, user_message, memory_size, capsule_id
+                    )
 
         # Get web search context if enabled
         web_search_context = ""
-        if web_search_enabled and web_search_available():
+        web_search_enabled = web_search_enabled and web_search_available()
+        if web_search_enabled:
             try:
-                user_message = messages[-1]["content"] if messages else ""
                 if user_message:
                     logger.info(f"🔎 Performing web search for: {user_message[:50]}...")
-                    web_search_context = web_search(user_message, k=5)
+                    web_search_context = await cached_web_search(user_message, k=5)
                     if web_search_context:
                         logger.info("✅ Web search completed successfully")
             except Exception as e:
                 # logger.warning(f"Web search failed: {e}")
                 pass
 
-        enhanced_messages = self._inject_system_prompt(messages, memory_context, web_search_context)
-
-        full_content = ""
-        async for chunk in self._stream_completion(
-            enhanced_messages,
-            agent_config,
-            agent_id
-        ):
-            full_content += chunk
-            yield chunk
-
-        if chat_id and self.memory_service._is_available():
+        # Older turns already folded into the rolling summary are replaced by it
+        # (counted in turns, like the summary itself)
+        history = messages
+        summary_context = ""
+        summary = await asyncio.to_thread(summary_service.get_summary, chat_id)
+        if summary and 0 < summary.get("message_count", 0) < len(conversation_turns(messages)):
+            summary_context = summary["summary"]
+            history = messages_after_summary(messages, summary["message_count"])
+
+        # Keep the most recent turns within the budget, leaving room for the
+        # memory / web-search sections of the system prompt
+        model = agent_config.model
+        reserved = reserved_prompt_tokens(
+            model,
+            SYSTEM_PROMPT + summary_context,
+            memory_context=memory_context,
+            web_search_context=web_search_context,
+            web_search_enabled=web_search_enabled,
+            memory_enabled=memory_enabled
+        )
+        windowed_messages, context_stats = build_history_window(
+            [dict(m) for m in history],
+            model=model,
+            reserved_tokens=reserved
+        )
+        context_stats["summarized_messages"] = len(messages) - len(history)
+        if context_stats["trimmed_messages"]:
+            logger.info(
+                f"✂️  Trimmed {context_stats['trimmed_messages']} messages "
+                f"({context_stats['trimmed_tokens']} tokens) from chat {chat_id} history"
+            )
+            metrics.increment("context_trimmed_messages_total", context_stats["trimmed_messages"])
+            metrics.increment("context_trimmed_tokens_total", context_stats["trimmed_tokens"])
+        metrics.observe("context_history_tokens", context_stats["history_tokens"])
+
+        # Stable instructions and history first, per-turn context last, so
+        # provider-side prefix caching can reuse everything but the final turn
+        enhanced_messages, prompt_stats = assemble_prompt(
+            windowed_messages,
+            summary_context=summary_context,
+            memory_context=memory_context,
+            web_search_context=web_search_context,
+            model=model
+        )
+        context_stats["prompt"] = prompt_stats
+        metrics.observe("prompt_prefix_share", prompt_stats["prefix_share"])
+        return enhanced_messages, context_stats
+
+    async def _record_usage(self, agent_id: str, chat_id: Optional[str], usage: dict) -> None:
+        """Add a completion's token usage to the per-agent / per-chat totals"""
+        if not usage:
+            return
+        try:
+            # A blocking Redis write; keep it off the event loop
+            await asyncio.to_thread(cache_service.record_usage, agent_id, chat_id, usage)
+        except Exception as e:
+            logger.warning(f"Could not record usage for agent {agent_id}: {e}")
+
+    async def _after_completion(
+        self,
+        agent_id: str,
+        messages: List[Dict[str, str]],
+        full_content: str,
+        agent_config: Agent,
+        chat_id: Optional[str],
+        capsule_id: Optional[str]
+    ) -> None:
+        """Store memory for the finished turn and schedule a background summary refresh"""
+        if not chat_id:
+            return
+        conversation = messages + [{"role": "assistant", "content": full_content}]
+
+        if self.memory_service._is_available():
             try:
-                self.memory_service.store_chat_memory(
+                # Vector store and cache calls block; keep them off the event loop
+                await asyncio.to_thread(
+                    self.memory_service.store_chat_memory,
                     agent_id=agent_id,
                     chat_id=chat_id,
-                    messages=messages + [{"role": "assistant", "content": full_content}],
+                    messages=conversation,
                     capsule_id=capsule_id
                 )
             except Exception as e:
                 # logger.warning(f"Memory storage failed: {e}")
                 pass
 
+        async def complete(prompt_messages: List[Dict[str, str]]) -> str:
+            chunks = []
+            usage = {}
+            async for chunk in self._stream_completion(
+                prompt_messages, agent_config, agent_id, priority=PRIORITY_BACKGROUND, usage=usage
+            ):
+                chunks.append(chunk)
+            # Summary refreshes are billed like any other request
+            await self._record_usage(agent_id, chat_id, usage)
+            return "".join(chunks)
+
+        try:
+            summary_service.schedule_refresh(chat_id, conversation, complete)
+        except Exception as e:
+            logger.warning(f"Could not schedule summary refresh for chat {chat_id}: {e}")
+
     # ---------------------------------------------------------------------
     # SINGLE STREAM ROUTER (THE FIX)
     # ---------------------------------------------------------------------
@@ -182,12 +382,53 @@ class LLMService:
         self,
         messages: List[Dict[str, str]],
         agent_config: Agent,
-        agent_id: str
+        agent_id: str,
+        use_cache: bool = False,
+        bypass_cache: bool = False,
+        priority: int = PRIORITY_DEFAULT,
+        usage: Optional[dict] = None
     ) -> AsyncGenerator[str, None]:
 
-        platform = agent_config.platform.lower()
         model = agent_config.model
         api_key = agent_config.api_key
+        provider = self._resolve_provider(agent_config, agent_id)
+
+        # Opt-in response cache (per-agent policy); bypass skips the lookup
+        # but still refreshes the cached answer
+        cache_policy = response_cache.get_policy(agent_id) if use_cache else None
+        if cache_policy and cache_policy["enabled"] and not bypass_cache:
+            cached = await response_cache.lookup(agent_id, provider, model, messages)
+            if cached is not None:
+                if usage is not None:
+                    usage.update(prompt_tokens=0, completion_tokens=0, total_tokens=0, cached=True)
+                async for chunk in response_cache.replay(cached):
+                    yield chunk
+                return
+
+        # Route through the provider router (failover / hedging between
+        # equivalent OpenRouter and Cerebras models)
+        chunks = []
+        async with aclosing(provider_router.stream(
+            provider,
+            model,
+            api_key,
+            messages,
+            partial(self._provider_stream, priority=priority, usage=usage)
+        )) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+
+        if cache_policy and cache_policy["enabled"]:
+            try:
+                await response_cache.store(
+                    agent_id, provider, model, messages, "".join(chunks), cache_policy["ttl_seconds"]
+                )
+            except Exception as e:
+                logger.warning(f"Response cache store failed: {e}")
+
+    def _resolve_provider(self, agent_config: Agent, agent_id: str) -> str:
+        platform = agent_config.platform.lower()
 
         # 🔥 Canonical provider resolution
         if (
@@ -195,22 +436,13 @@ class LLMService:
             or "openrouter" in platform
             or agent_id in {"gpt", "mistral"}
         ):
-            provider = "openrouter"
+            return "openrouter"
         elif (
             platform == "cerebras"
             or "cerebras" in platform
         ):
-            provider = "cerebras"
-        else:
-            provider = "openrouter"  # default fallback to openrouter
-
-        async for chunk in self._provider_stream(
-            provider,
-            messages,
-            model,
-            api_key
-        ):
-            yield chunk
+            return "cerebras"
+        return "openrouter"  # default fallback to openrouter
 
     # ---------------------------------------------------------------------
     # PROVIDER STREAM IMPLEMENTATIONS
@@ -221,26 +453,54 @@ class LLMService:
         provider: str,
         messages: List[Dict[str, str]],
         model: Optional[str],
-        api_key: Optional[str]
+        api_key: Optional[str],
+        priority: int = PRIORITY_DEFAULT,
+        usage: Optional[dict] = None
     ) -> AsyncGenerator[str, None]:
 
-        if provider == "openrouter":
-            async for c in self._openrouter_stream(messages, model, api_key):
-                yield c
-        elif provider == "cerebras":
-            async for c in self._cerebras_stream(messages, model, api_key):
-                yield c
+        # Usage reported by the provider (final stream frame)
+        reported = {}
+        if provider == "cerebras":
+            stream = self._cerebras_stream(messages, model, api_key, reported)
         else:
             # Default to openrouter for all providers
-            async for c in self._openrouter_stream(messages, model, api_key):
-                yield c
+            stream = self._openrouter_stream(messages, model, api_key, reported)
+
+        # Hold a provider/key slot for the whole upstream request; queues
+        # (capsule queries first) instead of bursting into provider 429s
+        chunks = []
+        prompt_estimate = count_message_tokens(messages, model)
+        async with provider_limiter.slot(provider, api_key, prompt_estimate, priority) as slot:
+            try:
+                async with aclosing(stream):
+                    async for c in stream:
+                        chunks.append(c)
+                        yield c
+            finally:
+                slot["completion_tokens"] = (
+                    reported.get("completion_tokens") or count_tokens("".join(chunks), model)
+                )
+
+        if not reported.get("prompt_tokens"):
+            # Provider ignored stream_options: fall back to local estimates
+            completion_estimate = count_tokens("".join(chunks), model)
+            reported.update(
+                prompt_tokens=prompt_estimate,
+                completion_tokens=completion_estimate,
+                total_tokens=prompt_estimate + completion_estimate,
+                estimated=True
+            )
+        metrics.increment("llm_prompt_tokens_total", reported["prompt_tokens"], provider=provider)
+        metrics.increment("llm_completion_tokens_total", reported.get("completion_tokens") or 0, provider=provider)
+        if usage is not None:
+            usage.update(reported, provider=provider, model=model or DEFAULT_MODELS.get(provider))
 
     # ---------------------------------------------------------------------
     # PROVIDER-SPECIFIC STREAMS (MINIMAL, CLEAN)
     # ---------------------------------------------------------------------
 
-    async def _openrouter_stream(self, messages, model, api_key):
-        model = model or "openai/gpt-4-turbo"
+    async def _openrouter_stream(self, messages, model, api_key, usage=None):
+        model = model or DEFAULT_MODELS["openrouter"]
         api_key = api_key or settings.OPENROUTER_API_KEY
 
         async with httpx.AsyncClient() as client:
@@ -256,23 +516,27 @@ class LLMService:
                 json={
                     "model": model,
                     "messages": messages,
-                    "stream": True
+                    "stream": True,
+                    # Final frame carries prompt/completion token counts
+                    "stream_options": {"include_usage": True}
                 },
                 timeout=60
             ) as response:
+                response.raise_for_status()
 
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data.strip() == "[DONE]":
-                            break
-                        payload = json.loads(data)
-                        delta = payload["choices"][0].get("delta", {})
-                        if content := delta.get("content"):
-                            yield content
-
-    async def _cerebras_stream(self, messages, model, api_key):
-        model = model or "llama3.1-8b"
+                async for data in iter_sse_data(response.aiter_bytes()):
+                    try:
+                        content, reported = parse_chunk(data)
+                    except ValueError as e:
+                        logger.warning(f"Error parsing OpenRouter stream chunk: {e}")
+                        continue
+                    if reported and usage is not None:
+                        usage.update(reported)
+                    if content:
+                        yield content
+
+    async def _cerebras_stream(self, messages, model, api_key, usage=None):
+        model = model or DEFAULT_MODELS["cerebras"]
         api_key = api_key or settings.CEREBRAS_API_KEY
 
         async with httpx.AsyncClient() as client:
@@ -286,45 +550,21 @@ class LLMService:
                 json={
                     "model": model,
                     "messages": messages,
-                    "stream": True
+                    "stream": True,
+                    # Final frame carries prompt/completion token counts
+                    "stream_options": {"include_usage": True}
                 },
                 timeout=60
             ) as response:
                 response.raise_for_status()
 
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data.strip() == "[DONE]":
-                            break
-                        try:
-                            payload = json.loads(data)
-                            delta = payload.get("choices", [{}])[0].get("delta", {})
-                            if content := delta.get("content"):
-                                yield content
-                        except (json.JSONDecodeError, KeyError, IndexError) as e:
-                            logger.warning(f"Error parsing Cerebras stream chunk: {e}")
-                            continue
-
-    # ---------------------------------------------------------------------
-
-    def _inject_system_prompt(self, messages, memory_context="", web_search_context=""):
-        system_prompt = "You are a helpful assistant. Please keep your responses concise and aim for approximately 100 words. Complete your thoughts naturally within this limit."
-        
-        if web_search_context:
-            system_prompt += "\n\nYou are a web-enabled research assistant. Use the following web results to answer the question accurately. Do NOT hallucinate. Base answers strictly on the data provided.\n\nWeb results:\n" + web_search_context
-        
-        if memory_context:
-            system_prompt += f"\n\nRelevant context from memory:\n{memory_context}"
-
-        if any(m["role"] == "system" for m in messages):
-            for m in messages:
-                if m["role"] == "system":
-                    m["content"] += "\n\nPlease keep your responses concise and aim for approximately 100 words. Complete your thoughts naturally within this limit."
-                    if web_search_context:
-                        m["content"] += "\n\nYou are a web-enabled research assistant. Use the following web results to answer the question accurately. Do NOT hallucinate. Base answers strictly on the data provided.\n\nWeb results:\n" + web_search_context
-                    if memory_context:
-                        m["content"] += f"\n\nRelevant context from memory:\n{memory_context}"
-            return messages
-
-        return [{"role": "system", "content": system_prompt}] + messages
+                async for data in iter_sse_data(response.aiter_bytes()):
+                    try:
+                        content, reported = parse_chunk(data)
+                    except ValueError as e:
+                        logger.warning(f"Error parsing Cerebras stream chunk: {e}")
+                        continue
+                    if reported and usage is not None:
+                        usage.update(reported)
+                    if content:
+                        yield content
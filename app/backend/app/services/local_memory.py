@@ -0,0 +1,796 @@
+"""
+Embedded vector memory engine (offline alternative to mem0)
+
+Implements the part of the mem0 client surface MemoryService uses
+(add / search / get_all / delete) with no external services:
+- Text is embedded locally with a feature-hashing embedder (no model download)
+- Memories are sharded by agent (the mem0 user_id) and capsule: each shard
+  is a directory holding a memory-mapped float32 matrix of unit vectors plus
+  an append-only JSONL metadata sidecar (ids, text, metadata, deletions)
+- Shards are opened lazily and the least recently used are closed beyond
+  LOCAL_MEMORY_MAX_OPEN_SHARDS; deleting an agent or capsule drops its
+  shard directories instead of filtering rows
+- Search only touches the shard in scope (and, within it, the chat's rows),
+  scoring them with batched NumPy dot products (cosine, since vectors are
+  normalized) and, through a per-shard BM25 inverted index, lexically; the
+  two rankings are fused by reciprocal rank (see memory_ranking)
+- Near-duplicate memories within a chat are merged by a scheduled job
+  (memory_compaction_service): dedupe() keeps the newest of each cluster
+- Above LOCAL_MEMORY_HNSW_THRESHOLD rows an HNSW index is used instead, if
+  hnswlib is installed (built in memory on first use)
+
+Unlike mem0 there is no LLM fact extraction: each add stores the latest
+user/assistant exchange as one memory.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.memory_ranking import BM25Index, reciprocal_rank_fusion
+from app.services.embedding_cache import CachedEmbedder
+
+logger = logging.getLogger(__name__)
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    hnswlib = None  # type: ignore
+    HNSWLIB_AVAILABLE = False
+
+# Rows scored per NumPy batch (bounds temporary memory on large scopes)
+SEARCH_BLOCK_ROWS = 65536
+
+# Longest memory text stored per exchange
+MAX_MEMORY_CHARS = 4000
+
+# Shard directory for memories outside any capsule
+DEFAULT_SHARD = "_default"
+
+_WORD = re.compile(r"\w+")
+
+
+# Compactions run one at a time, off the request path
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-compaction")
+
+
+class _ShardClosed(Exception):
+    """Raised by operations on a shard that was closed or dropped meanwhile"""
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-features embedder
+
+    Words, word bigrams and character trigrams are hashed into `dim` signed
+    buckets and the result is L2-normalized. Captures lexical overlap only,
+    but needs no model, network or GPU.
+    """
+
+    model_id = "hashing-v1"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _bucket(self, feature: str) -> tuple:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        return h % self.dim, (1.0 if (h >> 63) & 1 else -1.0)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into an (n, dim) float32 matrix of unit vectors"""
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD.findall((text or "").lower())
+            features = [(w, 1.0) for w in words]
+            features += [(f"{a} {b}", 0.5) for a, b in zip(words, words[1:])]
+            for w in words:
+                padded = f"#{w}#"
+                features += [(padded[i:i + 3], 0.25) for i in range(len(padded) - 2)]
+            for feature, weight in features:
+                index, sign = self._bucket(feature)
+                out[row, index] += sign * weight
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class _Collection:
+    """
+    One shard's vectors and metadata on disk
+
+    The vectors file holds `capacity` rows (grown by doubling); meta.jsonl is
+    an append-only log of {"op": "add", ...}, {"op": "delete", "rows": [...]}
+    and {"op": "deduped", "rows": n} (dedupe watermark) records replayed on open. Vectors are written before their metadata, so
+    a crash never leaves metadata pointing at a missing vector.
+
+    Compaction writes the live rows to a new vectors file and a new log whose
+    first record names that file; replacing the log is the commit point.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._meta_path = os.path.join(path, "meta.jsonl")
+        self._generation = 0
+        # Rows below this were already checked for near-duplicates
+        self._deduped = 0
+        self._lock = threading.RLock()
+        self.rows: List[Optional[dict]] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._rows_by_chat: Dict[str, List[int]] = {}
+        self.lexical = BM25Index()
+        self.closed = False
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self._index = None
+        self._index_rows = 0
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _load(self) -> None:
+        records = []
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Torn final line from a crash mid-write
+                        continue
+
+        if records and records[0].get("op") == "header":
+            self._generation = records[0]["generation"]
+            self._vectors_path = os.path.join(self.path, records[0]["vectors"])
+        self._remove_stale_vector_files()
+
+        if os.path.exists(self._vectors_path):
+            self._capacity = os.path.getsize(self._vectors_path) // (4 * self.dim)
+            if self._capacity:
+                self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+
+        for record in records:
+            if record.get("op") == "add" and record["row"] == len(self.rows) and record["row"] < self._capacity:
+                self._track(len(self.rows), {k: record[k] for k in ("id", "memory", "metadata", "created_at")})
+            elif record.get("op") == "deduped":
+                self._deduped = record["rows"]
+            elif record.get("op") == "delete":
+                self._untrack([r for r in record.get("rows", []) if 0 <= r < len(self.rows) and self.rows[r]])
+        self._deduped = min(self._deduped, len(self.rows))
+
+    def _remove_stale_vector_files(self) -> None:
+        """Delete vector files left behind by an interrupted or finished compaction"""
+        current = os.path.basename(self._vectors_path)
+        for name in os.listdir(self.path):
+            if name.startswith("vectors") and name != current:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    def _track(self, row: int, entry: dict) -> None:
+        self._row_by_id[entry["id"]] = row
+        self._rows_by_chat.setdefault(entry["metadata"].get("chat_id"), []).append(row)
+        self.lexical.add(row, entry["memory"])
+        self.rows.append(entry)
+
+    def _untrack(self, rows: List[int]) -> None:
+        by_chat: Dict[str, set] = {}
+        for row in rows:
+            entry = self.rows[row]
+            self._row_by_id.pop(entry["id"], None)
+            self.lexical.remove(row, entry["memory"])
+            by_chat.setdefault(entry["metadata"].get("chat_id"), set()).add(row)
+            self.rows[row] = None
+        for chat_id, removed in by_chat.items():
+            remaining = [r for r in self._rows_by_chat.get(chat_id, []) if r not in removed]
+            if remaining:
+                self._rows_by_chat[chat_id] = remaining
+            else:
+                self._rows_by_chat.pop(chat_id, None)
+
+    def _check_open(self) -> None:
+        if self.closed:
+            raise _ShardClosed(self.path)
+
+    def close(self) -> None:
+        """Flush and release the memory map and in-memory state"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._vectors = None
+            self._index = None
+            self.rows = []
+            self._row_by_id = {}
+            self._rows_by_chat = {}
+            self.lexical = BM25Index()
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= self._capacity:
+            return
+        new_capacity = max(rows, self._capacity * 2, 1024)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim))
+        self._capacity = new_capacity
+
+    def _append_meta(self, records: List[dict]) -> None:
+        with open(self._meta_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in records))
+
+    # ------------------------------------------------------------------
+    # Operations
+    # ------------------------------------------------------------------
+
+    def add(self, vectors: np.ndarray, entries: List[dict]) -> None:
+        """Append rows (vectors must be unit length)"""
+        with self._lock:
+            self._check_open()
+            start = len(self.rows)
+            self._ensure_capacity(start + len(entries))
+            self._vectors[start:start + len(entries)] = vectors
+            self._vectors.flush()
+            self._append_meta([{"op": "add", "row": start + i, **e} for i, e in enumerate(entries)])
+            for i, entry in enumerate(entries):
+                self._track(start + i, entry)
+            if self._index is not None:
+                self._index_add(start, start + len(entries))
+
+    def delete_rows(self, rows: List[int]) -> int:
+        """Tombstone rows; returns how many were live"""
+        with self._lock:
+            self._check_open()
+            rows = [r for r in rows if 0 <= r < len(self.rows) and self.rows[r]]
+            if not rows:
+                return 0
+            self._append_meta([{"op": "delete", "rows": rows}])
+            if self._index is not None:
+                for row in rows:
+                    self._index.mark_deleted(row)
+            self._untrack(rows)
+            return len(rows)
+
+    def matching_rows(self, filters: Dict[str, str]) -> List[int]:
+        """Live rows whose metadata matches every filter (chat filters use the chat's row list)"""
+        with self._lock:
+            self._check_open()
+            if "chat_id" in filters:
+                candidates = self._rows_by_chat.get(filters["chat_id"], [])
+            else:
+                candidates = range(len(self.rows))
+            return [i for i in candidates if self.rows[i] and _matches(self.rows[i]["metadata"], filters)]
+
+    def entries(self, rows: List[int]) -> List[dict]:
+        """Row entries (skipping rows deleted meanwhile)"""
+        with self._lock:
+            self._check_open()
+            return [self.rows[r] for r in rows if r < len(self.rows) and self.rows[r]]
+
+    def live_count(self) -> int:
+        return len(self._row_by_id)
+
+    def dead_count(self) -> int:
+        """Tombstoned rows still taking space on disk"""
+        return len(self.rows) - len(self._row_by_id)
+
+    def compact(self) -> int:
+        """
+        Rewrite the shard without tombstoned rows
+
+        Returns:
+            Number of rows reclaimed
+        """
+        with self._lock:
+            self._check_open()
+            live = [i for i, entry in enumerate(self.rows) if entry]
+            reclaimed = len(self.rows) - len(live)
+            if not reclaimed:
+                return 0
+
+            generation = self._generation + 1
+            vectors_name = f"vectors.{generation}.f32"
+            vectors_path = os.path.join(self.path, vectors_name)
+            capacity = max(len(live), 1024)
+            with open(vectors_path, "wb") as f:
+                f.truncate(capacity * self.dim * 4)
+            vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+            for start in range(0, len(live), SEARCH_BLOCK_ROWS):
+                block = live[start:start + SEARCH_BLOCK_ROWS]
+                vectors[start:start + len(block)] = self._vectors[block]
+            vectors.flush()
+
+            entries = [self.rows[i] for i in live]
+            deduped = bisect_right(live, self._deduped - 1)
+            tmp_meta = self._meta_path + ".tmp"
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"op": "header", "generation": generation, "vectors": vectors_name}) + "\n")
+                f.write(json.dumps({"op": "deduped", "rows": deduped}) + "\n")
+                f.write("".join(json.dumps({"op": "add", "row": i, **e}) + "\n" for i, e in enumerate(entries)))
+                f.flush()
+                os.fsync(f.fileno())
+            # Commit point: the new log names the new vectors file
+            os.replace(tmp_meta, self._meta_path)
+
+            old_vectors_path = self._vectors_path
+            self._vectors.flush()
+            self._vectors = vectors
+            self._vectors_path = vectors_path
+            self._capacity = capacity
+            self._generation = generation
+            self._deduped = deduped
+            self._index = None
+            self.rows = []
+            self._row_by_id = {}
+            self._rows_by_chat = {}
+            self.lexical = BM25Index()
+            for row, entry in enumerate(entries):
+                self._track(row, entry)
+            try:
+                os.remove(old_vectors_path)
+            except OSError:
+                pass
+        metrics.increment("local_memory_compactions_total")
+        metrics.increment("local_memory_compacted_rows_total", reclaimed)
+        return reclaimed
+
+    def dedupe(self, threshold: float) -> List[dict]:
+        """
+        Tombstone memories superseded by a newer near-duplicate in the same chat
+
+        Incremental: only rows added since the last pass are compared, each
+        against the older rows of its chat, so every pair is checked once.
+
+        Args:
+            threshold: Cosine similarity at which two memories count as duplicates
+
+        Returns:
+            The removed entries
+        """
+        with self._lock:
+            self._check_open()
+            start = self._deduped
+            if start >= len(self.rows):
+                return []
+            superseded = set()
+            for chat_rows in self._rows_by_chat.values():
+                first_new = bisect_right(chat_rows, start - 1)
+                if first_new == len(chat_rows):
+                    continue
+                vectors = np.asarray(self._vectors[chat_rows])
+                # Block over the new rows to bound the similarity matrix
+                block_rows = max(1, SEARCH_BLOCK_ROWS // max(len(chat_rows), 1))
+                for block_start in range(max(first_new, 1), len(chat_rows), block_rows):
+                    block_end = min(block_start + block_rows, len(chat_rows))
+                    sims = vectors[block_start:block_end] @ vectors[:block_end - 1].T
+                    for offset, row_sims in enumerate(sims):
+                        # Only older rows; the newer memory supersedes them
+                        older = row_sims[:block_start + offset]
+                        superseded.update(chat_rows[j] for j in np.nonzero(older >= threshold)[0])
+            removed = [self.rows[r] for r in sorted(superseded)]
+            self.delete_rows(sorted(superseded))
+            self._deduped = len(self.rows)
+            self._append_meta([{"op": "deduped", "rows": self._deduped}])
+            return removed
+
+    def search(self, query: np.ndarray, rows: List[int], k: int) -> List[tuple]:
+        """Top-k (row, score) among `rows` by cosine similarity"""
+        if not rows or k <= 0:
+            return []
+        with self._lock:
+            self._check_open()
+            if (
+                HNSWLIB_AVAILABLE
+                and self.live_count() >= settings.LOCAL_MEMORY_HNSW_THRESHOLD
+                and len(rows) > k * 4
+            ):
+                hits = self._index_search(query, set(rows), k)
+                if len(hits) == k:
+                    return hits
+
+            candidates = np.asarray(rows, dtype=np.int64)
+            scores = np.empty(len(candidates), dtype=np.float32)
+            for start in range(0, len(candidates), SEARCH_BLOCK_ROWS):
+                block = candidates[start:start + SEARCH_BLOCK_ROWS]
+                scores[start:start + len(block)] = self._vectors[block] @ query
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+    # ------------------------------------------------------------------
+    # HNSW index (optional, in memory)
+    # ------------------------------------------------------------------
+
+    def _index_add(self, start: int, end: int) -> None:
+        if end > self._index.get_max_elements():
+            self._index.resize_index(max(end, self._index.get_max_elements() * 2))
+        live = [r for r in range(start, end) if self.rows[r]]
+        if live:
+            self._index.add_items(np.asarray(self._vectors[live]), np.asarray(live))
+        self._index_rows = end
+
+    def _index_search(self, query: np.ndarray, allowed: set, k: int) -> List[tuple]:
+        if self._index is None:
+            self._index = hnswlib.Index(space="ip", dim=self.dim)
+            self._index.init_index(max_elements=max(len(self.rows), 1024), ef_construction=200, M=16)
+            self._index_add(0, len(self.rows))
+            logger.info(f"Built HNSW index over {self._index_rows} memories in {self.path}")
+        self._index.set_ef(max(64, k * 8))
+        try:
+            labels, distances = self._index.knn_query(
+                query, k=min(k, self.live_count()), filter=lambda label: label in allowed
+            )
+        except RuntimeError:
+            # Too few matches reachable under the filter; caller falls back to exact search
+            return []
+        # hnswlib's "ip" distance is 1 - dot product
+        return [(int(label), 1.0 - float(d)) for label, d in zip(labels[0], distances[0])]
+
+
+def _memory_text(messages: List[Dict[str, str]]) -> str:
+    """The latest user turn and the replies after it, as one memory"""
+    last_user = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=None)
+    turn = messages[last_user:] if last_user is not None else messages[-2:]
+    text = "\n".join(
+        f"{m.get('role')}: {m.get('content', '').strip()}"
+        for m in turn
+        if m.get("role") in ("user", "assistant") and m.get("content")
+    )
+    return text[:MAX_MEMORY_CHARS]
+
+
+def _matches(metadata: dict, filters: Dict[str, str]) -> bool:
+    return all(metadata.get(key) == value for key, value in filters.items())
+
+
+def _hash_dir(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:24]
+
+
+class LocalMemory:
+    """mem0-compatible memory store backed by local files, sharded by agent and capsule"""
+
+    def __init__(self, path: Optional[str] = None, embedder: Optional[HashingEmbedder] = None):
+        self.path = path or settings.LOCAL_MEMORY_PATH
+        # Repeated queries and re-ingested turns are served from the embedding cache
+        self.embedder = embedder or CachedEmbedder(HashingEmbedder(settings.LOCAL_MEMORY_EMBEDDING_DIM))
+        # Open shards by directory, least recently used first
+        self._shards: "OrderedDict[str, _Collection]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Shards
+    # ------------------------------------------------------------------
+
+    def _agent_dir(self, user_id: str) -> str:
+        return os.path.join(self.path, _hash_dir(user_id))
+
+    def _shard_dir(self, user_id: str, capsule_id: Optional[str]) -> str:
+        return os.path.join(self._agent_dir(user_id), _hash_dir(capsule_id) if capsule_id else DEFAULT_SHARD)
+
+    def _agent_shard_dirs(self, user_id: str) -> List[str]:
+        agent_dir = self._agent_dir(user_id)
+        if not os.path.isdir(agent_dir):
+            return []
+        return [os.path.join(agent_dir, name) for name in sorted(os.listdir(agent_dir))]
+
+    def _open(self, shard_dir: str) -> _Collection:
+        """Open a shard (or reuse it), closing the least recently used beyond the limit"""
+        with self._lock:
+            shard = self._shards.get(shard_dir)
+            if shard is not None:
+                self._shards.move_to_end(shard_dir)
+                return shard
+            shard = _Collection(shard_dir, self.embedder.dim)
+            self._shards[shard_dir] = shard
+            while len(self._shards) > max(1, settings.LOCAL_MEMORY_MAX_OPEN_SHARDS):
+                _, evicted = self._shards.popitem(last=False)
+                evicted.close()
+                metrics.increment("local_memory_shard_evictions_total")
+            metrics.set_gauge("local_memory_open_shards", len(self._shards))
+            return shard
+
+    def _with_shard(self, shard_dir: str, operation: Callable[[_Collection], object]):
+        """Run an operation on a shard, reopening it if it was closed underneath us"""
+        while True:
+            try:
+                return operation(self._open(shard_dir))
+            except _ShardClosed:
+                continue
+
+    def _drop(self, shard_dirs: List[str]) -> int:
+        """Close and delete whole shards; returns the number of memories dropped"""
+        dropped = 0
+        with self._lock:
+            for shard_dir in shard_dirs:
+                shard = self._shards.pop(shard_dir, None)
+                if shard is None and os.path.isdir(shard_dir):
+                    shard = _Collection(shard_dir, self.embedder.dim)
+                if shard is not None:
+                    dropped += shard.live_count()
+                    shard.close()
+                shutil.rmtree(shard_dir, ignore_errors=True)
+            metrics.set_gauge("local_memory_open_shards", len(self._shards))
+        return dropped
+
+    def _format(self, entry: dict, user_id: str, score: Optional[float] = None) -> dict:
+        result = {
+            "id": entry["id"],
+            "memory": entry["memory"],
+            "metadata": entry["metadata"],
+            "user_id": user_id,
+            "created_at": entry["created_at"],
+        }
+        if score is not None:
+            result["score"] = round(score, 6)
+        return result
+
+    # ------------------------------------------------------------------
+    # mem0 surface
+    # ------------------------------------------------------------------
+
+    def add(self, messages: List[Dict[str, str]], user_id: str, metadata: Optional[dict] = None) -> dict:
+        """Store the latest exchange of a conversation as a memory"""
+        text = _memory_text(messages)
+        if not text:
+            return {"results": []}
+        metadata = dict(metadata or {})
+
+        vector = self.embedder.embed([text])
+
+        def add_to(shard: _Collection) -> dict:
+            with shard._lock:
+                # Same exchange stored twice for the same chat (e.g. a retried save)
+                for entry in shard.entries(shard.matching_rows(metadata)):
+                    if entry["memory"] == text:
+                        return {"results": [{"id": entry["id"], "memory": text, "event": "NONE"}]}
+                entry = {
+                    "id": str(uuid.uuid4()),
+                    "memory": text,
+                    "metadata": metadata,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                }
+                shard.add(vector, [entry])
+            return {"results": [{"id": entry["id"], "memory": text, "event": "ADD"}]}
+
+        return self._with_shard(self._shard_dir(user_id, metadata.get("capsule_id")), add_to)
+
+    def search(self, query: str, user_id: str, metadata: Optional[dict] = None, limit: int = 5) -> List[dict]:
+        """
+        Memories in a scope matching the metadata, most relevant to the query first
+
+        Vector matches (at least MEMORY_MIN_SIMILARITY) and BM25 matches are
+        fused by reciprocal rank; "score" is the fused score (0..1).
+        """
+        filters = dict(metadata or {})
+        vector = self.embedder.embed([query])[0] if query and query.strip() else None
+        # Candidates taken from each ranking before fusing
+        candidates = max(limit * 4, 20)
+
+        def search_in(shard: _Collection) -> List[dict]:
+            # One lock hold, so rows can't be deleted between filtering and scoring
+            with shard._lock:
+                rows = shard.matching_rows(filters)
+                if vector is None:
+                    # No query: most recent memories
+                    return [self._format(e, user_id) for e in reversed(shard.entries(rows[-limit:]))]
+                similar = [
+                    (row, score) for row, score in shard.search(vector, rows, candidates)
+                    if score >= settings.MEMORY_MIN_SIMILARITY
+                ]
+                lexical = shard.lexical.top(query, candidates, allowed=rows)
+                similarity = dict(similar)
+                lexical_scores = dict(lexical)
+                fused = reciprocal_rank_fusion([[row for row, _ in similar], [row for row, _ in lexical]])
+                return [
+                    {
+                        **self._format(shard.rows[row], user_id, score),
+                        "vector_score": round(similarity[row], 6) if row in similarity else None,
+                        "lexical_score": round(lexical_scores.get(row, 0.0), 6),
+                    }
+                    for row, score in fused[:limit]
+                ]
+
+        return self._with_shard(self._shard_dir(user_id, filters.get("capsule_id")), search_in)
+
+    def _scoped_dirs(self, filters: Dict[str, str]) -> Tuple[str, List[str], Dict[str, str]]:
+        """(user_id, shard dirs in scope, remaining row filters) for get_all/delete filters"""
+        filters = dict(filters)
+        user_id = filters.pop("user_id")
+        if "capsule_id" in filters:
+            return user_id, [self._shard_dir(user_id, filters["capsule_id"])], filters
+        # Without a capsule, a chat's memories may be in any of the agent's shards
+        return user_id, self._agent_shard_dirs(user_id), filters
+
+    def get_all(self, filters: Dict[str, str]) -> List[dict]:
+        """All memories matching filters (must include user_id), oldest first per shard"""
+        user_id, shard_dirs, filters = self._scoped_dirs(filters)
+        results = []
+        for shard_dir in shard_dirs:
+            if not os.path.isdir(shard_dir):
+                continue
+            entries = self._with_shard(shard_dir, lambda shard: shard.entries(shard.matching_rows(filters)))
+            results.extend(self._format(e, user_id) for e in entries)
+        return results
+
+    def page(self, filters: Dict[str, str], after: Optional[dict] = None, limit: int = 100) -> dict:
+        """
+        One page of get_all, in a stable order (shard, then insertion)
+
+        Args:
+            filters: As for get_all (must include user_id)
+            after: Position returned as `next` by the previous page, None for the first
+            limit: Page size
+
+        Returns:
+            {"results": [...], "next": position or None, "total": exact match count}
+        """
+        user_id, shard_dirs, filters = self._scoped_dirs(filters)
+        total = 0
+        page: List[tuple] = []
+        for shard_dir in sorted(d for d in shard_dirs if os.path.isdir(d)):
+            name = os.path.relpath(shard_dir, self.path)
+
+            def read(shard: _Collection) -> tuple:
+                with shard._lock:
+                    rows = shard.matching_rows(filters)
+                    if after is None or name > after["shard"]:
+                        start = 0
+                    elif name < after["shard"]:
+                        start = len(rows)
+                    elif after["id"] in shard._row_by_id:
+                        start = bisect_right(rows, shard._row_by_id[after["id"]])
+                    else:
+                        # The last memory of the previous page was deleted since
+                        start = next((i for i, r in enumerate(rows) if shard.rows[r]["created_at"] > after["created_at"]), len(rows))
+                    return len(rows), shard.entries(rows[start:start + limit + 1 - len(page)])
+
+            count, entries = self._with_shard(shard_dir, read)
+            total += count
+            page.extend((name, e) for e in entries)
+
+        next_position = None
+        if len(page) > limit:
+            name, last = page[limit - 1]
+            next_position = {"shard": name, "id": last["id"], "created_at": last["created_at"]}
+            page = page[:limit]
+        return {"results": [self._format(e, user_id) for _, e in page], "next": next_position, "total": total}
+
+    def delete(self, filters: Dict[str, str]) -> dict:
+        """
+        Delete all memories matching filters (must include user_id)
+
+        Deleting a whole agent or capsule drops its shard directories;
+        narrower filters (e.g. a chat) tombstone the matching rows.
+        """
+        user_id, shard_dirs, filters = self._scoped_dirs(filters)
+        row_filters = {k: v for k, v in filters.items() if k not in ("capsule_id", "agent_id")}
+        if not row_filters:
+            deleted = self._drop(shard_dirs)
+            if "capsule_id" not in filters:
+                shutil.rmtree(self._agent_dir(user_id), ignore_errors=True)
+            return {"deleted": deleted}
+
+        deleted = 0
+        for shard_dir in shard_dirs:
+            if os.path.isdir(shard_dir):
+                deleted += self._with_shard(shard_dir, lambda shard: shard.delete_rows(shard.matching_rows(filters)))
+                self._maybe_compact(shard_dir)
+        return {"deleted": deleted}
+
+    def delete_capsule(self, capsule_id: str) -> int:
+        """Drop a capsule's shards across every agent; returns the number of memories dropped"""
+        capsule_dir = _hash_dir(capsule_id)
+        shard_dirs = [
+            os.path.join(self.path, agent_dir, capsule_dir)
+            for agent_dir in os.listdir(self.path)
+            if os.path.isdir(os.path.join(self.path, agent_dir, capsule_dir))
+        ]
+        return self._drop(shard_dirs)
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _needs_compaction(shard: _Collection) -> bool:
+        dead = shard.dead_count()
+        return dead >= settings.LOCAL_MEMORY_COMPACTION_MIN_DEAD and dead >= len(shard.rows) * settings.LOCAL_MEMORY_COMPACTION_DEAD_RATIO
+
+    def _maybe_compact(self, shard_dir: str) -> None:
+        """Schedule a background compaction once enough of a shard is tombstones"""
+        with self._lock:
+            shard = self._shards.get(shard_dir)
+        if shard is None or shard.closed:
+            return
+        if self._needs_compaction(shard):
+            _compactor.submit(self._compact, shard_dir)
+
+    def _compact(self, shard_dir: str) -> int:
+        # The shard may have been dropped while queued; don't recreate it
+        if not os.path.isdir(shard_dir):
+            return 0
+        try:
+            reclaimed = self._with_shard(shard_dir, lambda shard: shard.compact())
+            if reclaimed:
+                logger.info(f"Compacted memory shard {shard_dir}: reclaimed {reclaimed} rows")
+            return reclaimed
+        except Exception as e:
+            logger.warning(f"Memory shard compaction failed for {shard_dir}: {e}")
+            return 0
+
+
+    @staticmethod
+    def shard_version(shard_dir: str) -> Optional[int]:
+        """Version of a shard (its metadata log's mtime, which changes whenever the shard does)"""
+        try:
+            return os.stat(os.path.join(shard_dir, "meta.jsonl")).st_mtime_ns
+        except OSError:
+            return None
+
+    def shard_versions(self) -> Dict[str, int]:
+        """Every shard on disk with its version"""
+        versions = {}
+        for agent_dir in os.listdir(self.path):
+            agent_path = os.path.join(self.path, agent_dir)
+            if not os.path.isdir(agent_path):
+                continue
+            for name in os.listdir(agent_path):
+                version = self.shard_version(os.path.join(agent_path, name))
+                if version is not None:
+                    versions[os.path.join(agent_path, name)] = version
+        return versions
+
+    def dedupe_shard(self, shard_dir: str, threshold: float) -> dict:
+        """
+        Merge near-duplicate memories in a shard, compacting it if that leaves enough tombstones
+
+        Returns:
+            {"removed": [entries dropped as duplicates], "reclaimed": rows compacted away}
+        """
+        if not os.path.isdir(shard_dir):
+            return {"removed": [], "reclaimed": 0}
+        removed = self._with_shard(shard_dir, lambda shard: shard.dedupe(threshold))
+        reclaimed = 0
+        if self._with_shard(shard_dir, self._needs_compaction):
+            # Already on a background thread: compact in place (also rebuilds the indexes)
+            reclaimed = self._compact(shard_dir)
+        return {"removed": removed, "reclaimed": reclaimed}
+
+
+_local_memory: Optional[LocalMemory] = None
+_local_memory_lock = threading.Lock()
+
+
+def get_local_memory() -> LocalMemory:
+    """Process-wide LocalMemory (collections are shared by every MemoryService)"""
+    global _local_memory
+    with _local_memory_lock:
+        if _local_memory is None:
+            _local_memory = LocalMemory()
+        return _local_memory
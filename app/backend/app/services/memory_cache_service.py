@@ -0,0 +1,107 @@
+"""
+Memory search result cache
+
+Follow-up questions in a chat often search memory with nearly the same
+wording. Results are cached in CacheService (shared across replicas) for
+MEMORY_SEARCH_CACHE_TTL_SECONDS, keyed by:
+    (agent_id, chat_id, capsule_id, normalized query, limit, generation)
+
+The generation combines a per-chat counter, bumped whenever the chat's
+memories are stored or deleted, with per-agent and per-capsule counters,
+bumped when all of an agent's or capsule's memories are deleted. Every
+cached search in the scope is invalidated at once (old entries simply stop
+being looked up and expire). The three generations are read in one round
+trip.
+
+Searches run in a worker thread (see LLMService), so the blocking
+CacheService calls stay off the event loop. The local engine searches in
+process faster than a cache round trip, so it is not cached.
+"""
+from typing import List, Dict, Optional
+import hashlib
+import re
+import time
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.cache_service import cache_service
+
+
+def normalize_memory_query(query: str) -> str:
+    """Normalize a memory query (case, whitespace, trailing punctuation)"""
+    return re.sub(r"\s+", " ", query or "").strip().lower().rstrip("?!. ")
+
+
+class MemorySearchCache:
+    """Shared cache of mem0 search results with per-chat invalidation"""
+
+    def __init__(self):
+        # Rolling average of uncached search latency, used to estimate time saved by hits
+        self._avg_search_ms: Optional[float] = None
+
+    def key(
+        self,
+        agent_id: str,
+        chat_id: str,
+        capsule_id: Optional[str],
+        query: str,
+        limit: int
+    ) -> Optional[str]:
+        """
+        Cache key for a search in the chat's (and its agent's and capsule's)
+        current memory generation, None if the generations can't be read
+        """
+        generations = cache_service.get_memory_generations(agent_id, chat_id, capsule_id)
+        if generations is None:
+            return None
+        scope = f"{agent_id}\x1f{chat_id}\x1f{capsule_id or ''}\x1f{normalize_memory_query(query)}"
+        digest = hashlib.sha256(scope.encode("utf-8")).hexdigest()[:32]
+        return f"{digest}:{limit}:{'.'.join(str(g) for g in generations)}"
+
+    def get(self, cache_key: str) -> Optional[List[Dict]]:
+        """Cached memories for a key, or None on a miss"""
+        entry = cache_service.get_memory_search(cache_key)
+        # Entries also record their own expiry; never serve one past it
+        if entry and entry.get("expires_at", 0) > time.time():
+            metrics.increment("memory_search_cache_lookups_total", outcome="hit")
+            if self._avg_search_ms is not None:
+                metrics.increment("memory_search_cache_saved_ms_total", round(self._avg_search_ms, 1))
+            self._update_hit_rate()
+            return entry["memories"]
+        metrics.increment("memory_search_cache_lookups_total", outcome="miss")
+        self._update_hit_rate()
+        return None
+
+    def put(self, cache_key: str, memories: List[Dict], search_ms: float) -> None:
+        """Cache the result of an uncached search that took search_ms"""
+        self._avg_search_ms = search_ms if self._avg_search_ms is None else 0.8 * self._avg_search_ms + 0.2 * search_ms
+        metrics.observe("memory_search_ms", search_ms)
+        cache_service.set_memory_search(
+            cache_key,
+            {"memories": memories, "expires_at": time.time() + settings.MEMORY_SEARCH_CACHE_TTL_SECONDS},
+            settings.MEMORY_SEARCH_CACHE_TTL_SECONDS
+        )
+
+    def invalidate(self, agent_id: str, chat_id: str) -> None:
+        """Invalidate every cached search for a chat (all capsules, queries and limits)"""
+        cache_service.bump_memory_generation(agent_id, chat_id)
+        metrics.increment("memory_search_cache_invalidations_total")
+
+    def invalidate_agent(self, agent_id: str) -> None:
+        """Invalidate every cached search for an agent (all of its chats)"""
+        cache_service.bump_memory_scope_generation("agent", agent_id)
+        metrics.increment("memory_search_cache_invalidations_total")
+
+    def invalidate_capsule(self, capsule_id: str) -> None:
+        """Invalidate every cached search scoped to a capsule (across agents)"""
+        cache_service.bump_memory_scope_generation("capsule", capsule_id)
+        metrics.increment("memory_search_cache_invalidations_total")
+
+    def _update_hit_rate(self) -> None:
+        hits = metrics.counter("memory_search_cache_lookups_total", outcome="hit")
+        total = hits + metrics.counter("memory_search_cache_lookups_total", outcome="miss")
+        metrics.set_gauge("memory_search_cache_hit_rate", round(hits / total, 4) if total else 0.0)
+
+
+# Global memory search cache instance
+memory_search_cache = MemorySearchCache()
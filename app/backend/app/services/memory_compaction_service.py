@@ -0,0 +1,126 @@
+"""
+Scheduled memory compaction (near-duplicate merging)
+
+Each turn re-ingests recent history, so a chat accumulates near-identical
+memories that crowd search results and repeat in the prompt. Every
+MEMORY_COMPACTION_INTERVAL_SECONDS a background job goes over the local
+memory engine's shards (one per agent and capsule) and, per chat:
+- Clusters memories whose embeddings are at least MEMORY_DEDUP_SIMILARITY
+  alike and keeps only the newest (older versions of a fact are superseded)
+- Compacts the shard once enough rows are deleted, rebuilding its indexes
+
+Runs are incremental: shards unchanged since the last run are skipped and,
+within a shard, only memories added since its last pass are compared.
+Each run's report is logged and exposed under /metrics.
+
+mem0 backends resolve duplicates themselves when memories are added, so the
+job only runs with the local engine.
+"""
+from typing import Dict, Optional
+import asyncio
+import logging
+import time
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.local_memory import get_local_memory
+from app.services.memory_cache_service import memory_search_cache
+from app.services.memory_service import MemoryService
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCompactionService:
+    """Periodic near-duplicate merging for the local memory engine"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        # Shard directory -> metadata log version when it was last compacted
+        self._versions: Dict[str, int] = {}
+        self.last_run: Optional[dict] = None
+
+    def start(self) -> None:
+        """Start the schedule (no-op if disabled or not using the local engine)"""
+        if settings.MEMORY_COMPACTION_INTERVAL_SECONDS <= 0 or self._task:
+            return
+        if not MemoryService().use_local:
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"🧹 Memory compaction scheduled every {settings.MEMORY_COMPACTION_INTERVAL_SECONDS}s")
+
+    async def stop(self) -> None:
+        """Cancel the schedule (a run in progress finishes in its thread)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.MEMORY_COMPACTION_INTERVAL_SECONDS)
+            try:
+                # Reads and rewrites shard files; keep it off the event loop
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.warning(f"Memory compaction run failed: {e}")
+
+    def run_once(self) -> dict:
+        """
+        Compact every shard changed since the last run
+
+        Returns:
+            Report: {"scopes", "skipped", "removed", "reclaimed", "duration_ms", "finished_at"}
+        """
+        started = time.perf_counter()
+        memory = get_local_memory()
+        report = {"scopes": 0, "skipped": 0, "removed": 0, "reclaimed": 0}
+
+        versions = memory.shard_versions()
+        for shard_dir in set(self._versions) - set(versions):
+            # Shard dropped since (agent or capsule deleted)
+            self._versions.pop(shard_dir, None)
+
+        for shard_dir, version in versions.items():
+            if self._versions.get(shard_dir) == version:
+                report["skipped"] += 1
+                continue
+            try:
+                result = memory.dedupe_shard(shard_dir, settings.MEMORY_DEDUP_SIMILARITY)
+            except Exception as e:
+                logger.warning(f"Memory compaction failed for {shard_dir}: {e}")
+                continue
+            report["scopes"] += 1
+            report["removed"] += len(result["removed"])
+            report["reclaimed"] += result["reclaimed"]
+
+            # Cached searches of the affected chats may still list the removed memories
+            chats = {
+                (entry["metadata"].get("agent_id"), entry["metadata"].get("chat_id"))
+                for entry in result["removed"]
+            }
+            for agent_id, chat_id in chats:
+                if agent_id and chat_id:
+                    memory_search_cache.invalidate(agent_id, chat_id)
+            self._versions[shard_dir] = memory.shard_version(shard_dir)
+
+        report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        report["finished_at"] = time.time()
+        self.last_run = report
+
+        metrics.increment("memory_compaction_runs_total")
+        metrics.increment("memory_compaction_removed_total", report["removed"])
+        metrics.set_gauge("memory_compaction_last_removed", report["removed"])
+        metrics.observe("memory_compaction_ms", report["duration_ms"])
+        if report["removed"] or report["reclaimed"]:
+            logger.info(
+                f"🧹 Memory compaction: removed {report['removed']} near-duplicate memories "
+                f"in {report['scopes']} scope(s), reclaimed {report['reclaimed']} rows"
+            )
+        return report
+
+
+# Global memory compaction service (one schedule per process)
+memory_compaction_service = MemoryCompactionService()
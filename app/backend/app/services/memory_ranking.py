@@ -0,0 +1,185 @@
+"""
+Hybrid (lexical + vector) memory ranking
+
+Vector search alone misses exact names and terms, and always returns `limit`
+results however weak they are. Memories are instead ranked by:
+- Vector similarity, ignoring matches below MEMORY_MIN_SIMILARITY
+- Okapi BM25 over the memory text (BM25Index, an inverted index)
+Only memories passing one of these gates on their raw signal are fused by
+reciprocal rank (MEMORY_RRF_K), so unrelated memories never reach the prompt.
+The fused score is normalized to 0..1 (1.0 = first in both rankings); being
+rank-based it says nothing absolute, so the MEMORY_MIN_SCORE cutoff is
+relative to the best result and trims the tail behind a strong match.
+
+The local engine keeps a BM25Index per shard; for mem0 backends the lexical
+ranking is computed over an oversampled set of vector candidates.
+"""
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+import math
+import re
+
+from app.core.config import settings
+
+_WORD = re.compile(r"\w+")
+
+# Function words (and the role labels local memories are stored with) that would
+# otherwise make every memory a weak lexical match
+STOPWORDS = frozenset(
+    "a about am an and are as at be but by can did do does for from had has have how i if in is it its "
+    "me my of on or so that the their them there they this to was we were what when where which who "
+    "why will with you your user assistant".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, without stopwords"""
+    return [w for w in _WORD.findall((text or "").lower()) if w not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory inverted index scored with Okapi BM25
+
+    Documents are keyed by any hashable (row number, memory ID, ...) and can
+    be added and removed incrementally.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._lengths: Dict[Hashable, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, key: Hashable, text: str) -> None:
+        """Index a document (replacing any previous text for the key)"""
+        if key in self._lengths:
+            self.remove(key)
+        terms = tokenize(text)
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[key] = tf
+        self._lengths[key] = len(terms)
+        self._total_length += len(terms)
+
+    def remove(self, key: Hashable, text: Optional[str] = None) -> None:
+        """
+        Drop a document
+        Pass its text to touch only its own postings (otherwise every posting list is scanned)
+        """
+        length = self._lengths.pop(key, None)
+        if length is None:
+            return
+        self._total_length -= length
+        terms = set(tokenize(text)) if text is not None else list(self._postings)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings and postings.pop(key, None) is not None and not postings:
+                del self._postings[term]
+
+    def top(self, query: str, k: int, allowed: Optional[Iterable[Hashable]] = None) -> List[Tuple[Hashable, float]]:
+        """
+        Best k (key, score) for a query, restricted to `allowed` keys if given
+        Only documents sharing at least one term with the query are returned.
+        """
+        if not self._lengths or k <= 0:
+            return []
+        if allowed is not None and not isinstance(allowed, (set, frozenset)):
+            allowed = set(allowed)
+        n = len(self._lengths)
+        avg_length = self._total_length / n or 1.0
+        scores: Dict[Hashable, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, tf in postings.items():
+                if allowed is not None and key not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / avg_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda kv: -kv[1])[:k]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+    """
+    Fuse rankings (best first) by reciprocal rank
+
+    Returns:
+        (key, score) best first; the score is normalized so that ranking first
+        in every list gives 1.0
+    """
+    k = settings.MEMORY_RRF_K if k is None else k
+    if not rankings:
+        return []
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    best = len(rankings) / (k + 1)
+    return sorted(((key, score / best) for key, score in fused.items()), key=lambda kv: -kv[1])
+
+
+def similarity_from_distance(distance: Optional[float]) -> Optional[float]:
+    """
+    Cosine similarity from a squared L2 distance between unit vectors
+    (what open-source mem0's Chroma store reports as "score")
+    """
+    return None if distance is None else 1.0 - distance / 2.0
+
+
+def hybrid_rank(query: str, memories: List[Dict], min_similarity: Optional[float] = None) -> List[Dict]:
+    """
+    Rerank vector search results (best first) with BM25 over their text
+
+    Args:
+        query: Search query
+        memories: Candidates as returned by the vector store, most similar
+            first, with a cosine similarity "score"
+        min_similarity: Vector matches below this are ignored (default
+            MEMORY_MIN_SIMILARITY)
+
+    Returns:
+        Copies of the memories at least min_similarity alike or sharing a term
+        with the query, best first, with "score" (fused), "vector_score" and
+        "lexical_score"
+    """
+    min_similarity = settings.MEMORY_MIN_SIMILARITY if min_similarity is None else min_similarity
+    lexical = BM25Index()
+    for i, memory in enumerate(memories):
+        lexical.add(i, memory.get("memory", ""))
+    lexical_scores = dict(lexical.top(query, len(memories)))
+
+    vector_ranking = [
+        i for i, memory in enumerate(memories)
+        if memory.get("score") is not None and memory["score"] >= min_similarity
+    ]
+    fused = reciprocal_rank_fusion([vector_ranking, list(lexical_scores)])
+    return [
+        {
+            **memories[i],
+            "score": round(score, 6),
+            "vector_score": memories[i].get("score"),
+            "lexical_score": round(lexical_scores.get(i, 0.0), 6),
+        }
+        for i, score in fused
+    ]
+
+
+def select_memories(memories: List[Dict], limit: int, min_score: Optional[float] = None) -> List[Dict]:
+    """
+    Best `limit` fused memories scoring at least min_score (default
+    MEMORY_MIN_SCORE) times the best one's
+    """
+    min_score = settings.MEMORY_MIN_SCORE if min_score is None else min_score
+    ranked = sorted(memories, key=lambda m: -(m.get("score") or 0.0))
+    if not ranked:
+        return []
+    floor = min_score * (ranked[0].get("score") or 0.0)
+    return [m for m in ranked if (m.get("score") or 0.0) >= floor][:limit]
@@ -1,9 +1,56 @@
 from typing import List, Dict, Optional
+import base64
+import json
 import logging
+import time
 from app.core.config import settings
+from app.services.memory_cache_service import memory_search_cache
+from app.services.local_memory import get_local_memory
+from app.services.cache_service import cache_service
+from app.services.memory_ranking import hybrid_rank, select_memories, similarity_from_distance
+from app.services.context_service import count_tokens
+from app.services.embedding_cache import embedding_cache
+from app.core.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+
+class _CachedMem0Embedding:
+    """Open-source mem0 embedding model served through the shared embedding cache"""
+    
+    def __init__(self, model):
+        self.model = model
+        config = getattr(model, "config", None)
+        # Namespace by provider and model; the memory action too, since some providers embed queries differently
+        self.namespace = f"mem0:{type(model).__name__}:{getattr(config, 'model', None)}:{getattr(config, 'embedding_dims', None)}"
+    
+    def embed(self, text, memory_action=None):
+        vector = embedding_cache.embed(
+            f"{self.namespace}:{memory_action}",
+            [text],
+            lambda texts: [self.model.embed(t, memory_action) for t in texts]
+        )[0]
+        return vector.tolist()
+    
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def encode_cursor(position: dict) -> str:
+    """Opaque pagination cursor for a listing position"""
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Listing position from a cursor (raises ValueError if it is malformed)"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
 # Try to import MemoryClient (Platform API) first, fallback to Memory (open-source)
 MEM0_PLATFORM_AVAILABLE = False
 Memory = None
@@ -36,6 +83,14 @@ except Exception as e:
         Memory = None
         # logger.debug(f"Memory import also failed: {type(e2).__name__}: {e2}")
 
+# Open-source mem0 is the "auto" fallback whenever it is installed (not only
+# when the Platform client fails to import)
+if Memory is None:
+    try:
+        from mem0 import Memory
+    except Exception:
+        Memory = None
+
 class MemoryService:
     """
     Service for managing semantic memory using mem0
@@ -47,18 +102,24 @@ class MemoryService:
     - Memory size configuration
     - Memory tracking and verification
     
-    Supports both:
+    Supports (see MEMORY_BACKEND), in order of preference:
     - Mem0 Platform (hosted) via MemoryClient with MEM0_API_KEY
-    - Open-source mem0 with local ChromaDB (fallback)
+    - Open-source mem0 with local ChromaDB (if installed)
+    - The embedded local engine (app.services.local_memory), fully offline;
+      used when mem0 is unavailable or with MEMORY_BACKEND=local
     """
     
     def __init__(self):
-        """Initialize mem0 - prefer Platform API, fallback to open-source"""
+        """Initialize memory - prefer Platform API, then open-source mem0, then the local engine"""
         self.memory = None
         self.use_platform = False
+        self.use_local = False
+        backend = settings.MEMORY_BACKEND.lower()
         
         # Try Mem0 Platform first (if API key is provided and import succeeded)
-        if settings.MEM0_API_KEY and MEM0_PLATFORM_AVAILABLE:
+        if backend == "local":
+            pass
+        elif settings.MEM0_API_KEY and MEM0_PLATFORM_AVAILABLE:
             try:
                 self.memory = MemoryClient(api_key=settings.MEM0_API_KEY)
                 self.use_platform = True
@@ -81,7 +142,7 @@ class MemoryService:
             pass
         
         # Fallback to open-source mem0 with local ChromaDB
-        if not self.memory and Memory is not None:
+        if not self.memory and Memory is not None and backend in ("auto", "mem0"):
             try:
                 # Build config with vector store
                 config = {
@@ -95,12 +156,23 @@ class MemoryService:
                 }
                 
                 self.memory = Memory.from_config(config)
+                if getattr(self.memory, "embedding_model", None) is not None:
+                    self.memory.embedding_model = _CachedMem0Embedding(self.memory.embedding_model)
                 # logger.info("✅ MemoryService initialized with open-source mem0 (ChromaDB)")
                 # logger.warning("⚠️  Using local storage - memories not trackable via Mem0 dashboard")
             except Exception as e:
                 # logger.error(f"Failed to initialize open-source mem0: {e}")
                 self.memory = None
         
+        # Fallback to the embedded local engine (no services, no model downloads);
+        # auto only gets here without mem0, so existing ChromaDB memories stay in use
+        if not self.memory and backend in ("auto", "local"):
+            try:
+                self.memory = get_local_memory()
+                self.use_local = True
+            except Exception as e:
+                logger.warning(f"Local memory engine unavailable: {e}")
+        
         if not self.memory:
             # logger.error("❌ MemoryService initialization failed - memory features disabled")
             # if settings.MEM0_API_KEY:
@@ -129,16 +201,21 @@ class MemoryService:
         """
         Retrieve relevant memories for a chat (scoped by capsule if provided)
         
+        Memories are ranked by hybrid (BM25 + vector) retrieval; those neither
+        MEMORY_MIN_SIMILARITY alike nor sharing a term with the query, or
+        scoring below MEMORY_MIN_SCORE of the best match, are dropped, so
+        fewer than `limit` may come back.
+        
         Args:
             agent_id: Agent identifier (used as user_id in mem0)
             chat_id: Chat identifier (stored in metadata)
             query: Search query (usually the user's message)
             memory_size: Memory size setting ('Small', 'Medium', 'Large')
-            limit: Optional override for memory limit
+            limit: Optional override for the maximum number of memories
             capsule_id: Optional capsule ID for memory isolation
         
         Returns:
-            List of memory dictionaries with 'memory' and 'metadata' keys
+            List of memory dictionaries with 'memory', 'metadata' and 'score' keys, best first
         """
         if not self._is_available():
             # logger.warning("Memory service not available, returning empty memories")
@@ -153,18 +230,43 @@ class MemoryService:
             }
             limit = limits.get(memory_size, 5)
         
+        # Follow-ups with the same wording reuse the last search for this chat
+        # (not with the local engine, whose search is cheaper than the round trips)
+        cache_key = None
+        if settings.MEMORY_SEARCH_CACHE_ENABLED and not self.use_local:
+            cache_key = memory_search_cache.key(agent_id, chat_id, capsule_id, query, limit)
+            cached = memory_search_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                return cached
+        
         try:
             # Build metadata with capsule scope for isolation
             metadata = {"chat_id": chat_id, "agent_id": agent_id}
             if capsule_id:
                 metadata["capsule_id"] = capsule_id
             
-            memories = self.memory.search(
-                query=query,
-                user_id=agent_id,
-                metadata=metadata,
-                limit=limit
-            )
+            started = time.perf_counter()
+            if self.use_local:
+                # The local engine fuses vector and BM25 rankings itself
+                candidates = self.memory.search(query=query, user_id=agent_id, metadata=metadata, limit=limit)
+            else:
+                # Oversample mem0's vector results and rerank them with BM25
+                candidates = self.memory.search(
+                    query=query,
+                    user_id=agent_id,
+                    metadata=metadata,
+                    limit=limit * settings.MEMORY_HYBRID_OVERSAMPLE
+                )
+                candidates = candidates.get("results", []) if isinstance(candidates, dict) else candidates
+                if not self.use_platform:
+                    # Open-source mem0 (Chroma) reports distances; gate on similarity like the other backends
+                    candidates = [{**c, "score": similarity_from_distance(c.get("score"))} for c in candidates]
+                candidates = hybrid_rank(query, candidates)
+            memories = select_memories(candidates, limit)
+            if len(candidates) > len(memories):
+                metrics.increment("memory_results_dropped_total", len(candidates) - len(memories))
+            if cache_key:
+                memory_search_cache.put(cache_key, memories, (time.perf_counter() - started) * 1000)
             
             scope_info = f" (capsule: {capsule_id})" if capsule_id else ""
             # logger.info(f"🔍 Retrieved {len(memories)} memories for chat {chat_id}{scope_info} (query: '{query[:50]}...')")
@@ -214,6 +316,16 @@ class MemoryService:
                 user_id=agent_id,
                 metadata=metadata
             )
+            memory_search_cache.invalidate(agent_id, chat_id)
+            
+            # Open-source mem0 can't delete by metadata: remember which IDs belong to the chat
+            if not (self.use_platform or self.use_local):
+                memory_ids = self._result_memory_ids(result)
+                if memory_ids:
+                    cache_service.add_memory_ids(agent_id, chat_id, capsule_id, memory_ids)
+                deleted_ids = self._result_memory_ids(result, events=("DELETE",))
+                if deleted_ids:
+                    cache_service.remove_memory_ids(agent_id, chat_id, deleted_ids)
             
             # Enhanced logging for tracking
             scope_info = f" (capsule: {capsule_id})" if capsule_id else ""
@@ -233,12 +345,16 @@ class MemoryService:
             # logger.error(f"   Agent: {agent_id}, Messages: {len(messages)}")
             return False
     
-    def format_memory_context(self, memories: List[Dict]) -> str:
+    def format_memory_context(self, memories: List[Dict], max_tokens: Optional[int] = None) -> str:
         """
         Format memories into a context string for LLM prompts
         
+        Highest-scoring memories come first; lower ones that would push the
+        section past the token budget are left out.
+        
         Args:
             memories: List of memory dictionaries from get_chat_memories
+            max_tokens: Token budget (default CONTEXT_MEMORY_RESERVE_TOKENS)
         
         Returns:
             Formatted string with memory context
@@ -246,11 +362,22 @@ class MemoryService:
         if not memories:
             return ""
         
+        budget = settings.CONTEXT_MEMORY_RESERVE_TOKENS if max_tokens is None else max_tokens
+        # Stable sort: memories without scores keep the backend's order
+        ranked = sorted(memories, key=lambda m: -(m.get("score") or 0.0))
         memory_lines = []
-        for mem in memories:
+        used = 0
+        for mem in ranked:
             memory_text = mem.get("memory", "")
-            if memory_text:
-                memory_lines.append(f"- {memory_text}")
+            if not memory_text:
+                continue
+            line = f"- {memory_text}"
+            tokens = count_tokens(line) + 1
+            if used + tokens > budget:
+                metrics.increment("memory_context_trimmed_total")
+                continue
+            memory_lines.append(line)
+            used += tokens
         
         if memory_lines:
             return "\n".join(memory_lines)
@@ -265,6 +392,9 @@ class MemoryService:
         """
         Get all memories for a specific chat (for verification/tracking)
         
+        Reads every page of list_chat_memories; prefer that (or the NDJSON
+        export endpoint) for large chats.
+        
         Args:
             agent_id: Agent identifier
             chat_id: Chat identifier
@@ -273,36 +403,110 @@ class MemoryService:
         Returns:
             List of all memory dictionaries for this chat
         """
+        memories: List[Dict] = []
+        cursor = None
+        while True:
+            page = self.list_chat_memories(agent_id, chat_id, capsule_id, cursor=cursor)
+            memories.extend(page["memories"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                return memories
+    
+    def list_chat_memories(
+        self,
+        agent_id: str,
+        chat_id: str,
+        capsule_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> Dict:
+        """
+        One page of a chat's memories
+        
+        Args:
+            agent_id: Agent identifier
+            chat_id: Chat identifier
+            capsule_id: Optional capsule ID for filtering
+            cursor: next_cursor from the previous page (None for the first page)
+            limit: Page size (default MEMORY_PAGE_SIZE, capped at MEMORY_PAGE_MAX_SIZE)
+        
+        Returns:
+            {"memories": [...], "next_cursor": str or None, "total": exact memory count}
+        
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        limit = max(1, min(limit or settings.MEMORY_PAGE_SIZE, settings.MEMORY_PAGE_MAX_SIZE))
+        position = decode_cursor(cursor) if cursor else None
+        empty = {"memories": [], "next_cursor": None, "total": 0}
         if not self._is_available():
             logger.warning("Memory service not available")
-            return []
+            return empty
         
+        filters = {"user_id": agent_id, "chat_id": chat_id}
+        if capsule_id:
+            filters["capsule_id"] = capsule_id
         try:
+            if self.use_local:
+                page = self.memory.page(filters, after=position, limit=limit)
+                return {
+                    "memories": page["results"],
+                    "next_cursor": encode_cursor(page["next"]) if page["next"] else None,
+                    "total": page["total"],
+                }
             if self.use_platform:
-                # Use Platform API's get_all with filters (include capsule_id if provided)
-                filters = {"user_id": agent_id, "chat_id": chat_id}
-                if capsule_id:
-                    filters["capsule_id"] = capsule_id
-                memories = self.memory.get_all(
-                    filters=filters
-                )
-            else:
-                # For open-source, search with a broad query (filtered by capsule if provided)
-                metadata = {"chat_id": chat_id, "agent_id": agent_id}
-                if capsule_id:
-                    metadata["capsule_id"] = capsule_id
-                memories = self.memory.search(
-                    query="",
-                    user_id=agent_id,
-                    metadata=metadata,
-                    limit=100  # Get up to 100 memories
-                )
-            
-            # logger.info(f"📋 Found {len(memories)} total memories for chat {chat_id}")
-            return memories
+                return self._list_platform_memories(filters, (position or {}).get("page", 1), limit)
+            return self._list_indexed_memories(agent_id, chat_id, capsule_id, (position or {}).get("offset", 0), limit)
         except Exception as e:
-            # logger.error(f"Error getting all memories for chat {chat_id}: {e}")
-            return []
+            # logger.error(f"Error listing memories for chat {chat_id}: {e}")
+            return empty
+    
+    def _list_platform_memories(self, filters: Dict, page: int, limit: int) -> Dict:
+        """Platform API: server-side pages with an exact count"""
+        response = self.memory.get_all(filters=filters, page=page, page_size=limit)
+        if isinstance(response, dict):
+            return {
+                "memories": response.get("results", []),
+                "next_cursor": encode_cursor({"page": page + 1}) if response.get("next") else None,
+                "total": response.get("count", len(response.get("results", []))),
+            }
+        # Older clients ignore paging and return the full list
+        offset = (page - 1) * limit
+        return {
+            "memories": response[offset:offset + limit],
+            "next_cursor": encode_cursor({"page": page + 1}) if offset + limit < len(response) else None,
+            "total": len(response),
+        }
+    
+    def _list_indexed_memories(
+        self,
+        agent_id: str,
+        chat_id: str,
+        capsule_id: Optional[str],
+        offset: int,
+        limit: int
+    ) -> Dict:
+        """Open-source mem0: pages over the chat's memory ID index"""
+        memory_ids = cache_service.get_memory_ids(agent_id, chat_id)
+        if not memory_ids:
+            # Chats stored before the index existed: best effort, capped by mem0's search
+            metadata = {"chat_id": chat_id, "agent_id": agent_id}
+            if capsule_id:
+                metadata["capsule_id"] = capsule_id
+            memories = self.memory.search(query="", user_id=agent_id, metadata=metadata, limit=100)
+            memories = memories.get("results", []) if isinstance(memories, dict) else memories
+            return {"memories": memories, "next_cursor": None, "total": len(memories)}
+        
+        memories = []
+        for memory_id in memory_ids[offset:offset + limit]:
+            memory = self.memory.get(memory_id)
+            if memory:
+                memories.append(memory)
+        return {
+            "memories": memories,
+            "next_cursor": encode_cursor({"offset": offset + limit}) if offset + limit < len(memory_ids) else None,
+            "total": len(memory_ids),
+        }
     
     def delete_chat_memories(
         self,
@@ -324,18 +528,109 @@ class MemoryService:
             return False
         
         try:
-            if self.use_platform:
-                # Platform API supports delete with filters
+            if self.use_platform or self.use_local:
+                # Platform API (and the local engine) support delete with filters
                 result = self.memory.delete(
                     filters={"user_id": agent_id, "chat_id": chat_id}
                 )
+                memory_search_cache.invalidate(agent_id, chat_id)
                 # logger.info(f"✅ Deleted memories for chat {chat_id}")
                 return True
             else:
-                # For open-source, this is more complex
-                # logger.warning(f"Delete by metadata not fully supported in open-source mem0 for chat {chat_id}")
-                return False
+                # Open-source mem0: delete the IDs recorded for the chat in one batch
+                return self._delete_indexed_chats([(agent_id, chat_id)])
         except Exception as e:
             # logger.error(f"Error deleting memories for chat {chat_id}: {e}")
             return False
-
+    
+    def delete_agent_memories(self, agent_id: str) -> bool:
+        """
+        Delete all memories of an agent (every chat and capsule)
+        
+        With the local engine this drops the agent's shards outright.
+        
+        Args:
+            agent_id: Agent identifier
+        
+        Returns:
+            True if deletion was successful, False otherwise
+        """
+        if not self._is_available():
+            return False
+        
+        try:
+            if self.use_platform or self.use_local:
+                self.memory.delete(filters={"user_id": agent_id})
+                return True
+            chats = cache_service.get_memory_indexed_chats(agent_id)
+            return self._delete_indexed_chats([(agent_id, chat_id) for chat_id in chats])
+        except Exception as e:
+            # logger.error(f"Error deleting memories for agent {agent_id}: {e}")
+            return False
+        finally:
+            # Cached searches of any chat may list deleted memories (even if deletion failed midway)
+            memory_search_cache.invalidate_agent(agent_id)
+    
+    def delete_capsule_memories(self, capsule_id: str) -> bool:
+        """
+        Delete all memories stored under a capsule (across agents)
+        
+        Args:
+            capsule_id: Capsule identifier
+        
+        Returns:
+            True if deletion was successful, False otherwise
+        """
+        if not self._is_available():
+            return False
+        
+        try:
+            if self.use_local:
+                self.memory.delete_capsule(capsule_id)
+                return True
+            if self.use_platform:
+                self.memory.delete(filters={"capsule_id": capsule_id})
+                return True
+            pairs = cache_service.get_capsule_memory_indexed_chats(capsule_id)
+            return self._delete_indexed_chats([(agent_id, chat_id) for agent_id, chat_id in pairs])
+        except Exception as e:
+            # logger.error(f"Error deleting memories for capsule {capsule_id}: {e}")
+            return False
+        finally:
+            # Cached searches of any chat may list deleted memories (even if deletion failed midway)
+            memory_search_cache.invalidate_capsule(capsule_id)
+    
+    # ------------------------------------------------------------------
+    # Open-source mem0 deletion via the memory ID index
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _result_memory_ids(result, events: tuple = ("ADD", "UPDATE")) -> List[str]:
+        """Memory IDs a mem0 add() call reported with one of the given events"""
+        items = result.get("results", []) if isinstance(result, dict) else (result or [])
+        return [
+            item["id"] for item in items
+            if isinstance(item, dict) and item.get("id") and item.get("event", "ADD") in events
+        ]
+    
+    def _delete_indexed_chats(self, chats: List[tuple]) -> bool:
+        """Delete every indexed memory of the given (agent_id, chat_id) pairs in one batch"""
+        memory_ids = []
+        for agent_id, chat_id in chats:
+            memory_ids.extend(cache_service.get_memory_ids(agent_id, chat_id))
+        if memory_ids:
+            self._delete_memory_ids(list(dict.fromkeys(memory_ids)))
+        for agent_id, chat_id in chats:
+            cache_service.delete_memory_index(agent_id, chat_id)
+            memory_search_cache.invalidate(agent_id, chat_id)
+        logger.info(f"🗑️  Deleted {len(memory_ids)} memories for {len(chats)} chat(s)")
+        return True
+    
+    def _delete_memory_ids(self, memory_ids: List[str]) -> None:
+        # One call to the vector store when it exposes batch deletion (Chroma does)
+        collection = getattr(getattr(self.memory, "vector_store", None), "collection", None)
+        if collection is not None and hasattr(collection, "delete"):
+            collection.delete(ids=memory_ids)
+        else:
+            for memory_id in memory_ids:
+                self.memory.delete(memory_id=memory_id)
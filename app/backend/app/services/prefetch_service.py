@@ -0,0 +1,142 @@
+"""
+Speculative prefetch of chat context when a chat is opened
+
+Opening a chat (GET /chats/{chat_id}) tells us the agent, chat and capsule
+scope before the user has typed anything. When MEMORY_PREFETCH_ENABLED is
+set, a background task then:
+- Pre-resolves the agent config (skips the agent lookup on send)
+- Retrieves the chat's top memories, using the latest user message as the query
+
+Entries live in-process for MEMORY_PREFETCH_TTL_SECONDS. On send, the
+query-specific memory search still runs, but if it misses
+MEMORY_SEARCH_DEADLINE_MS the prefetched memories are used instead.
+"""
+from typing import Dict, List, Optional
+import asyncio
+import time
+import logging
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.models.schemas import Agent, Chat
+from app.services.agent_service import AgentService
+from app.services.memory_service import MemoryService
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchService:
+    """
+    Short-lived per-chat cache of agent config and top memories
+
+    An entry looks like:
+        {"wallet_address", "agent", "memories", "expires_at"}
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, dict] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Bumped when an agent changes, so prefetches already running don't store its old config
+        self._agent_versions: Dict[str, int] = {}
+        self._memory_service: Optional[MemoryService] = None
+
+    def schedule(self, chat: Chat, agent_id: str, wallet_address: Optional[str]) -> None:
+        """Start a background prefetch for a chat (no-op if disabled, fresh or running)"""
+        if not settings.MEMORY_PREFETCH_ENABLED or not wallet_address:
+            return
+        self._purge_expired()
+        if chat.id in self._entries or chat.id in self._inflight:
+            return
+
+        task = asyncio.create_task(self._prefetch(chat, agent_id, wallet_address))
+        self._inflight[chat.id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(chat.id, None))
+
+    def get_agent(self, chat_id: str, agent_id: str, wallet_address: Optional[str]) -> Optional[Agent]:
+        """Pre-resolved agent config for a chat, if prefetched by the same wallet"""
+        entry = self._get_entry(chat_id)
+        if not entry or entry["wallet_address"] != wallet_address or entry["agent"].id != agent_id:
+            return None
+        metrics.increment("memory_prefetch_agent_hits_total")
+        return entry["agent"]
+
+    def get_memories(self, chat_id: Optional[str]) -> Optional[List[Dict]]:
+        """Prefetched memories for a chat (None if nothing was prefetched)"""
+        entry = self._get_entry(chat_id) if chat_id else None
+        return entry["memories"] if entry else None
+
+    def invalidate(self, chat_id: str) -> None:
+        """Drop a chat's prefetched entry (e.g. when the chat is deleted)"""
+        self._entries.pop(chat_id, None)
+        task = self._inflight.pop(chat_id, None)
+        if task:
+            task.cancel()
+
+    def invalidate_agent(self, agent_id: str) -> None:
+        """Drop every prefetched entry of an agent (e.g. when it is updated or deleted)"""
+        self._agent_versions[agent_id] = self._agent_versions.get(agent_id, 0) + 1
+        for chat_id in [c for c, e in self._entries.items() if e["agent"].id == agent_id]:
+            self._entries.pop(chat_id, None)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _get_entry(self, chat_id: str) -> Optional[dict]:
+        entry = self._entries.get(chat_id)
+        if entry and entry["expires_at"] < time.monotonic():
+            self._entries.pop(chat_id, None)
+            return None
+        return entry
+
+    def _purge_expired(self) -> None:
+        now = time.monotonic()
+        for chat_id in [c for c, e in self._entries.items() if e["expires_at"] < now]:
+            self._entries.pop(chat_id, None)
+
+    async def _prefetch(self, chat: Chat, agent_id: str, wallet_address: str) -> None:
+        started = time.perf_counter()
+        try:
+            actual_agent_id = chat.agent_id if chat.agent_id else agent_id
+            version = self._agent_versions.get(actual_agent_id, 0)
+            agent = await AgentService().get_agent(actual_agent_id, wallet_address)
+            if not agent:
+                return
+
+            if self._memory_service is None:
+                self._memory_service = MemoryService()
+
+            memories: List[Dict] = []
+            if self._memory_service._is_available():
+                # The latest user message is the best guess at the next topic
+                last_user = next((m.content for m in reversed(chat.messages) if m.role.value == "user"), None)
+                memory_size = chat.memory_size.value if hasattr(chat.memory_size, 'value') else str(chat.memory_size)
+                # Memory search is blocking; keep it off the event loop
+                memories = await asyncio.to_thread(
+                    self._memory_service.get_chat_memories,
+                    agent_id=actual_agent_id,
+                    chat_id=chat.id,
+                    query=last_user or chat.name,
+                    memory_size=memory_size,
+                    capsule_id=getattr(chat, 'capsule_id', None)
+                )
+
+            if self._agent_versions.get(actual_agent_id, 0) != version:
+                # The agent changed while this prefetch ran
+                return
+            self._entries[chat.id] = {
+                "wallet_address": wallet_address,
+                "agent": agent,
+                "memories": memories,
+                "expires_at": time.monotonic() + settings.MEMORY_PREFETCH_TTL_SECONDS,
+            }
+            metrics.increment("memory_prefetches_total")
+            metrics.observe("memory_prefetch_ms", (time.perf_counter() - started) * 1000)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Memory prefetch failed for chat {chat.id}: {e}")
+
+
+# Global prefetch service instance (entries are per process)
+prefetch_service = PrefetchService()
@@ -0,0 +1,103 @@
+"""
+Prompt assembly with a cache-friendly layout
+
+Providers cache prompts by prefix (OpenAI, DeepSeek, Gemini, Anthropic via
+OpenRouter, ...), so anything that changes every turn must come after
+everything that doesn't. Messages are laid out as:
+
+1. Stable system instructions (identical on every turn of an agent)
+2. The rolling conversation summary (changes only when it is refreshed)
+3. Older history, as stored
+4. The latest user turn, with this turn's volatile context (web results,
+   retrieved memories) placed just before the question
+
+The input messages are never mutated; new message dicts are built. The
+stats report how much of the request is a prefix the next turn can reuse.
+"""
+from typing import List, Dict, Optional, Tuple
+
+from app.services.context_service import count_tokens, MESSAGE_OVERHEAD_TOKENS
+
+CONCISE_INSTRUCTION = "Please keep your responses concise and aim for approximately 100 words. Complete your thoughts naturally within this limit."
+
+SYSTEM_PROMPT = f"You are a helpful assistant. {CONCISE_INSTRUCTION}"
+
+WEB_SEARCH_INSTRUCTION = "You are a web-enabled research assistant. Use the following web results to answer the question accurately. Do NOT hallucinate. Base answers strictly on the data provided."
+
+# Separates the volatile context from the user's question in the final turn
+QUESTION_SEPARATOR = "\n\nQuestion:\n"
+
+
+def _volatile_context(memory_context: str, web_search_context: str) -> str:
+    """Per-turn context block placed right before the user's question"""
+    sections = []
+    if web_search_context:
+        sections.append(f"{WEB_SEARCH_INSTRUCTION}\n\nWeb results:\n{web_search_context}")
+    if memory_context:
+        sections.append(f"Relevant context from memory:\n{memory_context}")
+    return "\n\n".join(sections)
+
+
+def user_question(content: str) -> str:
+    """The user's own text from a final turn built by assemble_prompt"""
+    context, separator, question = content.partition(QUESTION_SEPARATOR)
+    return question if separator else content
+
+
+def assemble_prompt(
+    messages: List[Dict[str, str]],
+    summary_context: str = "",
+    memory_context: str = "",
+    web_search_context: str = "",
+    model: Optional[str] = None
+) -> Tuple[List[Dict[str, str]], Dict]:
+    """
+    Build the provider messages for a turn
+
+    Leading system messages from the caller replace the default system prompt
+    (with the length instruction appended); any other messages are kept in
+    order.
+
+    Args:
+        messages: Windowed chat history, oldest first (not modified)
+        summary_context: Rolling summary of the turns dropped from the history
+        memory_context: Formatted memories retrieved for this turn
+        web_search_context: Formatted web results for this turn
+        model: Model identifier used for token counting
+
+    Returns:
+        Tuple of (messages, stats dict with prefix_tokens, total_tokens, prefix_share)
+    """
+    leading = 0
+    while leading < len(messages) and messages[leading].get("role") == "system":
+        leading += 1
+
+    if leading:
+        instructions = "\n\n".join(m.get("content", "") for m in messages[:leading])
+        system_content = f"{instructions}\n\n{CONCISE_INSTRUCTION}"
+    else:
+        system_content = SYSTEM_PROMPT
+
+    assembled = [{"role": "system", "content": system_content}]
+    if summary_context:
+        assembled.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary_context}"})
+
+    history = [dict(m) for m in messages[leading:]]
+    context = _volatile_context(memory_context, web_search_context)
+    if context:
+        if history and history[-1].get("role") == "user":
+            history[-1]["content"] = f"{context}{QUESTION_SEPARATOR}{history[-1].get('content', '')}"
+        else:
+            history.append({"role": "system", "content": context})
+    assembled.extend(history)
+
+    # Everything before the final message is sent unchanged on the next turn
+    message_tokens = [count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in assembled]
+    total_tokens = sum(message_tokens)
+    prefix_tokens = total_tokens - message_tokens[-1]
+    stats = {
+        "prefix_tokens": prefix_tokens,
+        "total_tokens": total_tokens,
+        "prefix_share": round(prefix_tokens / total_tokens, 4) if total_tokens else 0.0,
+    }
+    return assembled, stats
@@ -0,0 +1,457 @@
+"""
+Latency-aware provider routing
+
+Tracks rolling time-to-first-token (TTFT) and error rates per provider/model
+and uses them to:
+- Fail over between OpenRouter and Cerebras for equivalent models when a
+  request fails before the first token (5xx, 429, timeouts, connection errors)
+- Optionally hedge: fire a second request on the equivalent model when the
+  first token hasn't arrived within the primary's p95 TTFT, keep whichever
+  answers first and cancel the loser
+- Retry transient failures with exponential backoff and jitter (honouring
+  Retry-After on 429), and resume streams that fail mid-answer by
+  re-requesting with the partial answer as an assistant prefix
+"""
+from typing import List, Dict, Optional, AsyncGenerator, Callable, Tuple, Deque
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+import asyncio
+import json
+import random
+import re
+import time
+import logging
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import metrics, percentile
+from app.services.rate_limiter import ProviderBusyError
+
+logger = logging.getLogger(__name__)
+
+# Default model per provider when the agent doesn't set one
+DEFAULT_MODELS = {
+    "openrouter": "openai/gpt-4-turbo",
+    "cerebras": "llama3.1-8b",
+}
+
+# OpenRouter model -> equivalent Cerebras model (used in both directions)
+DEFAULT_MODEL_EQUIVALENTS = {
+    "meta-llama/llama-3.1-8b-instruct": "llama3.1-8b",
+    "meta-llama/llama-3.3-70b-instruct": "llama-3.3-70b",
+    "qwen/qwen3-32b": "qwen-3-32b",
+    "openai/gpt-oss-120b": "gpt-oss-120b",
+}
+
+# Minimum samples before rolling stats are trusted
+MIN_SAMPLES = 5
+
+# Shortest restatement of already-sent text stripped from a resumed stream
+MIN_RESUME_OVERLAP_CHARS = 16
+
+ProviderStreamFn = Callable[[str, List[Dict[str, str]], Optional[str], Optional[str]], AsyncGenerator[str, None]]
+
+
+@dataclass(frozen=True)
+class Route:
+    """A concrete provider/model/key to send a request to"""
+    provider: str
+    model: str
+    api_key: Optional[str]
+
+
+class _RouteStats:
+    def __init__(self, window: int):
+        self.ttft_ms: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)  # True = success
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Errors worth failing over on: 5xx, 429, timeouts, transport errors and a saturated local queue"""
+    if isinstance(error, ProviderBusyError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, httpx.TimeoutException))
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Server-requested delay from a 429/503 Retry-After header (seconds or HTTP date)"""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay_seconds(attempt: int, error: Optional[BaseException] = None) -> Optional[float]:
+    """
+    Delay before retry number `attempt` (1-based)
+
+    Exponential backoff with equal jitter, raised to the provider's Retry-After
+    if it sent one. Returns None when Retry-After is longer than
+    PROVIDER_RETRY_MAX_DELAY_MS (not worth holding the request open).
+    """
+    ceiling = settings.PROVIDER_RETRY_MAX_DELAY_MS / 1000
+    backoff = min(ceiling, settings.PROVIDER_RETRY_BASE_DELAY_MS / 1000 * 2 ** (attempt - 1))
+    delay = backoff / 2 + random.uniform(0, backoff / 2)
+    requested = retry_after_seconds(error) if error is not None else None
+    if requested is not None:
+        if requested > ceiling:
+            return None
+        delay = max(delay, requested)
+    return delay
+
+
+def _restatable_suffixes(emitted: str) -> List[str]:
+    """
+    Suffixes of the emitted text a restarted stream may repeat, longest first:
+    starting on a word boundary and at least MIN_RESUME_OVERLAP_CHARS long
+    """
+    return [
+        emitted[m.start():] for m in re.finditer(r"(?<!\w)\w", emitted)
+        if len(emitted) - m.start() >= MIN_RESUME_OVERLAP_CHARS
+    ]
+
+
+def _strip_restatement(text: str, suffixes: List[str]) -> str:
+    """Drop the longest suffix of the emitted text that `text` starts with"""
+    overlap = next((s for s in suffixes if text.startswith(s)), None)
+    if overlap is None:
+        return text
+    metrics.increment("provider_resume_restarts_total")
+    return text[len(overlap):]
+
+
+async def _skip_repeated_prefix(gen: AsyncGenerator[str, None], emitted: str) -> AsyncGenerator[str, None]:
+    """
+    Drop a resumed stream's restatement of the text already sent
+
+    Models usually continue from an assistant prefix, but some restart the
+    answer or repeat its last sentence. Only a repeat of a meaningful suffix
+    of the emitted text (see _restatable_suffixes) is dropped. Output is held
+    back only while it could still be one, so a real continuation passes
+    through immediately.
+    """
+    suffixes = _restatable_suffixes(emitted)
+    pending = ""
+    matching = bool(suffixes)
+    async for chunk in gen:
+        if not matching:
+            yield chunk
+            continue
+        pending += chunk
+        if any(len(s) > len(pending) and s.startswith(pending) for s in suffixes):
+            continue
+        matching = False
+        text = _strip_restatement(pending, suffixes)
+        if text:
+            yield text
+    if matching and pending:
+        # Stream ended while still looking like a restatement
+        text = _strip_restatement(pending, suffixes)
+        if text:
+            yield text
+
+
+def _load_equivalents() -> Dict[str, Dict[str, str]]:
+    """Build provider -> {model -> equivalent model on the other provider}"""
+    pairs = dict(DEFAULT_MODEL_EQUIVALENTS)
+    if settings.PROVIDER_MODEL_EQUIVALENTS:
+        try:
+            pairs.update(json.loads(settings.PROVIDER_MODEL_EQUIVALENTS))
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid PROVIDER_MODEL_EQUIVALENTS, using defaults: {e}")
+    return {
+        "openrouter": {o: c for o, c in pairs.items()},
+        "cerebras": {c: o for o, c in pairs.items()},
+    }
+
+
+class ProviderRouter:
+    """Routes provider streams using rolling TTFT / error-rate stats"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], _RouteStats] = {}
+        self._equivalents = _load_equivalents()
+
+    # ------------------------------------------------------------------
+    # Stats
+    # ------------------------------------------------------------------
+
+    def _route_stats(self, provider: str, model: str) -> _RouteStats:
+        key = (provider, model)
+        if key not in self._stats:
+            self._stats[key] = _RouteStats(settings.PROVIDER_STATS_WINDOW)
+        return self._stats[key]
+
+    def record_ttft(self, route: Route, ttft_ms: float) -> None:
+        stats = self._route_stats(route.provider, route.model)
+        stats.ttft_ms.append(ttft_ms)
+        stats.outcomes.append(True)
+        metrics.observe("provider_ttft_ms", ttft_ms, provider=route.provider, model=route.model)
+
+    def record_error(self, route: Route, error: BaseException) -> None:
+        self._route_stats(route.provider, route.model).outcomes.append(False)
+        metrics.increment(
+            "provider_errors_total",
+            provider=route.provider,
+            model=route.model,
+            error=type(error).__name__
+        )
+
+    def p95_ttft_ms(self, provider: str, model: str) -> Optional[float]:
+        """Rolling p95 TTFT, or None if there are too few samples"""
+        samples = self._route_stats(provider, model).ttft_ms
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return percentile(sorted(samples), 95)
+
+    def error_rate(self, provider: str, model: str) -> float:
+        outcomes = self._route_stats(provider, model).outcomes
+        if len(outcomes) < MIN_SAMPLES:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def snapshot(self) -> dict:
+        """Current per-route stats (for diagnostics)"""
+        return {
+            f"{provider}:{model}": {
+                "p95_ttft_ms": self.p95_ttft_ms(provider, model),
+                "error_rate": self.error_rate(provider, model),
+                "samples": len(stats.outcomes),
+            }
+            for (provider, model), stats in self._stats.items()
+        }
+
+    # ------------------------------------------------------------------
+    # Route selection
+    # ------------------------------------------------------------------
+
+    def candidates(self, provider: str, model: Optional[str], api_key: Optional[str]) -> List[Route]:
+        """
+        Ordered routes for a request: the requested one plus an equivalent
+        model on the other provider (only if a server key is configured for it,
+        since the agent's own key is only valid for its own platform)
+        """
+        model = model or DEFAULT_MODELS.get(provider, DEFAULT_MODELS["openrouter"])
+        routes = [Route(provider, model, api_key)]
+
+        if settings.PROVIDER_FAILOVER_ENABLED:
+            alternate_provider = "cerebras" if provider == "openrouter" else "openrouter"
+            alternate_model = self._equivalents.get(provider, {}).get(model)
+            alternate_key = (
+                settings.CEREBRAS_API_KEY if alternate_provider == "cerebras" else settings.OPENROUTER_API_KEY
+            )
+            if alternate_model and alternate_key:
+                routes.append(Route(alternate_provider, alternate_model, alternate_key))
+
+        # Prefer the alternate while the primary is clearly unhealthy
+        if len(routes) > 1:
+            primary_errors = self.error_rate(routes[0].provider, routes[0].model)
+            alternate_errors = self.error_rate(routes[1].provider, routes[1].model)
+            if primary_errors >= settings.PROVIDER_ERROR_RATE_THRESHOLD and alternate_errors < primary_errors:
+                routes.reverse()
+        return routes
+
+    def hedge_delay_seconds(self, route: Route) -> float:
+        """Delay before firing the hedge request, based on the route's p95 TTFT"""
+        p95 = self.p95_ttft_ms(route.provider, route.model)
+        delay_ms = p95 if p95 is not None else settings.PROVIDER_HEDGE_DEFAULT_DELAY_MS
+        return max(delay_ms, settings.PROVIDER_HEDGE_MIN_DELAY_MS) / 1000
+
+    # ------------------------------------------------------------------
+    # Streaming
+    # ------------------------------------------------------------------
+
+    async def stream(
+        self,
+        provider: str,
+        model: Optional[str],
+        api_key: Optional[str],
+        messages: List[Dict[str, str]],
+        open_stream: ProviderStreamFn
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream a completion with failover (and hedging if enabled)
+
+        Failover happens before the first token. Retryable errors that survive
+        failover are retried up to PROVIDER_RETRY_MAX_ATTEMPTS times with
+        backoff; if tokens were already sent, the retry resumes from the
+        partial answer instead of starting over.
+        """
+        routes = self.candidates(provider, model, api_key)
+        emitted = ""
+        attempt = 0
+
+        while True:
+            if emitted:
+                # Continue the answer rather than restart it
+                request_messages = messages + [{"role": "assistant", "content": emitted}]
+            else:
+                request_messages = messages
+
+            try:
+                if settings.PROVIDER_HEDGING_ENABLED and len(routes) > 1 and not emitted:
+                    route, gen, first = await self._hedged_first_chunk(routes, request_messages, open_stream)
+                else:
+                    route, gen, first = await self._failover_first_chunk(routes, request_messages, open_stream)
+            except Exception as e:
+                attempt += 1
+                delay = self._retry_delay(e, attempt, emitted)
+                if delay is None:
+                    raise
+                logger.warning(f"⚠️  {provider} request failed ({e}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if gen is None:
+                return
+            stream = gen
+            if emitted:
+                stream = _skip_repeated_prefix(self._prepend(first, gen), emitted)
+            try:
+                if not emitted:
+                    emitted += first
+                    yield first
+                async for chunk in stream:
+                    emitted += chunk
+                    yield chunk
+                return
+            except Exception as e:
+                self.record_error(route, e)
+                attempt += 1
+                delay = self._retry_delay(e, attempt, emitted)
+                if delay is None:
+                    raise
+                logger.warning(f"⚠️  {route.provider}/{route.model} stream broke ({e}), resuming in {delay:.2f}s")
+            finally:
+                if stream is not gen:
+                    await stream.aclose()
+                await gen.aclose()
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: BaseException, attempt: int, emitted: str) -> Optional[float]:
+        """Backoff before the next attempt, or None if the error should be raised"""
+        # A saturated local queue already waited; report it with its own Retry-After
+        if not is_retryable_error(error) or isinstance(error, ProviderBusyError):
+            return None
+        if attempt > settings.PROVIDER_RETRY_MAX_ATTEMPTS:
+            return None
+        if emitted and not settings.PROVIDER_STREAM_RESUME_ENABLED:
+            return None
+        delay = backoff_delay_seconds(attempt, error)
+        if delay is not None:
+            metrics.increment("provider_retries_total", kind="resume" if emitted else "restart")
+        return delay
+
+    @staticmethod
+    async def _prepend(first: str, gen: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+        yield first
+        async for chunk in gen:
+            yield chunk
+
+    async def _failover_first_chunk(self, routes, messages, open_stream):
+        """Try routes in order until one produces its first chunk"""
+        last_error: Optional[BaseException] = None
+        for index, route in enumerate(routes):
+            gen = open_stream(route.provider, messages, route.model, route.api_key)
+            started = time.perf_counter()
+            try:
+                first = await gen.__anext__()
+            except StopAsyncIteration:
+                # Empty completion: nothing to fail over from
+                self.record_ttft(route, (time.perf_counter() - started) * 1000)
+                return route, None, None
+            except Exception as e:
+                await gen.aclose()
+                self.record_error(route, e)
+                last_error = e
+                if not is_retryable_error(e) or index == len(routes) - 1:
+                    raise
+                metrics.increment("provider_failovers_total", provider=route.provider, model=route.model)
+                logger.warning(f"⚠️  {route.provider}/{route.model} failed ({e}), failing over")
+                continue
+            self.record_ttft(route, (time.perf_counter() - started) * 1000)
+            return route, gen, first
+        raise last_error
+
+    async def _hedged_first_chunk(self, routes, messages, open_stream):
+        """
+        Race the primary against a delayed hedge on the alternate route.
+        The first route to produce a chunk wins; the other is cancelled.
+        """
+        primary, alternate = routes[0], routes[1]
+        attempts = {}  # task -> (route, gen, started)
+
+        def launch(route: Route) -> None:
+            gen = open_stream(route.provider, messages, route.model, route.api_key)
+            task = asyncio.ensure_future(gen.__anext__())
+            attempts[task] = (route, gen, time.perf_counter())
+
+        launch(primary)
+        hedge_launched = False
+        hedge_delay = self.hedge_delay_seconds(primary)
+        last_error: Optional[BaseException] = None
+
+        try:
+            while attempts:
+                timeout = None if hedge_launched else hedge_delay
+                done, _ = await asyncio.wait(attempts.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Primary is slower than its p95: fire the hedge
+                    hedge_launched = True
+                    metrics.increment("provider_hedges_total", provider=alternate.provider, model=alternate.model)
+                    launch(alternate)
+                    continue
+
+                for task in done:
+                    route, gen, started = attempts.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        self.record_ttft(route, (time.perf_counter() - started) * 1000)
+                        return route, None, None
+                    except Exception as e:
+                        await gen.aclose()
+                        self.record_error(route, e)
+                        last_error = e
+                        if not is_retryable_error(e):
+                            raise
+                        if not hedge_launched:
+                            # Primary failed before the hedge delay: fail over now
+                            hedge_launched = True
+                            metrics.increment("provider_failovers_total", provider=route.provider, model=route.model)
+                            launch(alternate)
+                        continue
+
+                    self.record_ttft(route, (time.perf_counter() - started) * 1000)
+                    if route != primary:
+                        metrics.increment("provider_hedge_wins_total", provider=route.provider, model=route.model)
+                    return route, gen, first
+            raise last_error
+        finally:
+            # Cancel the losing attempt(s) and close their upstream streams
+            for task, (route, gen, _) in attempts.items():
+                task.cancel()
+                try:
+                    await task
+                except BaseException:
+                    pass
+                await gen.aclose()
+
+
+# Global provider router instance (rolling stats are per process)
+provider_router = ProviderRouter()
@@ -0,0 +1,289 @@
+"""
+Provider concurrency and token-rate limiting
+
+Every upstream LLM request holds a slot on two limiters: one per provider
+(OpenRouter / Cerebras) and one per API key, so a burst of traffic queues up
+here instead of turning into a wall of 429s from the provider.
+
+Each limiter combines:
+- A concurrency cap (requests in flight)
+- A token bucket (tokens per minute): prompt tokens are charged up front,
+  completion tokens when the request finishes
+- A bounded wait queue ordered by priority (capsule queries first), then
+  arrival. When the queue is full callers get ProviderBusyError, which the
+  API maps to a fast 503 with Retry-After.
+
+Limits come from settings (0 = unlimited). Queue depth, wait time and
+rejections are exported through the metrics registry.
+"""
+from typing import Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import heapq
+import itertools
+import math
+import time
+import logging
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Queue priorities (lower is served first)
+PRIORITY_CAPSULE = 0     # paid capsule queries
+PRIORITY_DEFAULT = 1     # regular chat turns
+PRIORITY_BACKGROUND = 2  # background work such as summary refreshes
+
+# Fallback estimate of how long a request holds its slot, before any samples
+DEFAULT_HOLD_SECONDS = 5.0
+MAX_RETRY_AFTER_SECONDS = 60
+
+
+class ProviderBusyError(Exception):
+    """Raised when a provider's wait queue is full or the wait timed out"""
+
+    def __init__(self, provider: str, retry_after: int, reason: str = "queue full"):
+        self.provider = provider
+        self.retry_after = retry_after
+        super().__init__(f"{provider} is at capacity ({reason}), retry after {retry_after}s")
+
+
+class _Limiter:
+    """Concurrency cap + token bucket + bounded priority queue for one scope"""
+
+    def __init__(self, name: str, provider: str, max_concurrency: int, tokens_per_minute: int):
+        self.name = name
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.in_flight = 0
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.avg_hold_seconds = DEFAULT_HOLD_SECONDS
+        # Heap of [priority, seq, future, tokens]
+        self.waiters: List[list] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    # ------------------------------------------------------------------
+    # Capacity
+    # ------------------------------------------------------------------
+
+    def _refill(self) -> None:
+        if self.tokens_per_minute <= 0:
+            return
+        now = time.monotonic()
+        self.tokens = min(
+            float(self.tokens_per_minute),
+            self.tokens + (now - self.updated) * self.tokens_per_minute / 60
+        )
+        self.updated = now
+
+    def _cost(self, tokens: int) -> int:
+        # A single prompt larger than the bucket would otherwise never fit
+        if self.tokens_per_minute <= 0:
+            return 0
+        return min(tokens, self.tokens_per_minute)
+
+    def _token_wait_seconds(self, tokens: int) -> float:
+        if self.tokens_per_minute <= 0:
+            return 0.0
+        missing = self._cost(tokens) - self.tokens
+        return max(0.0, missing * 60 / self.tokens_per_minute)
+
+    def _try_take(self, tokens: int) -> bool:
+        if self.max_concurrency > 0 and self.in_flight >= self.max_concurrency:
+            return False
+        self._refill()
+        if self._token_wait_seconds(tokens) > 0:
+            return False
+        self.in_flight += 1
+        self.tokens -= self._cost(tokens)
+        return True
+
+    def retry_after(self, tokens: int = 0) -> int:
+        """Rough estimate of when a new request could be admitted"""
+        slots = self.max_concurrency if self.max_concurrency > 0 else 1
+        queue_wait = (len(self.waiters) + 1) / slots * self.avg_hold_seconds
+        self._refill()
+        wait = max(queue_wait, self._token_wait_seconds(tokens))
+        return max(1, min(MAX_RETRY_AFTER_SECONDS, math.ceil(wait)))
+
+    def can_admit(self, priority: int) -> bool:
+        """Whether a request at this priority would get a slot or a queue place"""
+        if len(self.waiters) < settings.PROVIDER_QUEUE_MAX_SIZE:
+            return True
+        return any(entry[0] > priority for entry in self.waiters)
+
+    # ------------------------------------------------------------------
+    # Acquire / release
+    # ------------------------------------------------------------------
+
+    async def acquire(self, tokens: int, priority: int) -> None:
+        if not self.waiters and self._try_take(tokens):
+            metrics.observe("provider_queue_wait_ms", 0.0, provider=self.provider)
+            return
+
+        if len(self.waiters) >= settings.PROVIDER_QUEUE_MAX_SIZE:
+            self._evict_lower_priority(priority, tokens)
+
+        loop = asyncio.get_running_loop()
+        entry = [priority, next(self._seq), loop.create_future(), tokens]
+        heapq.heappush(self.waiters, entry)
+        # Arms the refill timer if only the token bucket is holding us back
+        self._dispatch()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(entry[2], timeout=settings.PROVIDER_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            if not self._granted(entry):
+                self._remove(entry)
+                metrics.increment("provider_queue_rejections_total", provider=self.provider, reason="timeout")
+                raise ProviderBusyError(self.provider, self.retry_after(tokens), "queue timeout")
+        except asyncio.CancelledError:
+            # Granted just as we were cancelled: hand the slot back
+            if self._granted(entry):
+                self.release(0, 0.0)
+            else:
+                self._remove(entry)
+            raise
+        finally:
+            self._publish_depth()
+        metrics.observe("provider_queue_wait_ms", (time.perf_counter() - started) * 1000, provider=self.provider)
+
+    def release(self, completion_tokens: int, held_seconds: float) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        if self.tokens_per_minute > 0:
+            self._refill()
+            self.tokens -= completion_tokens
+        if held_seconds > 0:
+            self.avg_hold_seconds = 0.9 * self.avg_hold_seconds + 0.1 * held_seconds
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant slots to waiters in priority order while capacity allows"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.waiters:
+            entry = self.waiters[0]
+            if entry[2].done():
+                heapq.heappop(self.waiters)
+                continue
+            if not self._try_take(entry[3]):
+                # Only the token bucket is in the way: wake up once it has refilled
+                concurrency_free = self.max_concurrency <= 0 or self.in_flight < self.max_concurrency
+                if concurrency_free and self._timer is None:
+                    delay = self._token_wait_seconds(entry[3])
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                break
+            heapq.heappop(self.waiters)
+            entry[2].set_result(True)
+        self._publish_depth()
+
+    @staticmethod
+    def _granted(entry: list) -> bool:
+        future = entry[2]
+        return future.done() and not future.cancelled() and future.exception() is None
+
+    def _remove(self, entry: list) -> None:
+        if entry in self.waiters:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+        if not entry[2].done():
+            entry[2].cancel()
+
+    def _evict_lower_priority(self, priority: int, tokens: int) -> None:
+        """Make room for a higher-priority request, or reject this one"""
+        worst = max(self.waiters, key=lambda e: (e[0], e[1]))
+        if worst[0] <= priority:
+            metrics.increment("provider_queue_rejections_total", provider=self.provider, reason="full")
+            raise ProviderBusyError(self.provider, self.retry_after(tokens))
+        self.waiters.remove(worst)
+        heapq.heapify(self.waiters)
+        metrics.increment("provider_queue_rejections_total", provider=self.provider, reason="preempted")
+        if not worst[2].done():
+            worst[2].set_exception(ProviderBusyError(self.provider, self.retry_after(worst[3]), "preempted"))
+
+    def _publish_depth(self) -> None:
+        metrics.set_gauge("provider_queue_depth", len(self.waiters), limiter=self.name)
+        metrics.set_gauge("provider_in_flight", self.in_flight, limiter=self.name)
+
+
+class ProviderRateLimiter:
+    """Per-provider and per-API-key limiters, created lazily from settings"""
+
+    def __init__(self):
+        self._limiters: Dict[str, _Limiter] = {}
+
+    def _provider_limits(self, provider: str) -> Tuple[int, int]:
+        if provider == "cerebras":
+            return settings.CEREBRAS_MAX_CONCURRENCY, settings.CEREBRAS_TOKENS_PER_MINUTE
+        return settings.OPENROUTER_MAX_CONCURRENCY, settings.OPENROUTER_TOKENS_PER_MINUTE
+
+    def _limiters_for(self, provider: str, api_key: Optional[str]) -> List[_Limiter]:
+        """Key limiter first (narrower scope), then the provider-wide one"""
+        # Never keep raw keys around: identify them by a short hash
+        key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else "server"
+        scopes = [
+            (f"{provider}:key:{key_id}", settings.PROVIDER_KEY_MAX_CONCURRENCY, settings.PROVIDER_KEY_TOKENS_PER_MINUTE),
+            (provider, *self._provider_limits(provider)),
+        ]
+        limiters = []
+        for name, max_concurrency, tokens_per_minute in scopes:
+            if name not in self._limiters:
+                self._limiters[name] = _Limiter(name, provider, max_concurrency, tokens_per_minute)
+            limiters.append(self._limiters[name])
+        return limiters
+
+    def check_admission(self, provider: str, api_key: Optional[str], priority: int = PRIORITY_DEFAULT) -> None:
+        """
+        Fail fast, before a response starts streaming, if the request could
+        not even be queued
+
+        Raises:
+            ProviderBusyError: If a wait queue is full of equal/higher priority requests
+        """
+        for limiter in self._limiters_for(provider, api_key):
+            if not limiter.can_admit(priority):
+                metrics.increment("provider_queue_rejections_total", provider=provider, reason="admission")
+                raise ProviderBusyError(provider, limiter.retry_after())
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        api_key: Optional[str],
+        prompt_tokens: int = 0,
+        priority: int = PRIORITY_DEFAULT
+    ):
+        """
+        Hold a provider slot for the duration of one upstream request
+
+        Yields a dict; set "completion_tokens" on it so the token bucket is
+        charged for the output as well.
+        """
+        acquired: List[_Limiter] = []
+        usage = {"completion_tokens": 0}
+        try:
+            for limiter in self._limiters_for(provider, api_key):
+                await limiter.acquire(prompt_tokens, priority)
+                acquired.append(limiter)
+        except BaseException:
+            for limiter in acquired:
+                limiter.release(0, 0.0)
+            raise
+
+        started = time.monotonic()
+        try:
+            yield usage
+        finally:
+            held = time.monotonic() - started
+            for limiter in reversed(acquired):
+                limiter.release(usage["completion_tokens"], held)
+
+
+# Global limiter instance (limits are per process)
+provider_limiter = ProviderRateLimiter()
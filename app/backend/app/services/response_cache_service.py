@@ -0,0 +1,223 @@
+"""
+Opt-in response cache for LLM completions
+
+Two tiers, both keyed by (agent, provider, model, normalized prompt after
+injection), so one agent is never served another agent's answer:
+- Exact tier: sha256 of the normalized prompt, stored in CacheService so it is
+  shared across replicas
+- Semantic tier (optional): embedding of the user question compared against
+  recent first-turn questions for the same agent/provider/model
+
+Caching is enabled per agent (policy stored in CacheService) or globally via
+RESPONSE_CACHE_ENABLED. Cached answers are replayed as a chunked stream so the
+SSE path is unchanged. Policies are cached in process for
+POLICY_CACHE_SECONDS (other replicas pick up a change within that time), and
+CacheService calls run in worker threads, off the event loop.
+"""
+from typing import List, Dict, Optional, AsyncGenerator, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import re
+import time
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.cache_service import cache_service
+from app.services import embedding_service
+from app.services.prompt_assembler import user_question
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_REPLAY_TOKEN_RE = re.compile(r"\S+\s*")
+
+# Words per replayed chunk when streaming a cached answer
+REPLAY_WORDS_PER_CHUNK = 4
+
+# How long an agent's policy is reused before it is read from CacheService again
+POLICY_CACHE_SECONDS = 30
+
+
+def normalize_prompt(messages: List[Dict[str, str]]) -> str:
+    """Canonical form of a prompt: roles plus whitespace-collapsed content"""
+    return json.dumps(
+        [[m.get("role", ""), _WHITESPACE_RE.sub(" ", m.get("content", "")).strip()] for m in messages],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+
+
+def response_cache_key(agent_id: str, provider: str, model: Optional[str], messages: List[Dict[str, str]]) -> str:
+    """Exact-tier cache key for an agent's prompt"""
+    digest = hashlib.sha256(normalize_prompt(messages).encode("utf-8")).hexdigest()
+    return f"llm:response:{agent_id}:{provider}:{model or 'default'}:{digest}"
+
+
+class ResponseCacheService:
+    """Exact + semantic cache of completed LLM answers"""
+
+    def __init__(self):
+        # (agent_id, provider, model) -> OrderedDict[exact key -> unit-length embedding]
+        self._semantic_index: Dict[Tuple[str, str, str], "OrderedDict[str, np.ndarray]"] = {}
+        # agent_id -> (fetched at, stored policy)
+        self._policies: Dict[str, Tuple[float, dict]] = {}
+
+    # ------------------------------------------------------------------
+    # Per-agent policy
+    # ------------------------------------------------------------------
+
+    def get_policy(self, agent_id: str) -> dict:
+        """
+        Effective cache policy for an agent
+        Returns dict with 'enabled' and 'ttl_seconds'
+        """
+        cached = self._policies.get(agent_id)
+        if cached and time.monotonic() - cached[0] < POLICY_CACHE_SECONDS:
+            policy = cached[1]
+        else:
+            policy = cache_service.get_agent_response_cache_policy(agent_id) or {}
+            self._policies[agent_id] = (time.monotonic(), policy)
+        enabled = policy.get("enabled")
+        ttl = policy.get("ttl_seconds")
+        return {
+            "enabled": settings.RESPONSE_CACHE_ENABLED if enabled is None else bool(enabled),
+            "ttl_seconds": ttl or settings.RESPONSE_CACHE_TTL_SECONDS,
+        }
+
+    def invalidate_policy(self, agent_id: str) -> None:
+        """Forget the cached policy of an agent (after it was changed here)"""
+        self._policies.pop(agent_id, None)
+
+    # ------------------------------------------------------------------
+    # Lookup / store
+    # ------------------------------------------------------------------
+
+    async def lookup(
+        self,
+        agent_id: str,
+        provider: str,
+        model: Optional[str],
+        messages: List[Dict[str, str]]
+    ) -> Optional[str]:
+        """Find a cached answer for a prompt (exact tier first, then semantic)"""
+        key = response_cache_key(agent_id, provider, model, messages)
+        content = await asyncio.to_thread(self._get_entry, key)
+        if content is not None:
+            metrics.increment("response_cache_hits_total", tier="exact")
+            return content
+
+        question = self._semantic_question(messages)
+        if question is not None:
+            content = await self._semantic_lookup(agent_id, provider, model, question)
+            if content is not None:
+                metrics.increment("response_cache_hits_total", tier="semantic")
+                return content
+
+        metrics.increment("response_cache_misses_total")
+        return None
+
+    async def store(
+        self,
+        agent_id: str,
+        provider: str,
+        model: Optional[str],
+        messages: List[Dict[str, str]],
+        content: str,
+        ttl_seconds: int
+    ) -> None:
+        """Store a completed answer in the cache"""
+        if not content:
+            return
+        key = response_cache_key(agent_id, provider, model, messages)
+        await asyncio.to_thread(
+            cache_service.set,
+            key,
+            {"content": content, "expires_at": time.time() + ttl_seconds},
+            ttl_seconds
+        )
+
+        question = self._semantic_question(messages)
+        if question is not None:
+            embeddings = await embedding_service.embed_texts([question])
+            if embeddings:
+                index = self._semantic_index.setdefault((agent_id, provider, model or "default"), OrderedDict())
+                index[key] = _unit(embeddings[0])
+                index.move_to_end(key)
+                while len(index) > settings.RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES:
+                    index.popitem(last=False)
+
+    async def replay(self, content: str) -> AsyncGenerator[str, None]:
+        """Replay a cached answer as a stream of small chunks"""
+        words = _REPLAY_TOKEN_RE.findall(content)
+        for i in range(0, len(words), REPLAY_WORDS_PER_CHUNK):
+            yield "".join(words[i:i + REPLAY_WORDS_PER_CHUNK])
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _get_entry(self, key: str) -> Optional[str]:
+        entry = cache_service.get(key)
+        if not isinstance(entry, dict):
+            return None
+        # Entries also record their own expiry; never serve one past it
+        if entry.get("expires_at", 0) < time.time():
+            cache_service.delete(key)
+            return None
+        return entry.get("content")
+
+    def _semantic_question(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        The question to match semantically, or None if the tier does not apply
+        Only first-turn prompts qualify: follow-ups depend on the history.
+        Injected memory / web context is left out of the comparison.
+        """
+        if not settings.RESPONSE_CACHE_SEMANTIC_ENABLED or not embedding_service.is_available():
+            return None
+        turns = [m for m in messages if m.get("role") != "system"]
+        if len(turns) != 1 or turns[0].get("role") != "user":
+            return None
+        question = user_question(turns[0].get("content", ""))
+        return _WHITESPACE_RE.sub(" ", question).strip().lower() or None
+
+    async def _semantic_lookup(
+        self,
+        agent_id: str,
+        provider: str,
+        model: Optional[str],
+        question: str
+    ) -> Optional[str]:
+        index = self._semantic_index.get((agent_id, provider, model or "default"))
+        if not index:
+            return None
+        embeddings = await embedding_service.embed_texts([question])
+        if not embeddings:
+            return None
+
+        # One matrix product over every stored question (vectors are unit length)
+        keys = list(index)
+        scores = np.vstack([index[k] for k in keys]) @ _unit(embeddings[0])
+        best = int(np.argmax(scores))
+        if scores[best] < settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD:
+            return None
+        best_key = keys[best]
+        content = await asyncio.to_thread(self._get_entry, best_key)
+        if content is None:
+            index.pop(best_key, None)
+        return content
+
+
+def _unit(vector: List[float]) -> np.ndarray:
+    """Vector scaled to unit length (zero vectors stay zero)"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+# Global response cache instance
+response_cache = ResponseCacheService()
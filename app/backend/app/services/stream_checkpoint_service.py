@@ -0,0 +1,297 @@
+"""
+Checkpointed, resumable assistant streams
+
+Each streamed answer gets a message ID (announced in the first SSE frame) and
+is generated by a background task rather than by the SSE response itself:
+- The partial content is checkpointed to CacheService every
+  STREAM_CHECKPOINT_TOKENS tokens or STREAM_CHECKPOINT_INTERVAL_MS, so a
+  crashed or redeployed worker leaves the answer so far behind
+- Any number of clients can follow the live stream by message ID; the
+  original SSE response is just the first follower
+- When the last follower disconnects, generation keeps going for
+  STREAM_RESUME_GRACE_SECONDS so a reconnecting client can pick it up, and is
+  cancelled otherwise (so abandoned answers stop costing tokens)
+
+Followers on another replica poll the checkpoint instead of the live stream.
+"""
+from typing import Awaitable, Callable, Dict, List, Optional, AsyncGenerator
+import asyncio
+import logging
+import time
+import uuid
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.cache_service import cache_service
+from app.services.context_service import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Checkpoint statuses
+STREAMING = "streaming"
+COMPLETED = "completed"
+INTERRUPTED = "interrupted"
+FAILED = "error"
+# Reported for a checkpoint left "streaming" by a worker that stopped updating it
+STALE = "stale"
+
+
+class LiveStream:
+    """One assistant answer being generated in this process"""
+
+    def __init__(self, message_id: str, chat_id: str, wallet_address: str):
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.wallet_address = wallet_address
+        self.status = STREAMING
+        self.error: Optional[str] = None
+        self.retry_after: Optional[int] = None
+        self.usage: Optional[dict] = None
+        self.tokens = 0
+        self._parts: List[str] = []
+        self._subscribers: List[asyncio.Queue] = []
+        self._producer: Optional[asyncio.Task] = None
+        self._grace: Optional[asyncio.TimerHandle] = None
+        self._writer: Optional[asyncio.Task] = None
+        # Queue of the client that started the answer, registered by start()
+        self._origin: Optional[asyncio.Queue] = None
+        self._unsaved_tokens = 0
+        self._last_checkpoint = time.monotonic()
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts)
+
+    def snapshot(self) -> dict:
+        """Checkpoint record (also what GET .../partial returns)"""
+        return {
+            "message_id": self.message_id,
+            "chat_id": self.chat_id,
+            "wallet_address": self.wallet_address,
+            "content": self.content,
+            "status": self.status,
+            "tokens": self.tokens,
+            "error": self.error,
+            "retry_after": self.retry_after,
+            "usage": self.usage,
+            "updated_at": time.time(),
+        }
+
+    def append(self, chunk: str) -> None:
+        """Add generated text, fan it out to followers and checkpoint if due"""
+        self._parts.append(chunk)
+        tokens = count_tokens(chunk)
+        self.tokens += tokens
+        self._unsaved_tokens += tokens
+        for queue in self._subscribers:
+            queue.put_nowait(chunk)
+
+        due = (
+            self._unsaved_tokens >= settings.STREAM_CHECKPOINT_TOKENS
+            or (time.monotonic() - self._last_checkpoint) * 1000 >= settings.STREAM_CHECKPOINT_INTERVAL_MS
+        )
+        # One write at a time; a skipped checkpoint is picked up by the next chunk
+        if due and (self._writer is None or self._writer.done()):
+            self._unsaved_tokens = 0
+            self._last_checkpoint = time.monotonic()
+            self._writer = asyncio.ensure_future(self._save())
+
+    async def finish(
+        self,
+        status: str,
+        error: Optional[str] = None,
+        retry_after: Optional[int] = None,
+        usage: Optional[dict] = None
+    ) -> None:
+        """Record the final state, write the last checkpoint and release followers"""
+        if self.status != STREAMING:
+            return
+        self.status = status
+        self.error = error
+        self.retry_after = retry_after
+        self.usage = usage
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+        if self._grace:
+            self._grace.cancel()
+        if self._writer and not self._writer.done():
+            await asyncio.wait([self._writer])
+        await self._save()
+        metrics.increment("stream_checkpoint_finished_total", status=status)
+
+    def subscribe(self, offset: int = 0) -> asyncio.Queue:
+        """
+        Follow the stream from a character offset
+        The queue yields the content after `offset`, then new chunks, then None
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        backlog = self.content[offset:]
+        if backlog:
+            queue.put_nowait(backlog)
+        if self.status != STREAMING:
+            queue.put_nowait(None)
+        else:
+            self._subscribers.append(queue)
+            if self._grace:
+                self._grace.cancel()
+                self._grace = None
+                metrics.increment("stream_resumes_total")
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """Stop following; the last follower leaving starts the grace period"""
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+        if not self._subscribers and self.status == STREAMING and self._producer and not self._grace:
+            self._grace = asyncio.get_running_loop().call_later(
+                settings.STREAM_RESUME_GRACE_SECONDS, self._abandon
+            )
+
+    def _abandon(self) -> None:
+        self._grace = None
+        if not self._subscribers and self._producer and not self._producer.done():
+            logger.info(f"No client resumed message {self.message_id}, stopping generation")
+            self._producer.cancel()
+
+    async def _save(self) -> None:
+        if not settings.STREAM_CHECKPOINT_ENABLED:
+            return
+        started = time.perf_counter()
+        # CacheService calls are blocking HTTP requests; keep them off the event loop
+        await asyncio.to_thread(
+            cache_service.set_stream_checkpoint,
+            self.message_id,
+            self.snapshot(),
+            settings.STREAM_CHECKPOINT_TTL_SECONDS
+        )
+        metrics.observe("stream_checkpoint_write_ms", (time.perf_counter() - started) * 1000)
+
+
+class StreamCheckpointService:
+    """Registry of live streams in this process plus access to saved checkpoints"""
+
+    def __init__(self):
+        self._live: Dict[str, LiveStream] = {}
+
+    def start(
+        self,
+        chat_id: str,
+        wallet_address: str,
+        produce: Callable[[LiveStream], Awaitable[None]]
+    ) -> LiveStream:
+        """
+        Start generating an answer in the background
+
+        Args:
+            chat_id: Chat the answer belongs to
+            wallet_address: Owner (only they can fetch or follow it)
+            produce: Coroutine function that appends chunks to the stream and
+                calls finish(); it is cancelled if every follower goes away
+
+        Returns:
+            The live stream (the originating client follows it with
+            follow(..., stream=stream))
+        """
+        stream = LiveStream(str(uuid.uuid4()), chat_id, wallet_address)
+        self._live[stream.message_id] = stream
+        # Subscribe the originating client before generation starts, so an answer
+        # that finishes before its response is sent is still delivered to it
+        stream._origin = stream.subscribe()
+        stream._producer = asyncio.ensure_future(self._run(stream, produce))
+        # Initial checkpoint, so followers on other workers can find the message right away
+        stream._writer = asyncio.ensure_future(stream._save())
+        metrics.increment("stream_checkpoint_started_total")
+        return stream
+
+    async def _run(self, stream: LiveStream, produce: Callable[[LiveStream], Awaitable[None]]) -> None:
+        try:
+            await produce(stream)
+        except asyncio.CancelledError:
+            await stream.finish(INTERRUPTED)
+        except Exception as e:
+            logger.warning(f"Stream {stream.message_id} failed: {e}")
+            await stream.finish(FAILED, error=str(e))
+        finally:
+            self._live.pop(stream.message_id, None)
+
+    def get_checkpoint(self, message_id: str, chat_id: str, wallet_address: str) -> Optional[dict]:
+        """Latest state of a message (live if generated here), None if unknown or not the owner's"""
+        live = self._live.get(message_id)
+        checkpoint = live.snapshot() if live else cache_service.get_stream_checkpoint(message_id)
+        if not checkpoint or checkpoint.get("chat_id") != chat_id or checkpoint.get("wallet_address") != wallet_address:
+            return None
+        checkpoint = dict(checkpoint)
+        if not live and checkpoint["status"] == STREAMING and \
+                time.time() - checkpoint.get("updated_at", 0) > settings.STREAM_CHECKPOINT_STALE_SECONDS:
+            checkpoint["status"] = STALE
+        return checkpoint
+
+    async def follow(
+        self,
+        message_id: str,
+        offset: int = 0,
+        stream: Optional[LiveStream] = None
+    ) -> AsyncGenerator[dict, None]:
+        """
+        Follow an answer from a character offset, yielding SSE payloads
+
+        Args:
+            message_id: Message to follow
+            offset: Character offset to resume from
+            stream: The stream returned by start(), when following it as the
+                client that started it (uses the subscription made there)
+
+        Yields {"content"} frames, then {"done": True, "status", "usage"} or
+        {"error", "retry_after"} once generation ends.
+        """
+        live = stream or self._live.get(message_id)
+        if live is None:
+            async for frame in self._poll(message_id, offset):
+                yield frame
+            return
+
+        if stream is not None and live._origin is not None:
+            queue, live._origin = live._origin, None
+        else:
+            queue = live.subscribe(offset)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield {"content": chunk}
+        finally:
+            live.unsubscribe(queue)
+
+        if live.status == FAILED:
+            yield {"error": live.error, "retry_after": live.retry_after}
+        else:
+            yield {"done": True, "status": live.status, "usage": live.usage}
+
+    async def _poll(self, message_id: str, offset: int) -> AsyncGenerator[dict, None]:
+        """Follow a stream generated by another worker through its checkpoints"""
+        interval = max(settings.STREAM_CHECKPOINT_INTERVAL_MS, 100) / 1000
+        while True:
+            checkpoint = await asyncio.to_thread(cache_service.get_stream_checkpoint, message_id)
+            if not checkpoint:
+                yield {"error": "Stream not found"}
+                return
+            content = checkpoint.get("content", "")
+            if len(content) > offset:
+                yield {"content": content[offset:]}
+                offset = len(content)
+
+            status = checkpoint.get("status")
+            if status == STREAMING and time.time() - checkpoint.get("updated_at", 0) > settings.STREAM_CHECKPOINT_STALE_SECONDS:
+                status = STALE
+            if status == FAILED:
+                yield {"error": checkpoint.get("error"), "retry_after": checkpoint.get("retry_after")}
+                return
+            if status != STREAMING:
+                yield {"done": True, "status": status, "usage": checkpoint.get("usage")}
+                return
+            await asyncio.sleep(interval)
+
+
+# Global stream checkpoint service (live streams are per process)
+stream_checkpoint_service = StreamCheckpointService()
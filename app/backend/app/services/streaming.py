@@ -0,0 +1,235 @@
+"""
+Streaming helpers for the SSE hot path
+
+Client side (our SSE responses):
+- sse_event: format one Server-Sent Events frame
+- coalesce_chunks: merge small LLM chunks into fewer, larger frames, flushing
+  every SSE_FLUSH_INTERVAL_MS milliseconds or SSE_FLUSH_BYTES bytes
+
+Provider side (OpenAI-compatible SSE streams):
+- SSEDecoder / iter_sse_data: byte-level SSE decoding (multi-line events, comments)
+- parse_delta_content: pull choices[0].delta.content out of a chunk payload,
+  skipping payloads without content before parsing
+- parse_chunk: content plus the usage object (stream_options.include_usage),
+  still parsing each payload at most once
+"""
+from typing import AsyncIterator, AsyncGenerator, List, Optional, Tuple
+import asyncio
+import json
+
+from app.core.config import settings
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None  # type: ignore
+
+    def _json_loads(data: bytes):
+        # json.loads on bytes pays for encoding detection; decode explicitly
+        return json.loads(data.decode("utf-8"))
+
+SSE_DONE = b"[DONE]"
+_CONTENT_MARKER = b'"content"'
+_USAGE_MARKER = b'"usage"'
+
+
+def sse_event(payload: dict) -> str:
+    """Format a payload as an SSE data frame"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def coalesce_chunks(
+    source: AsyncIterator[str],
+    flush_interval_ms: Optional[int] = None,
+    flush_bytes: Optional[int] = None
+) -> AsyncGenerator[str, None]:
+    """
+    Merge consecutive chunks from an async stream
+
+    Buffered text is flushed when it reaches flush_bytes (counted as
+    characters of text), or when flush_interval_ms has passed since the first
+    buffered chunk even if no new chunk arrives. Setting both limits to 0
+    passes chunks through as-is.
+
+    Args:
+        source: Async iterator of text chunks
+        flush_interval_ms: Max time a chunk may wait in the buffer (default from settings)
+        flush_bytes: Buffer size that triggers a flush (default from settings)
+    """
+    interval_ms = settings.SSE_FLUSH_INTERVAL_MS if flush_interval_ms is None else flush_interval_ms
+    max_bytes = settings.SSE_FLUSH_BYTES if flush_bytes is None else flush_bytes
+
+    if interval_ms <= 0 and max_bytes <= 0:
+        async for chunk in source:
+            yield chunk
+        return
+
+    # A single pump task drains the source into the buffer so the per-chunk
+    # cost stays at a list append; the consumer wakes once per frame.
+    interval = interval_ms / 1000 if interval_ms > 0 else None
+    buffer = []
+    state = {"bytes": 0, "finished": False, "error": None}
+    has_data = asyncio.Event()
+    flush_now = asyncio.Event()
+
+    async def pump():
+        try:
+            async for chunk in source:
+                if not buffer:
+                    has_data.set()
+                buffer.append(chunk)
+                state["bytes"] += len(chunk)
+                if max_bytes > 0 and state["bytes"] >= max_bytes:
+                    flush_now.set()
+        except Exception as e:
+            state["error"] = e
+        finally:
+            state["finished"] = True
+            has_data.set()
+            flush_now.set()
+
+    pump_task = asyncio.ensure_future(pump())
+    first_frame = True
+    try:
+        while True:
+            await has_data.wait()
+            # The first frame goes out immediately so time-to-first-token is unchanged
+            if not first_frame and not flush_now.is_set():
+                if interval is None:
+                    await flush_now.wait()
+                else:
+                    try:
+                        await asyncio.wait_for(flush_now.wait(), timeout=interval)
+                    except asyncio.TimeoutError:
+                        pass
+
+            has_data.clear()
+            flush_now.clear()
+            if buffer:
+                text = "".join(buffer)
+                buffer.clear()
+                state["bytes"] = 0
+                first_frame = False
+                yield text
+
+            if state["finished"]:
+                if buffer:
+                    yield "".join(buffer)
+                if state["error"] is not None:
+                    raise state["error"]
+                return
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+            try:
+                await pump_task
+            except asyncio.CancelledError:
+                pass
+
+
+class SSEDecoder:
+    """
+    Incremental Server-Sent Events decoder working on raw bytes
+
+    Feed it network chunks; it returns the data payload of every completed
+    event. Multi-line events are joined with newlines, comment lines
+    (starting with ':') and non-data fields are ignored.
+    """
+
+    def __init__(self):
+        self._tail = b""
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Decode a chunk, returning the payloads of the events it completes"""
+        if self._tail:
+            chunk = self._tail + chunk
+        lines = chunk.split(b"\n")
+        self._tail = lines.pop()
+
+        events = []
+        for line in lines:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                # Blank line terminates the event
+                if self._data:
+                    events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+                    self._data = []
+            elif line.startswith(b"data:"):
+                value = line[5:]
+                if value[:1] == b" ":
+                    value = value[1:]
+                self._data.append(value)
+        return events
+
+    def flush(self) -> List[bytes]:
+        """Return any event left unterminated at the end of the stream"""
+        events = self.feed(b"\n\n") if self._tail or self._data else []
+        self._tail = b""
+        return events
+
+
+async def iter_sse_data(byte_stream: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+    """
+    Yield the data payload of every event in a byte stream until [DONE]
+
+    Args:
+        byte_stream: Raw response bytes (e.g. httpx response.aiter_bytes())
+    """
+    decoder = SSEDecoder()
+    async for chunk in byte_stream:
+        for data in decoder.feed(chunk):
+            if data == SSE_DONE:
+                return
+            yield data
+    for data in decoder.flush():
+        if data == SSE_DONE:
+            return
+        yield data
+
+
+def parse_delta_content(data: bytes) -> Optional[str]:
+    """
+    Extract choices[0].delta.content from a chunk payload
+
+    Payloads that cannot carry content (no "content" key) are skipped without
+    being parsed. Raises ValueError on malformed JSON.
+    """
+    if _CONTENT_MARKER not in data:
+        return None
+    payload = _json_loads(data)
+    choices = payload.get("choices")
+    if not choices:
+        return None
+    delta = choices[0].get("delta")
+    if not delta:
+        return None
+    return delta.get("content") or None
+
+
+def parse_chunk(data: bytes) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Extract (delta content, usage) from a chunk payload
+
+    Usage is only reported once, on the final chunk, when the request sets
+    stream_options.include_usage (some providers send "usage": null on the
+    other chunks). Payloads with neither key are skipped without being
+    parsed. Raises ValueError on malformed JSON.
+    """
+    has_content = _CONTENT_MARKER in data
+    if not has_content and _USAGE_MARKER not in data:
+        return None, None
+    payload = _json_loads(data)
+
+    content = None
+    if has_content:
+        choices = payload.get("choices")
+        if choices:
+            delta = choices[0].get("delta")
+            if delta:
+                content = delta.get("content") or None
+
+    usage = payload.get("usage")
+    return content, usage if isinstance(usage, dict) and usage else None
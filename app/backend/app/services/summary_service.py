@@ -0,0 +1,169 @@
+"""
+Rolling conversation summaries per chat
+
+Older turns of long chats are folded into a running summary that is stored
+next to the chat metadata in CacheService. The summary is refreshed
+incrementally in the background every SUMMARY_REFRESH_EVERY_TURNS turns,
+never on the request path.
+"""
+from typing import List, Dict, Optional, Callable, Awaitable
+from datetime import datetime
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+# Summary refreshes currently running, by chat_id (also keeps task references alive)
+_inflight_refreshes: Dict[str, asyncio.Task] = {}
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the new messages into the existing summary. Keep facts, names, decisions, "
+    "preferences and open questions; drop small talk. Write plain prose in at most "
+    "{max_words} words and return only the updated summary."
+)
+
+
+def conversation_turns(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """The user/assistant turns of a chat (what summary message counts refer to)"""
+    return [m for m in messages if m.get("role") != "system"]
+
+
+def messages_after_summary(messages: List[Dict[str, str]], covered: int) -> List[Dict[str, str]]:
+    """The messages a summary covering the first `covered` turns leaves out (system messages are kept)"""
+    remaining = []
+    turns = 0
+    for m in messages:
+        if m.get("role") == "system":
+            remaining.append(m)
+            continue
+        turns += 1
+        if turns > covered:
+            remaining.append(m)
+    return remaining
+
+
+def _format_transcript(messages: List[Dict[str, str]]) -> str:
+    lines = []
+    for m in messages:
+        speaker = "User" if m.get("role") == "user" else "Assistant"
+        lines.append(f"{speaker}: {m.get('content', '')}")
+    return "\n".join(lines)
+
+
+class SummaryService:
+    """
+    Service for maintaining rolling chat summaries
+
+    A summary record looks like:
+        {"summary": str, "message_count": int, "updated_at": iso timestamp}
+    where message_count is the number of leading chat turns (non-system
+    messages, see conversation_turns) it covers.
+
+    CacheService calls block, so get_summary is meant to run in a worker
+    thread and refreshes read and write the summary off the event loop.
+    """
+
+    def get_summary(self, chat_id: str) -> Optional[dict]:
+        """Get the stored summary for a chat, if any"""
+        if not settings.SUMMARY_ENABLED or not chat_id:
+            return None
+        summary = cache_service.get_chat_summary(chat_id)
+        if not summary or not summary.get("summary"):
+            return None
+        return summary
+
+    def needs_refresh(self, chat_id: str, turn_count: int, summary: Optional[dict] = None) -> bool:
+        """
+        Check whether enough new turns have accumulated past the summary
+        Args:
+            chat_id: Chat identifier
+            turn_count: Number of turns in the chat (see conversation_turns)
+            summary: The stored summary, if already fetched
+        """
+        if not settings.SUMMARY_ENABLED or not chat_id:
+            return False
+        if summary is None:
+            summary = cache_service.get_chat_summary(chat_id) or {}
+        covered = summary.get("message_count", 0)
+        target = turn_count - settings.SUMMARY_KEEP_RECENT_MESSAGES
+        return target - covered >= settings.SUMMARY_REFRESH_EVERY_TURNS * 2
+
+    def schedule_refresh(
+        self,
+        chat_id: str,
+        messages: List[Dict[str, str]],
+        complete: Callable[[List[Dict[str, str]]], Awaitable[str]]
+    ) -> Optional[asyncio.Task]:
+        """
+        Refresh the chat summary in the background if it is due
+        (the check runs in the background task too)
+
+        Args:
+            chat_id: Chat identifier
+            messages: Full chat history (oldest first), including the latest reply
+            complete: Async callable that runs a completion for a list of messages
+
+        Returns:
+            The background task, or None if disabled or a refresh is already running
+        """
+        if not settings.SUMMARY_ENABLED or not chat_id or chat_id in _inflight_refreshes:
+            return None
+
+        task = asyncio.create_task(self._refresh(chat_id, conversation_turns(messages), complete))
+        _inflight_refreshes[chat_id] = task
+        task.add_done_callback(lambda _: _inflight_refreshes.pop(chat_id, None))
+        return task
+
+    async def _refresh(
+        self,
+        chat_id: str,
+        messages: List[Dict[str, str]],
+        complete: Callable[[List[Dict[str, str]]], Awaitable[str]]
+    ) -> None:
+        """Fold the turns not yet covered into the summary (if due)"""
+        try:
+            previous = await asyncio.to_thread(cache_service.get_chat_summary, chat_id) or {}
+            if not self.needs_refresh(chat_id, len(messages), previous):
+                return
+            covered = previous.get("message_count", 0)
+            target = len(messages) - settings.SUMMARY_KEEP_RECENT_MESSAGES
+            new_messages = messages[covered:target]
+            if not new_messages:
+                return
+
+            prompt = [
+                {
+                    "role": "system",
+                    "content": SUMMARY_INSTRUCTIONS.format(max_words=settings.SUMMARY_MAX_WORDS)
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        f"Current summary:\n{previous.get('summary') or '(none)'}\n\n"
+                        f"New messages:\n{_format_transcript(new_messages)}"
+                    )
+                },
+            ]
+            summary_text = (await complete(prompt)).strip()
+            if not summary_text:
+                return
+
+            await asyncio.to_thread(cache_service.set_chat_summary, chat_id, {
+                "summary": summary_text,
+                "message_count": target,
+                "updated_at": datetime.now().isoformat()
+            })
+            metrics.increment("chat_summary_refreshes_total")
+            logger.info(f"📝 Refreshed summary for chat {chat_id} ({target} messages covered)")
+        except Exception as e:
+            metrics.increment("chat_summary_refresh_errors_total")
+            logger.warning(f"Summary refresh failed for chat {chat_id}: {e}")
+
+
+# Global summary service instance
+summary_service = SummaryService()
@@ -1,8 +1,26 @@
+"""
+Web search (Tavily) for web-enabled chats
+
+Searches go through an async client on a pooled connection with a hard
+deadline. Results are deduplicated by URL, each result is cut down to the
+snippet most relevant to the query, and the formatted block is truncated to
+CONTEXT_WEB_SEARCH_RESERVE_TOKENS (the room the context builder reserves for it).
+"""
 import os
-from typing import Optional
+from typing import Optional, Dict, List
+from urllib.parse import urlsplit, urlunsplit
 from dotenv import load_dotenv
-from tavily import TavilyClient
+import asyncio
+import hashlib
+import httpx
 import logging
+import re
+import time
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.cache_service import cache_service
+from app.services.context_service import count_tokens
 
 load_dotenv()
 
@@ -10,20 +28,121 @@ logger = logging.getLogger(__name__)
 
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
-# Initialize Tavily client
-tavily_client = None
-if TAVILY_API_KEY:
-    try:
-        tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
-        logger.info("Tavily client initialized successfully")
-    except Exception as e:
-        # logger.warning(f"Failed to initialize Tavily client: {e}")
-        pass
-# else:
-#     logger.warning("TAVILY_API_KEY not found in environment variables")
+# Shared client, created on first use (see get_http_client / close)
+_http_client: Optional[httpx.AsyncClient] = None
+
+# Words too common to say anything about a snippet's relevance
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to was what when where which who why with".split()
+)
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\w+")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Pooled HTTP client for Tavily (keeps connections alive between searches)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=settings.TAVILY_BASE_URL.rstrip("/"),
+            timeout=httpx.Timeout(settings.WEB_SEARCH_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return _http_client
+
+
+async def close() -> None:
+    """Close the pooled client (called on shutdown)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _terms(text: str) -> set:
+    return {w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS and len(w) > 1}
+
+
+def _normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), parts.query, ""))
+
+
+def dedupe_results(results: List[Dict]) -> List[Dict]:
+    """Drop repeated URLs (keeping the best-scored copy), best results first"""
+    best: Dict[str, Dict] = {}
+    for r in results:
+        url = r.get("url")
+        if not url:
+            continue
+        key = _normalize_url(url)
+        if key not in best or r.get("score", 0) > best[key].get("score", 0):
+            best[key] = r
+    return sorted(best.values(), key=lambda r: r.get("score", 0), reverse=True)
 
 
-def web_search(query: str, k: int = 5) -> str:
+def extract_snippet(content: str, query: str, max_chars: int) -> str:
+    """
+    Cut a result down to the passage most relevant to the query
+    
+    Args:
+        content: Result content from the search API
+        query: Search query
+        max_chars: Maximum snippet length
+    
+    Returns:
+        The best-matching sentence plus following sentences that fit in max_chars
+    """
+    content = re.sub(r"\s+", " ", content or "").strip()
+    if len(content) <= max_chars:
+        return content
+
+    sentences = _SENTENCE_SPLIT.split(content)
+    query_terms = _terms(query)
+    # Earliest sentence with the most query terms (the lead sentence if none match)
+    start = max(range(len(sentences)), key=lambda i: (len(query_terms & _terms(sentences[i])), -i))
+
+    snippet = ""
+    for sentence in sentences[start:]:
+        candidate = f"{snippet} {sentence}" if snippet else sentence
+        if len(candidate) > max_chars:
+            break
+        snippet = candidate
+    if not snippet:
+        snippet = sentences[start][:max_chars - 1].rstrip() + "…"
+    return snippet
+
+
+def format_results(results: List[Dict], query: str, max_tokens: int) -> str:
+    """
+    Format search results for the prompt within a token budget
+    
+    Args:
+        results: Raw results from the search API
+        query: Search query (used to pick snippets)
+        max_tokens: Token budget for the whole block
+    
+    Returns:
+        One "- title (url): snippet" line per result that fits in the budget
+    """
+    lines: List[str] = []
+    used = 0
+    for r in dedupe_results(results):
+        snippet = extract_snippet(r.get("content", ""), query, settings.WEB_SEARCH_SNIPPET_CHARS)
+        line = f"- {r.get('title', '')} ({r['url']}): {snippet}"
+        tokens = count_tokens(line) + 1
+        if used + tokens > max_tokens:
+            if not lines:
+                # Keep a cut-down top result rather than nothing at all
+                keep = max(0, int(len(line) * max_tokens / tokens) - 1)
+                lines.append(line[:keep].rstrip() + "…")
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(lines)
+
+
+async def web_search(query: str, k: int = 5) -> str:
     """
     Perform web search using Tavily API.
     
@@ -32,32 +151,118 @@ def web_search(query: str, k: int = 5) -> str:
         k: Number of results to return (default: 5)
     
     Returns:
-        Formatted string with search results
+        Formatted string with search results ("" if unavailable, failed or past the deadline)
     """
-    if not tavily_client:
-        # logger.warning("Tavily client not available, web search disabled")
+    if not TAVILY_API_KEY:
         return ""
     
+    started = time.perf_counter()
     try:
-        res = tavily_client.search(
-            query=query,
-            max_results=k,
-            include_answer=False,
-            include_raw_content=False,
+        response = await asyncio.wait_for(
+            get_http_client().post(
+                "/search",
+                headers={"Authorization": f"Bearer {TAVILY_API_KEY}"},
+                json={
+                    "query": query,
+                    "max_results": k,
+                    "include_answer": False,
+                    "include_raw_content": False,
+                }
+            ),
+            timeout=settings.WEB_SEARCH_TIMEOUT_SECONDS
         )
-        
-        docs = []
-        for r in res.get("results", []):
-            docs.append(
-                f"- {r['title']} ({r['url']}): {r['content']}"
-            )
-        return "\n".join(docs) if docs else ""
+        response.raise_for_status()
+        results = response.json().get("results", [])
+    except asyncio.TimeoutError:
+        metrics.increment("web_search_errors_total", reason="timeout")
+        logger.warning(f"Web search timed out after {settings.WEB_SEARCH_TIMEOUT_SECONDS}s")
+        return ""
     except Exception as e:
+        metrics.increment("web_search_errors_total", reason="error")
         # logger.error(f"Error performing web search: {e}")
         return ""
+    finally:
+        metrics.observe("web_search_ms", (time.perf_counter() - started) * 1000)
+
+    return format_results(results, query, settings.CONTEXT_WEB_SEARCH_RESERVE_TOKENS)
+
+
+# In-flight searches by cache key, so concurrent identical queries share one call
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for caching (case, whitespace, trailing punctuation)"""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+def _cache_key(query: str, k: int) -> str:
+    digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()[:32]
+    return f"{digest}:{k}"
+
+
+def _record_lookup(outcome: str) -> None:
+    metrics.increment("web_search_cache_lookups_total", outcome=outcome)
+    hits = metrics.counter("web_search_cache_lookups_total", outcome="hit") + \
+        metrics.counter("web_search_cache_lookups_total", outcome="joined")
+    total = hits + metrics.counter("web_search_cache_lookups_total", outcome="miss")
+    metrics.set_gauge("web_search_cache_hit_rate", round(hits / total, 4) if total else 0.0)
+
+
+async def _search_and_store(cache_key: str, query: str, k: int) -> str:
+    context = await web_search(query, k)
+    if context:
+        # Failed or empty searches are not cached so the next turn retries;
+        # CacheService calls are blocking HTTP requests, keep them off the event loop
+        await asyncio.to_thread(
+            cache_service.set_web_search_result,
+            cache_key,
+            {"context": context, "expires_at": time.time() + settings.WEB_SEARCH_CACHE_TTL_SECONDS},
+            settings.WEB_SEARCH_CACHE_TTL_SECONDS,
+            settings.WEB_SEARCH_CACHE_MAX_ENTRIES
+        )
+    return context
+
+
+async def cached_web_search(query: str, k: int = 5) -> str:
+    """
+    Web search through the shared result cache
+    
+    Results are cached in CacheService (shared across replicas) by normalized
+    query and k for WEB_SEARCH_CACHE_TTL_SECONDS. Concurrent identical queries
+    in this process wait on a single Tavily call.
+    
+    Args:
+        query: Search query string
+        k: Number of results to return (default: 5)
+    
+    Returns:
+        Formatted string with search results
+    """
+    if not settings.WEB_SEARCH_CACHE_ENABLED:
+        return await web_search(query, k)
+
+    cache_key = _cache_key(query, k)
+    cached = await asyncio.to_thread(cache_service.get_web_search_result, cache_key)
+    # Entries also record their own expiry; never serve one past it
+    if cached and cached.get("expires_at", 0) > time.time():
+        _record_lookup("hit")
+        return cached["context"]
+
+    task = _inflight.get(cache_key)
+    if task is not None:
+        _record_lookup("joined")
+    else:
+        _record_lookup("miss")
+        task = asyncio.ensure_future(_search_and_store(cache_key, query, k))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+
+    # shield: a cancelled caller must not cancel the search others are waiting on
+    return await asyncio.shield(task)
 
 
 def is_available() -> bool:
     """Check if web search is available (Tavily API key configured)"""
-    return tavily_client is not None
+    return bool(TAVILY_API_KEY)
 
@@ -0,0 +1,181 @@
+"""
+End-to-end load test for the chat endpoints
+
+Creates an agent and a set of chats through the API, then drives
+POST .../messages/stream (or the non-streaming endpoint with --no-stream)
+at a fixed concurrency and reports:
+- TTFT (time to first content frame) and total latency: p50 / p95 / p99
+- Throughput and error counts
+- Server CPU, from the process CPU time in /metrics before and after the run
+  (single worker: run uvicorn without --workers for meaningful numbers)
+
+Typical setup, all local:
+    python benchmarks/mock_provider.py --port 9000 --ttft-ms 300 --token-delay-ms 20
+    OPENROUTER_BASE_URL=http://127.0.0.1:9000/v1 CEREBRAS_BASE_URL=http://127.0.0.1:9000/v1 python main.py
+    python benchmarks/load_test.py --concurrency 32 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.metrics import percentile  # noqa: E402
+
+
+async def setup(client: httpx.AsyncClient, args) -> tuple:
+    """Create (or reuse) the agent and create the chats to drive"""
+    agent_id = args.agent_id
+    if not agent_id:
+        resp = await client.post("/api/v1/agents/", json={
+            "name": "load-test",
+            "display_name": "Load test",
+            "platform": args.platform,
+            "api_key": args.api_key,
+            "model": args.model,
+        })
+        resp.raise_for_status()
+        agent_id = resp.json()["id"]
+
+    chat_ids = []
+    for i in range(args.chats or args.concurrency):
+        resp = await client.post(f"/api/v1/agents/{agent_id}/chats", json={"name": f"load-test-{i}"})
+        resp.raise_for_status()
+        chat_ids.append(resp.json()["id"])
+    return agent_id, chat_ids
+
+
+async def send_stream(client: httpx.AsyncClient, path: str, payload: dict) -> dict:
+    started = time.perf_counter()
+    ttft = None
+    error = None
+    async with client.stream("POST", path, json=payload) as resp:
+        if resp.status_code != 200:
+            await resp.aread()
+            return {"error": f"HTTP {resp.status_code}"}
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            frame = json.loads(line[6:])
+            if frame.get("content") and ttft is None:
+                ttft = time.perf_counter() - started
+            if frame.get("error"):
+                error = frame["error"]
+            if frame.get("done"):
+                break
+    return {"ttft": ttft, "total": time.perf_counter() - started, "error": error}
+
+
+async def send_once(client: httpx.AsyncClient, path: str, payload: dict) -> dict:
+    started = time.perf_counter()
+    resp = await client.post(path, json=payload)
+    total = time.perf_counter() - started
+    if resp.status_code != 200:
+        return {"error": f"HTTP {resp.status_code}"}
+    # Without streaming the first token arrives with the whole answer
+    return {"ttft": total, "total": total, "error": None}
+
+
+async def worker(worker_id: int, client: httpx.AsyncClient, args, agent_id: str, chat_ids: list, counter: dict, results: list):
+    # Each worker sticks to one chat so turns within a chat stay sequential
+    chat_id = chat_ids[worker_id % len(chat_ids)]
+    suffix = "/stream" if args.stream else ""
+    path = f"/api/v1/agents/{agent_id}/chats/{chat_id}/messages{suffix}"
+    send = send_stream if args.stream else send_once
+
+    while counter["remaining"] > 0:
+        counter["remaining"] -= 1
+        payload = {"role": "user", "content": f"{args.message} ({uuid.uuid4().hex[:6]})"}
+        try:
+            results.append(await send(client, path, payload))
+        except Exception as e:
+            results.append({"error": f"{type(e).__name__}: {e}"})
+
+
+async def server_cpu_seconds(client: httpx.AsyncClient):
+    try:
+        resp = await client.get("/metrics")
+        return resp.json().get("process", {}).get("cpu_seconds")
+    except Exception:
+        return None
+
+
+def report(label: str, values: list) -> None:
+    if not values:
+        print(f"  {label:<14} n/a")
+        return
+    ordered = sorted(values)
+    p50, p95, p99 = (percentile(ordered, p) * 1000 for p in (50, 95, 99))
+    print(f"  {label:<14} p50 {p50:8.1f} ms   p95 {p95:8.1f} ms   p99 {p99:8.1f} ms")
+
+
+async def run(args) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        headers={"X-Wallet-Address": args.wallet},
+        timeout=args.timeout,
+        limits=limits
+    ) as client:
+        agent_id, chat_ids = await setup(client, args)
+        print(f"agent {agent_id}, {len(chat_ids)} chats, concurrency {args.concurrency}, {args.requests} requests")
+
+        cpu_before = await server_cpu_seconds(client)
+        started = time.perf_counter()
+        results: list = []
+        counter = {"remaining": args.requests}
+        await asyncio.gather(*(
+            worker(i, client, args, agent_id, chat_ids, counter, results)
+            for i in range(args.concurrency)
+        ))
+        wall = time.perf_counter() - started
+        cpu_after = await server_cpu_seconds(client)
+
+    ok = [r for r in results if not r.get("error")]
+    errors = [r for r in results if r.get("error")]
+    print(f"\n{len(ok)} ok, {len(errors)} errors in {wall:.2f}s ({len(results) / wall:.1f} req/s)")
+    report("TTFT", [r["ttft"] for r in ok if r.get("ttft") is not None])
+    report("total latency", [r["total"] for r in ok])
+
+    if cpu_before is not None and cpu_after is not None:
+        cpu = cpu_after - cpu_before
+        per_request = cpu / len(results) * 1000 if results else 0.0
+        print(f"  server CPU     {cpu:.2f}s ({cpu / wall * 100:.1f}% of one core, {per_request:.2f} ms/request)")
+    else:
+        print("  server CPU     unavailable (/metrics did not report process CPU)")
+
+    if errors:
+        kinds: dict = {}
+        for r in errors:
+            kinds[r["error"]] = kinds.get(r["error"], 0) + 1
+        print("errors:")
+        for kind, count in sorted(kinds.items(), key=lambda kv: -kv[1])[:10]:
+            print(f"  {count:5d}  {kind[:120]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--wallet", default="0x000000000000000000000000000000000000load")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="total requests across all workers")
+    parser.add_argument("--chats", type=int, default=0, help="chats to spread load over (default: one per worker)")
+    parser.add_argument("--agent-id", help="reuse an existing agent instead of creating one")
+    parser.add_argument("--platform", default="openrouter")
+    parser.add_argument("--model", default="mock-model")
+    parser.add_argument("--api-key", default="mock-key")
+    parser.add_argument("--message", default="Give me a short overview of how caching works")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="use the non-streaming endpoint")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Local OpenAI-compatible mock LLM provider
+
+Streams chat completions the way OpenRouter / Cerebras do (SSE chunks,
+processing comments, finish frame, optional usage frame, [DONE]) with
+configurable latency and failures, so the backend can be load-tested
+without real credits or network access.
+
+Run it, then point the backend at it:
+    python benchmarks/mock_provider.py --port 9000 --ttft-ms 300 --token-delay-ms 20
+    OPENROUTER_BASE_URL=http://127.0.0.1:9000/v1 CEREBRAS_BASE_URL=http://127.0.0.1:9000/v1 python main.py
+
+Options can also be changed at runtime: POST /config with a JSON object of the
+same names (ttft_ms, token_delay_ms, tokens, error_rate, error_status, jitter).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the quick brown fox jumps over the lazy dog while a patient assistant "
+    "explains the answer step by step with enough detail to be useful"
+).split()
+
+config = {
+    "ttft_ms": 300.0,         # delay before the first token
+    "token_delay_ms": 20.0,   # delay between tokens
+    "tokens": 100,            # completion length
+    "error_rate": 0.0,        # share of requests that fail before the first token
+    "error_status": 503,      # status code for failed requests (e.g. 429, 500, 503)
+    "jitter": 0.1,            # +/- relative jitter applied to every delay
+}
+
+app = FastAPI(title="Mock LLM provider")
+
+
+def _delay(ms: float) -> float:
+    jitter = config["jitter"]
+    return max(0.0, ms * random.uniform(1 - jitter, 1 + jitter)) / 1000
+
+
+def _prompt_tokens(messages) -> int:
+    # Rough count, good enough for usage frames
+    return sum(len(str(m.get("content", ""))) // 4 + 4 for m in messages)
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> bytes:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n".encode()
+
+
+async def _stream(body: dict):
+    completion_id = f"mock-{uuid.uuid4().hex[:12]}"
+    model = body.get("model") or "mock-model"
+    tokens = int(config["tokens"])
+
+    yield b": MOCK PROCESSING\n\n"
+    await asyncio.sleep(_delay(config["ttft_ms"]))
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+
+    for i in range(tokens):
+        if i:
+            await asyncio.sleep(_delay(config["token_delay_ms"]))
+        word = WORDS[i % len(WORDS)]
+        yield _chunk(completion_id, model, {"content": word if i == 0 else f" {word}"})
+
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    if (body.get("stream_options") or {}).get("include_usage"):
+        prompt_tokens = _prompt_tokens(body.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage}
+        yield f"data: {json.dumps(payload)}\n\n".encode()
+    yield b"data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+
+    if random.random() < config["error_rate"]:
+        await asyncio.sleep(_delay(config["ttft_ms"]) / 2)
+        headers = {"Retry-After": "1"} if config["error_status"] == 429 else None
+        return JSONResponse({"error": {"message": "mock failure"}}, status_code=config["error_status"], headers=headers)
+
+    if not body.get("stream"):
+        await asyncio.sleep(_delay(config["ttft_ms"] + config["token_delay_ms"] * config["tokens"]))
+        content = " ".join(WORDS[i % len(WORDS)] for i in range(int(config["tokens"])))
+        prompt_tokens = _prompt_tokens(body.get("messages", []))
+        return {
+            "id": f"mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "model": body.get("model") or "mock-model",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": int(config["tokens"]),
+                "total_tokens": prompt_tokens + int(config["tokens"]),
+            },
+        }
+
+    return StreamingResponse(_stream(body), media_type="text/event-stream")
+
+
+@app.post("/config")
+async def update_config(request: Request):
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in config:
+            config[key] = type(config[key])(value)
+    return config
+
+
+@app.get("/config")
+async def get_config():
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    for key, value in config.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    for key in config:
+        config[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from contextlib import asynccontextmanager
 import uvicorn
 import logging
 import os
+import time
 
 from app.api.v1 import agents, marketplace, capsules, wallet, auth, preferences
 from app.core.config import settings
@@ -41,9 +42,16 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"Memory service initialization failed: {e}")
     
+    # Periodic near-duplicate merging for the local memory engine
+    from app.services.memory_compaction_service import memory_compaction_service
+    memory_compaction_service.start()
+    
     yield
     # Shutdown
     logger.info("Shutting down Mantlememo API...")
+    await memory_compaction_service.stop()
+    from app.services import web_search_service
+    await web_search_service.close()
 
 
 app = FastAPI(
@@ -114,6 +122,21 @@ async def health_check():
     return status
 
 
+@app.get("/metrics")
+async def metrics_snapshot():
+    """In-process service metrics (per worker)"""
+    from app.core.metrics import metrics
+    from app.services.provider_router import provider_router
+    from app.services.memory_compaction_service import memory_compaction_service
+    return {
+        **metrics.snapshot(),
+        "providers": provider_router.snapshot(),
+        "memory_compaction": memory_compaction_service.last_run,
+        # CPU seconds used by this worker, for load tests (diff two snapshots)
+        "process": {"pid": os.getpid(), "cpu_seconds": time.process_time()},
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
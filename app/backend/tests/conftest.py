@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# Make the backend importable as `app` (run from app/backend: python -m pytest tests)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def in_memory_cache(monkeypatch):
+    """Run CacheService on its in-memory fallback, emptied for each test"""
+    from app.services import cache_service as module
+
+    monkeypatch.setattr(module.cache_service, "redis_available", False)
+    module._in_memory_cache.clear()
+    module._in_memory_expiry.clear()
+    module._web_search_lru.clear()
+    yield module.cache_service
+    module._in_memory_cache.clear()
+    module._in_memory_expiry.clear()
+    module._web_search_lru.clear()
+
+
+@pytest.fixture
+def anyio_backend():
+    """Async tests (marked anyio) run on asyncio, like the app"""
+    return "asyncio"
@@ -0,0 +1,97 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.api.v1 import agents
+from app.models.schemas import BatchMessageItem, BatchMessageRequest, LLMResponse
+from app.services.batch_service import BatchService
+from app.services.rate_limiter import ProviderBusyError, PRIORITY_BACKGROUND
+
+
+class FakeAgentService:
+    def __init__(self):
+        self.saved = []
+
+    async def get_chat(self, chat_id, wallet_address):
+        return SimpleNamespace(agent_id="agent-1", memory_size="Medium", capsule_id=None, messages=[])
+
+    async def get_agent(self, agent_id, wallet_address):
+        return SimpleNamespace(api_key=None, model="m")
+
+    async def add_message(self, chat_id, message, wallet_address):
+        self.saved.append((chat_id, message.role.value, message.content))
+
+
+class FakeLLMService:
+    def __init__(self, busy_after=None):
+        self.busy_after = busy_after
+        self.admissions = []
+        self.memory_queries = []
+        self.completions = []
+        self.memory_service = SimpleNamespace(_is_available=lambda: True)
+
+    def check_capacity(self, agent_id, agent_config, capsule_id=None, priority=None):
+        self.admissions.append(priority)
+        if self.busy_after is not None and len(self.admissions) > self.busy_after:
+            raise ProviderBusyError("openrouter", 7)
+
+    def retrieve_memory_context(self, agent_id, chat_id, query, memory_size, capsule_id):
+        self.memory_queries.append((chat_id, query))
+        return f"memories for {query}"
+
+    async def get_completion(self, **kwargs):
+        self.completions.append(kwargs)
+        return LLMResponse(content=f"answer to {kwargs['messages'][-1]['content']}", model="m", usage={"total_tokens": 3})
+
+
+def _service(llm):
+    service = BatchService.__new__(BatchService)
+    service.agent_service = FakeAgentService()
+    service.llm_service = llm
+    return service
+
+
+def _items(*pairs):
+    return [BatchMessageItem(chat_id=c, message={"role": "user", "content": m}) for c, m in pairs]
+
+
+@pytest.mark.anyio
+async def test_each_item_gets_its_own_memory_lookup():
+    llm = FakeLLMService()
+    service = _service(llm)
+    items = _items(("c1", "first"), ("c1", "second"), ("c1", "first"), ("c2", "first"))
+    results = [r async for r in service.run("agent-1", items, "wallet")]
+
+    assert results[-1] == {"done": True, "succeeded": 4, "failed": 0}
+    assert sorted(llm.memory_queries) == [("c1", "first"), ("c1", "second"), ("c2", "first")]
+    by_query = {c["messages"][-1]["content"]: c["memory_context"] for c in llm.completions}
+    assert by_query["second"] == "memories for second"
+    assert all(c["priority"] == PRIORITY_BACKGROUND for c in llm.completions)
+
+
+@pytest.mark.anyio
+async def test_items_go_through_provider_admission():
+    llm = FakeLLMService(busy_after=1)
+    service = _service(llm)
+    results = [r async for r in service.run("agent-1", _items(("c1", "a"), ("c1", "b")), "wallet", concurrency=1)]
+
+    assert llm.admissions == [PRIORITY_BACKGROUND, PRIORITY_BACKGROUND]
+    busy = [r for r in results if "retry_after" in r]
+    assert len(busy) == 1 and busy[0]["retry_after"] == 7
+    # Rejected items do no memory search and save nothing
+    assert len(llm.memory_queries) == 1
+    assert len(service.agent_service.saved) == 2
+    assert results[-1] == {"done": True, "succeeded": 1, "failed": 1}
+
+
+@pytest.mark.anyio
+async def test_batch_route_streams_ndjson(monkeypatch):
+    monkeypatch.setattr(agents, "BatchService", lambda: _service(FakeLLMService()))
+    batch = BatchMessageRequest(items=_items(("c1", "a"), ("c2", "b")))
+    response = await agents.send_message_batch("agent-1", batch, wallet_address="wallet")
+
+    lines = [json.loads(line) async for line in response.body_iterator]
+    assert response.media_type == "application/x-ndjson"
+    assert sorted(r["index"] for r in lines[:-1]) == [0, 1]
+    assert lines[-1]["done"] is True
@@ -0,0 +1,36 @@
+import numpy as np
+
+from app.services.embedding_cache import _DiskTier
+
+
+def _vector(value, dim=4):
+    return np.full(dim, value, dtype=np.float32)
+
+
+def test_ring_overwrites_the_oldest_key(tmp_path):
+    tier = _DiskTier(str(tmp_path), dim=4, capacity=2)
+    tier.put_many({"aa" * 16: _vector(1), "bb" * 16: _vector(2)})
+    tier.put_many({"cc" * 16: _vector(3)})
+    assert tier.get("aa" * 16) is None
+    assert tier.get("cc" * 16)[0] == 3
+
+    reopened = _DiskTier(str(tmp_path), dim=4, capacity=2)
+    assert reopened.get("aa" * 16) is None
+    assert reopened.get("bb" * 16)[0] == 2
+    assert reopened.get("cc" * 16)[0] == 3
+
+
+def test_crash_before_the_log_line_never_serves_another_keys_vector(tmp_path):
+    tier = _DiskTier(str(tmp_path), dim=4, capacity=1)
+    tier.put_many({"aa" * 16: _vector(1)})
+    with open(tier._log_path, encoding="utf-8") as f:
+        log = f.read()
+
+    tier.put_many({"bb" * 16: _vector(2)})
+    # Simulate a crash after the row was overwritten but before its log line landed
+    with open(tier._log_path, "w", encoding="utf-8") as f:
+        f.write(log)
+
+    reopened = _DiskTier(str(tmp_path), dim=4, capacity=1)
+    assert reopened.get("aa" * 16) is None
+    assert reopened.get("bb" * 16) is None
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from app.core.config import settings
+from app.services.local_memory import HashingEmbedder, LocalMemory
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return LocalMemory(path=str(tmp_path), embedder=HashingEmbedder(64))
+
+
+def _add(memory, agent, chat, text, capsule=None):
+    metadata = {"agent_id": agent, "chat_id": chat}
+    if capsule:
+        metadata["capsule_id"] = capsule
+    memory.add([{"role": "user", "content": text}], user_id=agent, metadata=metadata)
+
+
+def _texts(results):
+    return sorted(r["memory"] for r in results)
+
+
+def test_memories_are_stored_per_agent_and_capsule(memory):
+    _add(memory, "agent-a", "chat-1", "solar panels on the roof")
+    _add(memory, "agent-a", "chat-2", "solar panel warranty terms", capsule="cap-1")
+    _add(memory, "agent-b", "chat-3", "solar farm permits")
+
+    assert len(os.listdir(memory.path)) == 2
+    assert len(memory._agent_shard_dirs("agent-a")) == 2
+
+    in_capsule = memory.search("solar", "agent-a", {"agent_id": "agent-a", "chat_id": "chat-2", "capsule_id": "cap-1"})
+    assert [r["memory"] for r in in_capsule] == ["user: solar panel warranty terms"]
+    default = memory.search("solar", "agent-a", {"agent_id": "agent-a", "chat_id": "chat-1"})
+    assert [r["memory"] for r in default] == ["user: solar panels on the roof"]
+
+
+def test_least_recently_used_shards_are_closed_and_reopened(memory, monkeypatch):
+    monkeypatch.setattr(settings, "LOCAL_MEMORY_MAX_OPEN_SHARDS", 1)
+    _add(memory, "agent-a", "chat-1", "first agent memory")
+    _add(memory, "agent-b", "chat-2", "second agent memory")
+    assert len(memory._shards) == 1
+
+    results = memory.get_all({"user_id": "agent-a", "chat_id": "chat-1"})
+    assert _texts(results) == ["user: first agent memory"]
+    assert len(memory._shards) == 1
+
+
+def test_deleting_an_agent_or_capsule_drops_its_shards(memory):
+    _add(memory, "agent-a", "chat-1", "kept in the default shard")
+    _add(memory, "agent-a", "chat-2", "capsule memory", capsule="cap-1")
+    _add(memory, "agent-b", "chat-3", "other agent capsule memory", capsule="cap-1")
+
+    assert memory.delete_capsule("cap-1") == 2
+    assert len(memory._agent_shard_dirs("agent-a")) == 1
+    assert memory.get_all({"user_id": "agent-b"}) == []
+
+    assert memory.delete({"user_id": "agent-a"}) == {"deleted": 1}
+    assert not os.path.exists(memory._agent_dir("agent-a"))
+
+
+def test_deleting_a_chat_only_removes_its_rows(memory):
+    _add(memory, "agent-a", "chat-1", "first chat")
+    _add(memory, "agent-a", "chat-2", "second chat")
+
+    assert memory.delete({"user_id": "agent-a", "chat_id": "chat-1"}) == {"deleted": 1}
+    assert _texts(memory.get_all({"user_id": "agent-a"})) == ["user: second chat"]
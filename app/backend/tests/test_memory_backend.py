@@ -0,0 +1,39 @@
+import pytest
+
+from app.core.config import settings
+from app.services import memory_service as module
+
+
+class FakeMem0:
+    embedding_model = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls()
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    monkeypatch.setattr(settings, "MEM0_API_KEY", None)
+    monkeypatch.setattr(module, "get_local_memory", lambda: "local-engine")
+
+
+def test_auto_prefers_installed_open_source_mem0(backends, monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_BACKEND", "auto")
+    monkeypatch.setattr(module, "Memory", FakeMem0)
+    service = module.MemoryService()
+    assert isinstance(service.memory, FakeMem0)
+    assert not service.use_local
+
+
+def test_auto_falls_back_to_local_engine_without_mem0(backends, monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_BACKEND", "auto")
+    monkeypatch.setattr(module, "Memory", None)
+    service = module.MemoryService()
+    assert service.memory == "local-engine" and service.use_local
+
+
+def test_local_backend_skips_mem0(backends, monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_BACKEND", "local")
+    monkeypatch.setattr(module, "Memory", FakeMem0)
+    assert module.MemoryService().use_local
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from app.api.v1 import agents
+from app.services import memory_service as module
+from app.services.local_memory import HashingEmbedder, LocalMemory
+from app.services.memory_service import MemoryService
+
+
+def _service(memory, use_local=False):
+    service = MemoryService.__new__(MemoryService)
+    service.memory = memory
+    service.use_platform = False
+    service.use_local = use_local
+    return service
+
+
+@pytest.fixture
+def local_service(tmp_path):
+    memory = LocalMemory(path=str(tmp_path), embedder=HashingEmbedder(64))
+    for i in range(5):
+        memory.add([{"role": "user", "content": f"memory {i}"}], user_id="agent-1",
+                   metadata={"agent_id": "agent-1", "chat_id": "chat-1"})
+    memory.add([{"role": "user", "content": "another chat"}], user_id="agent-1",
+               metadata={"agent_id": "agent-1", "chat_id": "chat-2"})
+    return _service(memory, use_local=True)
+
+
+def _all_pages(service, limit):
+    pages, cursor = [], None
+    while True:
+        page = service.list_chat_memories("agent-1", "chat-1", cursor=cursor, limit=limit)
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if not cursor:
+            return pages
+
+
+def test_cursor_pages_cover_every_memory_once_with_an_exact_count(local_service):
+    pages = _all_pages(local_service, limit=2)
+    assert [len(p["memories"]) for p in pages] == [2, 2, 1]
+    assert all(p["total"] == 5 for p in pages)
+    assert [m["memory"] for p in pages for m in p["memories"]] == [f"user: memory {i}" for i in range(5)]
+
+
+def test_cursor_survives_deleting_the_last_memory_of_a_page(local_service):
+    first = local_service.list_chat_memories("agent-1", "chat-1", limit=2)
+    last_id = first["memories"][-1]["id"]
+    for shard in local_service.memory._shards.values():
+        if last_id in shard._row_by_id:
+            shard.delete_rows([shard._row_by_id[last_id]])
+
+    second = local_service.list_chat_memories("agent-1", "chat-1", cursor=first["next_cursor"], limit=2)
+    assert [m["memory"] for m in second["memories"]] == ["user: memory 2", "user: memory 3"]
+    assert second["total"] == 4
+
+
+def test_malformed_cursor_is_rejected(local_service):
+    with pytest.raises(ValueError):
+        local_service.list_chat_memories("agent-1", "chat-1", cursor="not-a-cursor")
+
+
+class FakeMem0:
+    def __init__(self, ids):
+        self.stored = {memory_id: {"id": memory_id, "memory": f"text {memory_id}"} for memory_id in ids}
+
+    def get(self, memory_id):
+        return self.stored.get(memory_id)
+
+
+def test_open_source_mem0_pages_over_the_memory_id_index(in_memory_cache):
+    ids = [f"m{i}" for i in range(5)]
+    in_memory_cache.add_memory_ids("agent-1", "chat-1", None, ids)
+    service = _service(FakeMem0(ids))
+
+    pages = _all_pages(service, limit=3)
+    assert [m["id"] for p in pages for m in p["memories"]] == ids
+    assert pages[0]["total"] == 5
+
+
+@pytest.mark.anyio
+async def test_export_streams_ndjson_with_the_count_up_front(local_service, monkeypatch):
+    async def scope(agent_id, chat_id, wallet_address):
+        return "agent-1", None
+
+    monkeypatch.setattr(agents, "_memory_scope", scope)
+    monkeypatch.setattr(module, "MemoryService", lambda: local_service)
+    monkeypatch.setattr(agents.settings, "MEMORY_PAGE_MAX_SIZE", 2)
+
+    response = await agents.export_chat_memories("agent-1", "chat-1", wallet_address="wallet")
+    body = "".join([chunk async for chunk in response.body_iterator])
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert response.headers["X-Memory-Count"] == "5"
+    assert [m["memory"] for m in lines] == [f"user: memory {i}" for i in range(5)]
@@ -0,0 +1,69 @@
+from app.services.local_memory import HashingEmbedder, LocalMemory
+from app.services.memory_ranking import hybrid_rank, select_memories
+from app.services.memory_service import MemoryService
+
+QUERY = "What is my dog called?"
+RELATED = "user: my dog is called Biscuit\nassistant: Biscuit is a great name"
+UNRELATED = [
+    "user: I prefer jazz over rock\nassistant: Noted",
+    "user: the meeting moved to Thursday\nassistant: Got it",
+]
+
+
+def test_hybrid_rank_drops_unrelated_memories():
+    memories = [
+        {"memory": UNRELATED[0], "score": 0.12},
+        {"memory": RELATED, "score": 0.71},
+        {"memory": UNRELATED[1], "score": 0.05},
+    ]
+    ranked = hybrid_rank(QUERY, memories, min_similarity=0.2)
+    assert [m["memory"] for m in ranked] == [RELATED]
+
+
+def test_hybrid_rank_keeps_lexical_matches_below_min_similarity():
+    memories = [{"memory": UNRELATED[0], "score": 0.05}, {"memory": RELATED, "score": 0.05}]
+    ranked = hybrid_rank(QUERY, memories, min_similarity=0.2)
+    assert [m["memory"] for m in ranked] == [RELATED]
+
+
+def test_select_memories_cutoff_is_relative_to_best():
+    memories = [{"memory": "a", "score": 0.9}, {"memory": "b", "score": 0.5}, {"memory": "c", "score": 0.2}]
+    assert [m["memory"] for m in select_memories(memories, limit=5, min_score=0.5)] == ["a", "b"]
+    assert select_memories([], limit=5) == []
+
+
+def test_local_engine_filters_unrelated_memories(tmp_path):
+    memory = LocalMemory(str(tmp_path), embedder=HashingEmbedder(384))
+    metadata = {"agent_id": "agent-1", "chat_id": "chat-1"}
+    for text in UNRELATED + [RELATED]:
+        user, assistant = text.split("\n")
+        memory.add(
+            messages=[
+                {"role": "user", "content": user.split(": ", 1)[1]},
+                {"role": "assistant", "content": assistant.split(": ", 1)[1]},
+            ],
+            user_id="agent-1",
+            metadata=metadata,
+        )
+    results = memory.search(query=QUERY, user_id="agent-1", metadata=metadata, limit=5)
+    assert [r["memory"] for r in results] == [RELATED]
+
+
+class FakeOpenSourceMem0:
+    """Returns every memory with Chroma's squared L2 distance as "score" (lower is closer)"""
+
+    def search(self, query, user_id, metadata, limit):
+        return {"results": [
+            {"id": "1", "memory": RELATED, "score": 0.6},
+            {"id": "2", "memory": UNRELATED[0], "score": 1.7},
+            {"id": "3", "memory": UNRELATED[1], "score": 1.9},
+        ]}
+
+
+def test_open_source_mem0_filters_unrelated_memories():
+    service = MemoryService.__new__(MemoryService)
+    service.memory = FakeOpenSourceMem0()
+    service.use_platform = False
+    service.use_local = False
+    memories = service.get_chat_memories("agent-1", "chat-1", QUERY, limit=5)
+    assert [m["memory"] for m in memories] == [RELATED]
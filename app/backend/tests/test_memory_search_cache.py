@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from app.core.config import settings
+from app.services.memory_service import MemoryService
+
+
+class FakePlatformMemory:
+    """Stands in for the mem0 Platform client: memories deletable by filter"""
+
+    def __init__(self):
+        self.rows = []
+        self.searches = 0
+
+    def add_row(self, agent_id, chat_id, capsule_id, text):
+        self.rows.append({
+            "memory": text,
+            "score": 1.0,
+            "metadata": {"agent_id": agent_id, "chat_id": chat_id, "capsule_id": capsule_id},
+        })
+
+    def search(self, query, user_id, metadata, limit):
+        self.searches += 1
+        return [
+            dict(row) for row in self.rows
+            if row["metadata"]["agent_id"] == user_id and row["metadata"]["chat_id"] == metadata["chat_id"]
+        ][:limit]
+
+    def delete(self, filters):
+        self.rows = [
+            row for row in self.rows
+            if not all(row["metadata"].get(k if k != "user_id" else "agent_id") == v for k, v in filters.items())
+        ]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_SEARCH_CACHE_ENABLED", True)
+    service = MemoryService.__new__(MemoryService)
+    service.memory = FakePlatformMemory()
+    service.use_platform = True
+    service.use_local = False
+    return service
+
+
+def test_delete_agent_memories_invalidates_cached_searches(service):
+    service.memory.add_row("agent-1", "chat-1", None, "The user's dog is called Biscuit")
+    assert service.get_chat_memories("agent-1", "chat-1", "dog name?", limit=3)
+    assert service.get_chat_memories("agent-1", "chat-1", "dog name?", limit=3)
+    assert service.memory.searches == 1
+
+    assert service.delete_agent_memories("agent-1")
+
+    assert service.get_chat_memories("agent-1", "chat-1", "dog name?", limit=3) == []
+    assert service.memory.searches == 2
+
+
+def test_delete_capsule_memories_invalidates_cached_searches(service):
+    service.memory.add_row("agent-1", "chat-1", "capsule-1", "The user's dog is called Biscuit")
+    assert service.get_chat_memories("agent-1", "chat-1", "dog name?", limit=3, capsule_id="capsule-1")
+
+    assert service.delete_capsule_memories("capsule-1")
+
+    assert service.get_chat_memories("agent-1", "chat-1", "dog name?", limit=3, capsule_id="capsule-1") == []
+
+
+def test_local_engine_searches_are_not_cached(service):
+    service.use_platform = False
+    service.use_local = True
+    service.memory.add_row("agent-1", "chat-1", None, "The user's dog is called Biscuit")
+    service.get_chat_memories("agent-1", "chat-1", "dog name?", limit=3)
+    service.get_chat_memories("agent-1", "chat-1", "dog name?", limit=3)
+    assert service.memory.searches == 2
+
+
+def test_memory_generations_are_read_together(in_memory_cache):
+    assert in_memory_cache.get_memory_generations("agent-1", "chat-1", "capsule-1") == (0, 0, 0)
+    in_memory_cache.bump_memory_generation("agent-1", "chat-1")
+    in_memory_cache.bump_memory_scope_generation("capsule", "capsule-1")
+    assert in_memory_cache.get_memory_generations("agent-1", "chat-1", "capsule-1") == (1, 0, 1)
+    assert in_memory_cache.get_memory_generations("agent-1", "chat-1") == (1, 0, 0)
+
+
+def test_memory_index_keeps_concurrent_updates(in_memory_cache):
+    def store(i):
+        in_memory_cache.add_memory_ids("agent-1", f"chat-{i}", "capsule-1", [f"mem-{i}"])
+
+    threads = [threading.Thread(target=store, args=(i,)) for i in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(in_memory_cache.get_memory_indexed_chats("agent-1")) == 50
+    assert len(in_memory_cache.get_capsule_memory_indexed_chats("capsule-1")) == 50
+
+    in_memory_cache.delete_memory_index("agent-1", "chat-0")
+    assert "chat-0" not in in_memory_cache.get_memory_indexed_chats("agent-1")
+    assert ["agent-1", "chat-0"] not in in_memory_cache.get_capsule_memory_indexed_chats("capsule-1")
+    assert in_memory_cache.get_memory_ids("agent-1", "chat-0") == []
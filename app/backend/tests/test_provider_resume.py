@@ -0,0 +1,63 @@
+import pytest
+
+from app.services.provider_router import _skip_repeated_prefix
+
+EMITTED = "The capital of France is Paris. It lies on the Seine"
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def resumed(emitted, *chunks):
+    return "".join([c async for c in _skip_repeated_prefix(stream(*chunks), emitted)])
+
+
+@pytest.mark.anyio
+async def test_continuation_sharing_leading_characters_is_kept():
+    assert await resumed("a", "and then", " more") == "and then more"
+    assert await resumed(EMITTED, " river", " in the north.") == " river in the north."
+    assert await resumed(EMITTED, "The end.") == "The end."
+
+
+@pytest.mark.anyio
+async def test_restarted_answer_is_stripped():
+    assert await resumed(EMITTED, "The capital of ", "France is Paris. It lies on the Seine", " river.") == " river."
+
+
+@pytest.mark.anyio
+async def test_repeated_last_sentence_is_stripped():
+    assert await resumed(EMITTED, "It lies on the ", "Seine river.") == " river."
+
+
+@pytest.mark.anyio
+async def test_pending_text_is_flushed_when_the_stream_ends():
+    # Still a possible restatement when the stream ends
+    assert await resumed(EMITTED, "The capital") == "The capital"
+    assert await resumed(EMITTED, "It lies on the Seine") == ""
+
+
+@pytest.mark.anyio
+async def test_router_resumes_a_broken_stream_from_the_partial_answer(monkeypatch):
+    import httpx
+
+    from app.core.config import settings
+    from app.services.provider_router import ProviderRouter
+
+    monkeypatch.setattr(settings, "PROVIDER_FAILOVER_ENABLED", False)
+    monkeypatch.setattr(settings, "PROVIDER_STREAM_RESUME_ENABLED", True)
+    monkeypatch.setattr(settings, "PROVIDER_RETRY_BASE_DELAY_MS", 1)
+    requests = []
+
+    async def open_stream(provider, messages, model, api_key):
+        requests.append(messages)
+        if len(requests) == 1:
+            yield "The capital of France"
+            raise httpx.ReadError("connection reset")
+        # Restarts the answer instead of continuing it
+        yield "The capital of France is Paris."
+
+    chunks = [c async for c in ProviderRouter().stream("openrouter", "m", "key", [{"role": "user", "content": "?"}], open_stream)]
+    assert "".join(chunks) == "The capital of France is Paris."
+    assert requests[1][-1] == {"role": "assistant", "content": "The capital of France"}
@@ -0,0 +1,100 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services.provider_router import ProviderRouter, Route, backoff_delay_seconds
+
+MESSAGES = [{"role": "user", "content": "?"}]
+OPENROUTER_MODEL = "meta-llama/llama-3.1-8b-instruct"
+
+
+@pytest.fixture(autouse=True)
+def routing(monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_FAILOVER_ENABLED", True)
+    monkeypatch.setattr(settings, "PROVIDER_HEDGING_ENABLED", False)
+    monkeypatch.setattr(settings, "PROVIDER_RETRY_MAX_ATTEMPTS", 0)
+    monkeypatch.setattr(settings, "CEREBRAS_API_KEY", "server-cerebras-key")
+
+
+def _status_error(status, headers=None):
+    request = httpx.Request("POST", "https://example.test")
+    return httpx.HTTPStatusError("failed", request=request, response=httpx.Response(status, headers=headers, request=request))
+
+
+async def _collect(router, open_stream):
+    return "".join([c async for c in router.stream("openrouter", OPENROUTER_MODEL, "agent-key", MESSAGES, open_stream)])
+
+
+@pytest.mark.anyio
+async def test_fails_over_to_the_equivalent_model_before_the_first_token():
+    calls = []
+
+    async def open_stream(provider, messages, model, api_key):
+        calls.append((provider, model, api_key))
+        if provider == "openrouter":
+            raise _status_error(503)
+        yield "from cerebras"
+
+    assert await _collect(ProviderRouter(), open_stream) == "from cerebras"
+    assert calls == [
+        ("openrouter", OPENROUTER_MODEL, "agent-key"),
+        ("cerebras", "llama3.1-8b", "server-cerebras-key"),
+    ]
+
+
+@pytest.mark.anyio
+async def test_client_errors_do_not_fail_over():
+    calls = []
+
+    async def open_stream(provider, messages, model, api_key):
+        calls.append(provider)
+        raise _status_error(400)
+        yield
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await _collect(ProviderRouter(), open_stream)
+    assert calls == ["openrouter"]
+
+
+def test_unhealthy_primary_is_tried_second():
+    router = ProviderRouter()
+    primary = Route("openrouter", OPENROUTER_MODEL, "agent-key")
+    for _ in range(5):
+        router.record_error(primary, _status_error(503))
+    routes = router.candidates("openrouter", OPENROUTER_MODEL, "agent-key")
+    assert [r.provider for r in routes] == ["cerebras", "openrouter"]
+
+
+def test_no_alternate_without_a_server_key_for_it(monkeypatch):
+    monkeypatch.setattr(settings, "CEREBRAS_API_KEY", "")
+    routes = ProviderRouter().candidates("openrouter", OPENROUTER_MODEL, "agent-key")
+    assert [r.provider for r in routes] == ["openrouter"]
+
+
+@pytest.mark.anyio
+async def test_hedge_wins_over_a_slow_primary_and_the_primary_is_closed(monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_HEDGING_ENABLED", True)
+    monkeypatch.setattr(settings, "PROVIDER_HEDGE_MIN_DELAY_MS", 10)
+    monkeypatch.setattr(settings, "PROVIDER_HEDGE_DEFAULT_DELAY_MS", 10)
+    closed = []
+
+    async def open_stream(provider, messages, model, api_key):
+        try:
+            if provider == "openrouter":
+                await asyncio.sleep(5)
+            yield f"from {provider}"
+        finally:
+            closed.append(provider)
+
+    assert await _collect(ProviderRouter(), open_stream) == "from cerebras"
+    assert sorted(closed) == ["cerebras", "openrouter"]
+
+
+def test_backoff_honours_retry_after_up_to_the_ceiling(monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_RETRY_BASE_DELAY_MS", 100)
+    monkeypatch.setattr(settings, "PROVIDER_RETRY_MAX_DELAY_MS", 4000)
+    assert 0.05 <= backoff_delay_seconds(1) <= 0.1
+    assert backoff_delay_seconds(1, _status_error(429, {"Retry-After": "2"})) >= 2
+    assert backoff_delay_seconds(1, _status_error(429, {"Retry-After": "30"})) is None
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app.api.v1 import agents
+from app.core.config import settings
+from app.services.rate_limiter import (
+    ProviderRateLimiter, ProviderBusyError, PRIORITY_CAPSULE, PRIORITY_DEFAULT, PRIORITY_BACKGROUND
+)
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """One request in flight per key, one waiter queued, no token limits"""
+    monkeypatch.setattr(settings, "PROVIDER_KEY_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "PROVIDER_KEY_TOKENS_PER_MINUTE", 0)
+    monkeypatch.setattr(settings, "OPENROUTER_MAX_CONCURRENCY", 0)
+    monkeypatch.setattr(settings, "OPENROUTER_TOKENS_PER_MINUTE", 0)
+    monkeypatch.setattr(settings, "PROVIDER_QUEUE_MAX_SIZE", 1)
+    monkeypatch.setattr(settings, "PROVIDER_QUEUE_TIMEOUT_SECONDS", 5)
+    return ProviderRateLimiter()
+
+
+async def _hold(limiter, release: asyncio.Event, priority=PRIORITY_DEFAULT, order=None, name=None):
+    async with limiter.slot("openrouter", "key", 0, priority):
+        if order is not None:
+            order.append(name)
+        await release.wait()
+
+
+@pytest.mark.anyio
+async def test_full_queue_fails_admission_with_retry_after(limiter):
+    release = asyncio.Event()
+    holder = asyncio.ensure_future(_hold(limiter, release))
+    waiter = asyncio.ensure_future(_hold(limiter, release))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(ProviderBusyError) as error:
+        limiter.check_admission("openrouter", "key", PRIORITY_DEFAULT)
+    assert error.value.retry_after >= 1
+    # Other API keys have their own queue
+    limiter.check_admission("openrouter", "other-key", PRIORITY_DEFAULT)
+
+    release.set()
+    await asyncio.gather(holder, waiter)
+    limiter.check_admission("openrouter", "key", PRIORITY_DEFAULT)
+
+
+@pytest.mark.anyio
+async def test_higher_priority_preempts_a_queued_background_request(limiter):
+    release = asyncio.Event()
+    order = []
+    holder = asyncio.ensure_future(_hold(limiter, release))
+    await asyncio.sleep(0.01)
+    background = asyncio.ensure_future(_hold(limiter, release, PRIORITY_BACKGROUND, order, "background"))
+    await asyncio.sleep(0.01)
+    capsule = asyncio.ensure_future(_hold(limiter, release, PRIORITY_CAPSULE, order, "capsule"))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(ProviderBusyError, match="preempted"):
+        await background
+    release.set()
+    await asyncio.gather(holder, capsule)
+    assert order == ["capsule"]
+
+
+@pytest.mark.anyio
+async def test_queue_wait_times_out(limiter, monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_QUEUE_TIMEOUT_SECONDS", 0.05)
+    release = asyncio.Event()
+    holder = asyncio.ensure_future(_hold(limiter, release))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(ProviderBusyError, match="queue timeout"):
+        await _hold(limiter, release)
+    release.set()
+    await holder
+    # The timed-out waiter left no queue entry behind
+    assert all(not l.waiters for l in limiter._limiters.values())
+
+
+def test_busy_error_maps_to_503_with_retry_after():
+    error = agents._provider_busy(ProviderBusyError("cerebras", 12))
+    assert error.status_code == 503
+    assert error.headers == {"Retry-After": "12"}
@@ -0,0 +1,61 @@
+import pytest
+
+from app.core.config import settings
+from app.services import embedding_service
+from app.services.response_cache_service import ResponseCacheService, response_cache_key
+
+PROMPT = [{"role": "user", "content": "What is the capital of France?"}]
+
+
+def test_exact_key_is_scoped_to_the_agent():
+    assert response_cache_key("agent-1", "openrouter", "m", PROMPT) != response_cache_key("agent-2", "openrouter", "m", PROMPT)
+
+
+@pytest.mark.anyio
+async def test_exact_tier_does_not_serve_another_agents_answer(in_memory_cache, monkeypatch):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SEMANTIC_ENABLED", False)
+    cache = ResponseCacheService()
+    await cache.store("agent-1", "openrouter", "m", PROMPT, "Paris", ttl_seconds=60)
+    assert await cache.lookup("agent-1", "openrouter", "m", PROMPT) == "Paris"
+    assert await cache.lookup("agent-2", "openrouter", "m", PROMPT) is None
+
+
+@pytest.mark.anyio
+async def test_semantic_tier_matches_the_closest_question(in_memory_cache, monkeypatch):
+    vectors = {
+        "what is the capital of france?": [1.0, 0.0, 0.0],
+        "capital city of france?": [0.9, 0.1, 0.0],
+        "how tall is everest?": [0.0, 0.0, 2.0],
+    }
+
+    async def embed_texts(texts):
+        return [vectors[t] for t in texts]
+
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SEMANTIC_ENABLED", True)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SIMILARITY_THRESHOLD", 0.9)
+    monkeypatch.setattr(embedding_service, "is_available", lambda: True)
+    monkeypatch.setattr(embedding_service, "embed_texts", embed_texts)
+    cache = ResponseCacheService()
+    await cache.store("agent-1", "openrouter", "m", PROMPT, "Paris", ttl_seconds=60)
+    everest = [{"role": "user", "content": "How tall is Everest?"}]
+    await cache.store("agent-1", "openrouter", "m", everest, "8849 m", ttl_seconds=60)
+
+    similar = [{"role": "user", "content": "Capital city of France?"}]
+    assert await cache.lookup("agent-1", "openrouter", "m", similar) == "Paris"
+    assert await cache.lookup("agent-2", "openrouter", "m", similar) is None
+
+
+def test_policy_is_cached_in_process_until_invalidated(in_memory_cache, monkeypatch):
+    reads = []
+    real_get = in_memory_cache.get_agent_response_cache_policy
+    monkeypatch.setattr(in_memory_cache, "get_agent_response_cache_policy", lambda a: reads.append(a) or real_get(a))
+    cache = ResponseCacheService()
+    in_memory_cache.set_agent_response_cache_policy("agent-1", {"enabled": True, "ttl_seconds": 60})
+
+    assert cache.get_policy("agent-1") == {"enabled": True, "ttl_seconds": 60}
+    in_memory_cache.set_agent_response_cache_policy("agent-1", {"enabled": False, "ttl_seconds": 60})
+    assert cache.get_policy("agent-1")["enabled"] is True
+    assert len(reads) == 1
+
+    cache.invalidate_policy("agent-1")
+    assert cache.get_policy("agent-1")["enabled"] is False
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app.services.streaming import coalesce_chunks
+
+
+async def _source(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def _collect(gen):
+    return [frame async for frame in gen]
+
+
+@pytest.mark.anyio
+async def test_first_frame_is_not_held_for_the_interval():
+    async def source():
+        yield "Hi"
+        await asyncio.sleep(0.05)
+        yield "there"
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    frames = coalesce_chunks(source(), flush_interval_ms=10_000, flush_bytes=10_000)
+    assert await frames.__anext__() == "Hi"
+    assert loop.time() - started < 1
+    assert [f async for f in frames] == ["there"]
+
+
+@pytest.mark.anyio
+async def test_small_chunks_are_merged_until_the_size_limit():
+    async def source():
+        yield "Hi"
+        await asyncio.sleep(0.02)
+        for chunk in ["a", "b", "c", "d", "e"]:
+            await asyncio.sleep(0)
+            yield chunk
+
+    frames = await _collect(coalesce_chunks(source(), flush_interval_ms=10_000, flush_bytes=3))
+    assert frames[0] == "Hi"
+    assert "".join(frames) == "Hiabcde"
+    assert all(len(f) >= 3 for f in frames[1:-1])
+    assert len(frames) < 6
+
+
+@pytest.mark.anyio
+async def test_interval_flushes_a_buffer_below_the_size_limit():
+    async def source():
+        yield "first"
+        await asyncio.sleep(0.02)
+        yield "x"
+        await asyncio.sleep(0.3)
+        yield "y"
+
+    frames = await _collect(coalesce_chunks(source(), flush_interval_ms=50, flush_bytes=1000))
+    assert frames == ["first", "x", "y"]
+
+
+@pytest.mark.anyio
+async def test_zero_limits_pass_chunks_through():
+    frames = await _collect(coalesce_chunks(_source(["a", "b", "c"]), flush_interval_ms=0, flush_bytes=0))
+    assert frames == ["a", "b", "c"]
+
+
+@pytest.mark.anyio
+async def test_source_errors_surface_after_buffered_text():
+    async def failing():
+        yield "partial"
+        raise RuntimeError("upstream broke")
+
+    received = []
+    with pytest.raises(RuntimeError, match="upstream broke"):
+        async for frame in coalesce_chunks(failing(), flush_interval_ms=1000, flush_bytes=1000):
+            received.append(frame)
+    assert "".join(received) == "partial"
@@ -0,0 +1,45 @@
+import pytest
+
+from app.services.streaming import SSEDecoder, iter_sse_data, parse_delta_content, parse_chunk
+
+
+def test_decoder_handles_events_split_across_chunks():
+    decoder = SSEDecoder()
+    assert decoder.feed(b'data: {"a"') == []
+    assert decoder.feed(b':1}\n') == []
+    assert decoder.feed(b'\ndata: two\r\n\r\n') == [b'{"a":1}', b"two"]
+
+
+def test_decoder_joins_multiline_data_and_skips_comments_and_other_fields():
+    decoder = SSEDecoder()
+    events = decoder.feed(b": keep-alive\n\nevent: message\nid: 3\ndata: line1\ndata:line2\n\n")
+    assert events == [b"line1\nline2"]
+
+
+def test_flush_returns_an_unterminated_final_event():
+    decoder = SSEDecoder()
+    assert decoder.feed(b"data: last") == []
+    assert decoder.flush() == [b"last"]
+    assert decoder.flush() == []
+
+
+@pytest.mark.anyio
+async def test_iter_sse_data_stops_at_done():
+    async def body():
+        yield b"data: one\n\ndata: [DO"
+        yield b"NE]\n\ndata: after\n\n"
+
+    assert [d async for d in iter_sse_data(body())] == [b"one"]
+
+
+def test_parse_delta_content():
+    assert parse_delta_content(b'{"choices":[{"delta":{"content":"Hi"}}]}') == "Hi"
+    assert parse_delta_content(b'{"choices":[{"delta":{"role":"assistant"}}]}') is None
+    assert parse_delta_content(b'{"choices":[{"delta":{"content":""}}]}') is None
+    with pytest.raises(ValueError):
+        parse_delta_content(b'{"content": ')
+
+
+def test_parse_chunk_skips_payloads_without_content_or_usage():
+    assert parse_chunk(b'{"choices":[{"finish_reason":"stop"}]}') == (None, None)
+    assert parse_chunk(b'{"choices":[{"delta":{"content":"x"}}],"usage":{}}') == ("x", None)
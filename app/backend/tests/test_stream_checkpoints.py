@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.services.stream_checkpoint_service import (
+    StreamCheckpointService, COMPLETED, INTERRUPTED, STALE, STREAMING
+)
+
+
+@pytest.fixture(autouse=True)
+def checkpoints(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_CHECKPOINT_ENABLED", True)
+    monkeypatch.setattr(settings, "STREAM_CHECKPOINT_INTERVAL_MS", 100)
+    monkeypatch.setattr(settings, "STREAM_RESUME_GRACE_SECONDS", 0.05)
+
+
+async def _follow(service, message_id, offset=0, stream=None):
+    return [frame async for frame in service.follow(message_id, offset, stream=stream)]
+
+
+@pytest.mark.anyio
+async def test_originating_client_gets_an_answer_that_finished_before_it_followed():
+    service = StreamCheckpointService()
+
+    async def produce(stream):
+        stream.append("Hello ")
+        stream.append("world")
+        await stream.finish(COMPLETED, usage={"total_tokens": 2})
+
+    stream = service.start("chat-1", "wallet", produce)
+    await asyncio.wait_for(asyncio.shield(stream._producer), timeout=1)
+
+    frames = await _follow(service, stream.message_id, stream=stream)
+    assert "".join(f.get("content", "") for f in frames) == "Hello world"
+    assert frames[-1] == {"done": True, "status": COMPLETED, "usage": {"total_tokens": 2}}
+
+
+@pytest.mark.anyio
+async def test_reconnecting_client_resumes_from_its_offset():
+    service = StreamCheckpointService()
+    release = asyncio.Event()
+
+    async def produce(stream):
+        stream.append("Hello ")
+        await release.wait()
+        stream.append("world")
+        await stream.finish(COMPLETED)
+
+    stream = service.start("chat-1", "wallet", produce)
+    await asyncio.sleep(0)
+    resumed = asyncio.ensure_future(_follow(service, stream.message_id, offset=3))
+    await asyncio.sleep(0.01)
+    release.set()
+
+    frames = await asyncio.wait_for(resumed, timeout=1)
+    assert "".join(f.get("content", "") for f in frames) == "lo world"
+    checkpoint = service.get_checkpoint(stream.message_id, "chat-1", "wallet")
+    assert checkpoint["status"] == COMPLETED and checkpoint["content"] == "Hello world"
+    assert service.get_checkpoint(stream.message_id, "chat-1", "someone-else") is None
+
+
+@pytest.mark.anyio
+async def test_generation_stops_when_nobody_resumes_within_the_grace_period():
+    service = StreamCheckpointService()
+
+    async def produce(stream):
+        stream.append("partial")
+        await asyncio.Event().wait()
+
+    stream = service.start("chat-1", "wallet", produce)
+    frames = service.follow(stream.message_id, stream=stream)
+    assert await frames.__anext__() == {"content": "partial"}
+    await frames.aclose()
+
+    await asyncio.wait_for(asyncio.shield(stream._producer), timeout=1)
+    checkpoint = service.get_checkpoint(stream.message_id, "chat-1", "wallet")
+    assert checkpoint["status"] == INTERRUPTED and checkpoint["content"] == "partial"
+
+
+@pytest.mark.anyio
+async def test_other_workers_follow_through_the_saved_checkpoint(in_memory_cache):
+    service = StreamCheckpointService()
+    in_memory_cache.set_stream_checkpoint("m-1", {
+        "message_id": "m-1", "chat_id": "chat-1", "wallet_address": "wallet",
+        "content": "Hello world", "status": COMPLETED, "usage": None, "updated_at": time.time(),
+    })
+
+    frames = await _follow(service, "m-1", offset=6)
+    assert frames == [{"content": "world"}, {"done": True, "status": COMPLETED, "usage": None}]
+
+
+def test_checkpoint_left_streaming_by_a_dead_worker_is_stale(in_memory_cache):
+    in_memory_cache.set_stream_checkpoint("m-1", {
+        "message_id": "m-1", "chat_id": "chat-1", "wallet_address": "wallet",
+        "content": "Hel", "status": STREAMING,
+        "updated_at": time.time() - settings.STREAM_CHECKPOINT_STALE_SECONDS - 1,
+    })
+    checkpoint = StreamCheckpointService().get_checkpoint("m-1", "chat-1", "wallet")
+    assert checkpoint["status"] == STALE
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.api.v1 import agents
+from app.core.config import settings
+from app.services.stream_checkpoint_service import stream_checkpoint_service, INTERRUPTED
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+@pytest.fixture
+def fast_disconnect(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_DISCONNECT_POLL_MS", 50)
+    monkeypatch.setattr(settings, "STREAM_RESUME_GRACE_SECONDS", 0)
+
+
+@pytest.mark.anyio
+async def test_disconnect_during_a_stall_cancels_generation(fast_disconnect):
+    async def produce(stream):
+        stream.append("Hello")
+        await asyncio.Event().wait()  # provider stalls
+
+    stream = stream_checkpoint_service.start("chat-1", "wallet", produce)
+    request = FakeRequest()
+    frames = agents._follow_stream(request, "chat-1", stream.message_id, announce=True, stream=stream)
+    assert "message_id" in await frames.__anext__()
+    assert "Hello" in await frames.__anext__()
+
+    request.disconnected = True
+    with pytest.raises(StopAsyncIteration):
+        await asyncio.wait_for(frames.__anext__(), timeout=1)
+
+    await asyncio.wait_for(asyncio.shield(stream._producer), timeout=1)
+    assert stream.status == INTERRUPTED
+
+
+@pytest.mark.anyio
+async def test_connected_client_gets_every_frame(fast_disconnect):
+    async def produce(stream):
+        stream.append("a")
+        await asyncio.sleep(0.12)  # longer than the poll interval
+        stream.append("b")
+        await stream.finish("completed")
+
+    stream = stream_checkpoint_service.start("chat-1", "wallet", produce)
+    frames = [f async for f in agents._follow_stream(FakeRequest(), "chat-1", stream.message_id, stream=stream)]
+    assert frames[:2] == [agents.sse_event({"content": "a"}), agents.sse_event({"content": "b"})]
+    assert '"done": true' in frames[-1]
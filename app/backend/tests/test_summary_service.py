@@ -0,0 +1,63 @@
+import pytest
+
+from app.core.config import settings
+from app.services.summary_service import (
+    SummaryService, conversation_turns, messages_after_summary
+)
+
+
+def chat(turns, system_every=None):
+    messages = [{"role": "system", "content": "Be brief"}]
+    for i in range(turns):
+        messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i}"})
+        if system_every and i % system_every == 0:
+            messages.append({"role": "system", "content": f"note {i}"})
+    return messages
+
+
+def test_messages_after_summary_counts_turns_and_keeps_system_messages():
+    messages = chat(6, system_every=2)
+    remaining = messages_after_summary(messages, 4)
+    assert [m["content"] for m in conversation_turns(remaining)] == ["turn 4", "turn 5"]
+    assert [m["content"] for m in remaining if m["role"] == "system"] == ["Be brief", "note 0", "note 2", "note 4"]
+
+
+@pytest.mark.anyio
+async def test_refresh_boundary_matches_history_slicing(in_memory_cache, monkeypatch):
+    monkeypatch.setattr(settings, "SUMMARY_ENABLED", True)
+    monkeypatch.setattr(settings, "SUMMARY_KEEP_RECENT_MESSAGES", 8)
+    monkeypatch.setattr(settings, "SUMMARY_REFRESH_EVERY_TURNS", 4)
+    service = SummaryService()
+    messages = chat(20, system_every=3)
+    summarized = []
+
+    async def complete(prompt):
+        summarized.append(prompt[1]["content"])
+        return "They talked about turns"
+
+    await service.schedule_refresh("chat-1", messages, complete)
+
+    summary = service.get_summary("chat-1")
+    assert summary["message_count"] == 12
+    assert "turn 11" in summarized[0] and "turn 12" not in summarized[0]
+    # The history sent next to the summary starts right after the summarized turns
+    history = conversation_turns(messages_after_summary(messages, summary["message_count"]))
+    assert history[0]["content"] == "turn 12" and len(history) == 8
+
+
+@pytest.mark.anyio
+async def test_refresh_waits_until_enough_new_turns(in_memory_cache, monkeypatch):
+    monkeypatch.setattr(settings, "SUMMARY_ENABLED", True)
+    monkeypatch.setattr(settings, "SUMMARY_KEEP_RECENT_MESSAGES", 8)
+    monkeypatch.setattr(settings, "SUMMARY_REFRESH_EVERY_TURNS", 4)
+
+    calls = []
+
+    async def complete(prompt):
+        calls.append(prompt)
+        return "Too early"
+
+    # 10 turns (plus system notes): only 2 past the 8 kept verbatim
+    await SummaryService().schedule_refresh("chat-1", chat(10, system_every=1), complete)
+    assert calls == []
+    assert SummaryService().get_summary("chat-1") is None
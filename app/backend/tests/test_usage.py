@@ -0,0 +1,26 @@
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1 import agents
+from app.services.streaming import parse_chunk
+
+
+def test_parse_chunk_reads_usage_from_the_final_chunk():
+    assert parse_chunk(b'{"choices":[{"delta":{"content":"Hi"}}],"usage":null}') == ("Hi", None)
+    usage = {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15}
+    assert parse_chunk(b'{"choices":[],"usage":{"prompt_tokens":12,"completion_tokens":3,"total_tokens":15}}') == (None, usage)
+
+
+def test_record_usage_adds_to_agent_and_chat_totals(in_memory_cache):
+    in_memory_cache.record_usage("agent-1", "chat-1", {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15})
+    in_memory_cache.record_usage("agent-1", None, {"total_tokens": 7, "estimated": True})
+    agent = in_memory_cache.get_agent_usage("agent-1")
+    assert agent["requests"] == 2 and agent["total_tokens"] == 22 and agent["estimated_requests"] == 1
+    assert in_memory_cache.get_chat_usage("chat-1")["total_tokens"] == 15
+
+
+@pytest.mark.anyio
+async def test_chat_usage_requires_a_wallet():
+    with pytest.raises(HTTPException) as error:
+        await agents.get_chat_usage("agent-1", "chat-1", wallet_address=None)
+    assert error.value.status_code == 401
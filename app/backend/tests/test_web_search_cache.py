@@ -0,0 +1,29 @@
+import time
+
+
+def _result(context):
+    return {"context": context, "expires_at": time.time() + 60}
+
+
+def test_fallback_keeps_at_most_max_entries(in_memory_cache):
+    for i in range(5):
+        in_memory_cache.set_web_search_result(f"q{i}", _result(f"r{i}"), 60, max_entries=3)
+    assert in_memory_cache.get_web_search_result("q0") is None
+    assert in_memory_cache.get_web_search_result("q1") is None
+    assert [in_memory_cache.get_web_search_result(f"q{i}")["context"] for i in (2, 3, 4)] == ["r2", "r3", "r4"]
+
+
+def test_fallback_evicts_the_least_recently_read_entry(in_memory_cache):
+    for i in range(3):
+        in_memory_cache.set_web_search_result(f"q{i}", _result(f"r{i}"), 60, max_entries=3)
+    in_memory_cache.get_web_search_result("q0")
+    in_memory_cache.set_web_search_result("q3", _result("r3"), 60, max_entries=3)
+    assert in_memory_cache.get_web_search_result("q0")["context"] == "r0"
+    assert in_memory_cache.get_web_search_result("q1") is None
+
+
+def test_rewriting_an_entry_does_not_count_twice(in_memory_cache):
+    for _ in range(3):
+        in_memory_cache.set_web_search_result("q", _result("r"), 60, max_entries=2)
+    in_memory_cache.set_web_search_result("other", _result("o"), 60, max_entries=2)
+    assert in_memory_cache.get_web_search_result("q")["context"] == "r"